@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+""" Benchmark the conversion of synthetic wheels.
+
+For each of the wheel shapes in :data:`wheelgen.SHAPES`, this
+converts the wheel with :meth:`humpty.EggWriter.build_egg` several
+times, each in a fresh interpreter, and records the wall time, peak
+RSS, bytes read and written, and files written per second.
+
+The results are written as JSON.  Pass the results of an earlier run
+to ``--compare`` to print a comparison.
+
+"""
+from __future__ import absolute_import, print_function
+
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import click
+
+import wheelgen
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+TOPDIR = os.path.dirname(HERE)
+
+
+def read_proc_io():
+    """ Read the I/O counters of this process, if possible.
+    """
+    try:
+        with open('/proc/self/io') as fp:
+            counters = dict(line.split(': ') for line in fp)
+    except (IOError, OSError):
+        return None
+    return int(counters['rchar']), int(counters['wchar'])
+
+
+def peak_rss_kb():
+    try:
+        import resource
+    except ImportError:         # pragma: NO COVER
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        maxrss //= 1024         # bytes, not kilobytes
+    return maxrss
+
+
+def count_files(egg):
+    if os.path.isdir(egg):
+        return sum(len(filenames) for _, _, filenames in os.walk(egg))
+    from zipfile import ZipFile
+    zf = ZipFile(egg)
+    try:
+        return len(zf.namelist())
+    finally:
+        zf.close()
+
+
+def egg_size(egg):
+    if os.path.isdir(egg):
+        return sum(os.path.getsize(os.path.join(dirpath, fn))
+                   for dirpath, _, filenames in os.walk(egg)
+                   for fn in filenames)
+    return os.path.getsize(egg)
+
+
+def run_one(wheel, destdir, options):
+    """ Convert a wheel, and print measurements as JSON.
+
+    This is run in a child process.
+    """
+    import logging
+    from humpty import EggWriter
+
+    logging.getLogger('humpty').setLevel(logging.ERROR)
+
+    io_before = read_proc_io()
+    start = time.time()
+    with EggWriter(wheel, **options) as writer:
+        egg = writer.build_egg(destdir, force=True)
+    elapsed = time.time() - start
+    io_after = read_proc_io()
+
+    files = count_files(egg)
+    result = {
+        'seconds': elapsed,
+        'peak_rss_kb': peak_rss_kb(),
+        'bytes_read': None,
+        'bytes_written': None,
+        'files': files,
+        'files_per_sec': files / elapsed if elapsed else None,
+        'wheel_size': os.path.getsize(wheel),
+        'egg_size': egg_size(egg),
+        }
+    if io_before is not None and io_after is not None:
+        result['bytes_read'] = io_after[0] - io_before[0]
+        result['bytes_written'] = io_after[1] - io_before[1]
+    print(json.dumps(result))
+
+
+def run_python(script, *args):
+    """ Run ``script`` in a fresh interpreter, returning its last line
+    of output.
+
+    On Linux, the peak RSS of a process survives ``exec``, so
+    anything memory hungry is done in a child process, in order to
+    keep the peak RSS of this process (which is inherited by every
+    child) small.
+
+    """
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([HERE, TOPDIR] + sys.path)
+    output = subprocess.check_output(
+        [sys.executable, '-c', script] + list(args), env=env)
+    return output.decode('utf-8').splitlines()[-1]
+
+
+def build_wheel(shape, scale, destdir):
+    script = ("import sys, wheelgen\n"
+              "wheel = wheelgen.SHAPES[sys.argv[1]](float(sys.argv[2]))\n"
+              "print(wheel.build(sys.argv[3]))\n")
+    return run_python(script, shape, repr(scale), destdir)
+
+
+def measure(wheel, destdir, options):
+    script = ("import sys, json, bench_convert\n"
+              "bench_convert.run_one(sys.argv[1], sys.argv[2],"
+              " json.loads(sys.argv[3]))\n")
+    return json.loads(
+        run_python(script, wheel, destdir, json.dumps(options)))
+
+
+def summarize(runs):
+    best = min(runs, key=lambda run: run['seconds'])
+    times = sorted(run['seconds'] for run in runs)
+    summary = dict(best)
+    summary['median_seconds'] = times[len(times) // 2]
+    rss = [run['peak_rss_kb'] for run in runs if run['peak_rss_kb']]
+    summary['peak_rss_kb'] = max(rss) if rss else None
+    return summary
+
+
+def git_commit():
+    try:
+        output = subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=TOPDIR,
+            stderr=open(os.devnull, 'wb'))
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return output.decode('ascii').strip()
+
+
+def humpty_version():
+    with open(os.path.join(TOPDIR, 'humpty.py')) as fp:
+        for line in fp:
+            if line.startswith('__version__'):
+                return line.split('=')[1].strip().strip("'")
+
+
+def parse_option(ctx, param, value):
+    options = {}
+    for item in value:
+        key, sep, val = item.partition('=')
+        if not sep:
+            raise click.BadParameter("expected KEY=VALUE, got %r" % item)
+        try:
+            options[key] = json.loads(val)
+        except ValueError:
+            options[key] = val
+    return options
+
+
+def print_comparison(old, new):
+    print("%-20s %12s %12s %8s" % ("shape", "old (s)", "new (s)", "change"),
+          file=sys.stderr)
+    for shape in sorted(new['results']):
+        if shape not in old['results']:
+            continue
+        old_secs = old['results'][shape]['seconds']
+        new_secs = new['results'][shape]['seconds']
+        print("%-20s %12.3f %12.3f %+7.1f%%"
+              % (shape, old_secs, new_secs,
+                 100.0 * (new_secs - old_secs) / old_secs),
+              file=sys.stderr)
+
+
+@click.command()
+@click.option(
+    '-s', '--shape', 'shapes',
+    type=click.Choice(sorted(wheelgen.SHAPES)),
+    multiple=True,
+    help="Benchmark only this shape of wheel.  May be repeated.",
+    )
+@click.option(
+    '-n', '--repeat',
+    type=click.IntRange(1, None),
+    default=3,
+    help="Convert each wheel N times.  Default is 3.",
+    metavar='N',
+    )
+@click.option(
+    '--scale',
+    type=float,
+    default=1.0,
+    help="Scale the size of the synthetic wheels.  Default is 1.",
+    )
+@click.option(
+    '-O', '--writer-option', 'options',
+    multiple=True,
+    callback=parse_option,
+    help="Pass KEY=VALUE (VALUE in JSON) to EggWriter.  May be repeated.",
+    metavar='KEY=VALUE',
+    )
+@click.option(
+    '-o', '--output',
+    type=click.File('w'),
+    default='-',
+    help="Write JSON results to FILE.  Default is stdout.",
+    metavar='FILE',
+    )
+@click.option(
+    '--compare',
+    type=click.File('r'),
+    help="Compare the results to those of an earlier run.",
+    metavar='FILE',
+    )
+def main(shapes, repeat, scale, options, output, compare):
+    """ Benchmark the conversion of synthetic wheels.
+    """
+    workdir = tempfile.mkdtemp(prefix='humpty-bench-')
+    try:
+        results = {}
+        for shape in shapes or sorted(wheelgen.SHAPES):
+            wheel = build_wheel(shape, scale, workdir)
+            destdir = os.path.join(workdir, 'dist')
+            runs = [measure(wheel, destdir, options) for i in range(repeat)]
+            results[shape] = summarize(runs)
+            print("%-20s %8.3fs" % (shape, results[shape]['seconds']),
+                  file=sys.stderr)
+            os.unlink(wheel)
+            shutil.rmtree(destdir)
+    finally:
+        shutil.rmtree(workdir)
+
+    report = {
+        'humpty_version': humpty_version(),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'scale': scale,
+        'repeat': repeat,
+        'options': options,
+        'results': results,
+        }
+    json.dump(report, output, indent=2, sort_keys=True)
+    output.write('\n')
+
+    if compare is not None:
+        print_comparison(json.load(compare), report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+""" Measure the startup time of humpty.
+
+This times, in fresh interpreters, ``import humpty`` and ``humpty
+--help``, net of the startup time of a bare interpreter.  The exit
+status is non-zero if the median time to import humpty exceeds
+``--max-ms``.
+
+"""
+from __future__ import absolute_import, print_function
+
+import json
+import os
+import subprocess
+import sys
+import time
+
+import click
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+SCRIPTS = [
+    ('python', "pass"),
+    ('import', "import humpty"),
+    ('help', "import humpty; humpty.main(['--help'])"),
+    ]
+
+
+def time_script(script, env):
+    devnull = open(os.devnull, 'wb')
+    try:
+        start = time.time()
+        subprocess.check_call([sys.executable, '-c', script],
+                              env=env, stdout=devnull)
+        return time.time() - start
+    finally:
+        devnull.close()
+
+
+def median(values):
+    values = sorted(values)
+    n = len(values)
+    return (values[(n - 1) // 2] + values[n // 2]) / 2.0
+
+
+@click.command()
+@click.option(
+    '-n', '--repeat',
+    type=click.IntRange(1, None),
+    default=20,
+    help="Number of times to run each script.  Default is 20.",
+    metavar='N',
+    )
+@click.option(
+    '--max-ms',
+    type=float,
+    help="Fail if importing humpty takes longer than this.",
+    metavar='MS',
+    )
+def main(repeat, max_ms):
+    """ Measure the startup time of humpty.
+    """
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([os.path.dirname(HERE)] + sys.path)
+
+    # Warm up (and write byte-code, if allowed)
+    for name, script in SCRIPTS:
+        time_script(script, env)
+
+    times = dict((name, []) for name, script in SCRIPTS)
+    for i in range(repeat):
+        for name, script in SCRIPTS:
+            times[name].append(time_script(script, env))
+
+    baseline = median(times['python'])
+    results = {
+        'python': sys.version.split()[0],
+        'repeat': repeat,
+        'baseline_ms': round(baseline * 1000, 1),
+        }
+    for name, script in SCRIPTS[1:]:
+        results['%s_ms' % name] = round(
+            (median(times[name]) - baseline) * 1000, 1)
+    print(json.dumps(results, indent=2, sort_keys=True))
+
+    if max_ms is not None and results['import_ms'] > max_ms:
+        sys.exit("Importing humpty took %.1fms (limit %.1fms)"
+                 % (results['import_ms'], max_ms))
+
+
+if __name__ == '__main__':
+    main()
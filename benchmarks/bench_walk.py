@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+""" Benchmark the listing of an unpacked wheel.
+
+This builds a synthetic tree, ``--width`` directories wide at each
+of ``--depth`` levels with ``--files`` files in each directory, and
+times :meth:`humpty.EggWriter.walk_unpacked` over it.  (The walk is
+what ``EggWriter`` does, after installing the wheel, when not
+streaming.)
+
+"""
+from __future__ import absolute_import, print_function
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import click
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from humpty import EggWriter    # noqa: E402
+
+
+def build_tree(root, width, depth, files):
+    """ Build the synthetic tree.  Returns the number of files.
+    """
+    count = 0
+    level = [root]
+    for i in range(depth):
+        next_level = []
+        for dirpath in level:
+            for j in range(files):
+                open(os.path.join(dirpath, 'mod%d.py' % j), 'w').close()
+                count += 1
+            for j in range(width):
+                subdir = os.path.join(dirpath, 'pkg%d' % j)
+                os.mkdir(subdir)
+                next_level.append(subdir)
+        level = next_level
+    return count
+
+
+@click.command()
+@click.option(
+    '--width',
+    type=click.IntRange(1, None),
+    default=8,
+    help="Subdirectories per directory.  Default is 8.",
+    metavar='N',
+    )
+@click.option(
+    '--depth',
+    type=click.IntRange(1, None),
+    default=4,
+    help="Levels of subdirectories.  Default is 4.",
+    metavar='N',
+    )
+@click.option(
+    '--files',
+    type=click.IntRange(0, None),
+    default=20,
+    help="Files per directory.  Default is 20.",
+    metavar='N',
+    )
+@click.option(
+    '-n', '--repeat',
+    type=click.IntRange(1, None),
+    default=5,
+    help="Walk the tree N times.  Default is 5.",
+    metavar='N',
+    )
+def main(width, depth, files, repeat):
+    """ Benchmark the listing of an unpacked wheel.
+    """
+    root = tempfile.mkdtemp(prefix='humpty-bench-')
+    try:
+        count = build_tree(root, width, depth, files)
+        times = []
+        for i in range(repeat):
+            start = time.time()
+            listed = sum(1 for item in EggWriter.walk_unpacked(root))
+            times.append(time.time() - start)
+            assert listed == count
+    finally:
+        shutil.rmtree(root)
+
+    best = min(times)
+    print(json.dumps({
+        'python': sys.version.split()[0],
+        'width': width,
+        'depth': depth,
+        'files': count,
+        'repeat': repeat,
+        'seconds': round(best, 4),
+        'files_per_sec': round(count / best) if best else None,
+        }, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+""" Generate synthetic wheels for benchmarking.
+
+Each of the :data:`SHAPES` is a function which, given a ``scale``
+factor, returns a :class:`WheelBuilder` for a wheel of that shape.
+
+"""
+from __future__ import absolute_import
+
+import base64
+import hashlib
+import os
+from zipfile import ZipFile, ZIP_DEFLATED
+
+from distlib.wheel import COMPATIBLE_TAGS
+
+try:
+    import sysconfig
+except ImportError:            # pragma: NO COVER
+    EXT_SUFFIX = '.so'
+else:
+    EXT_SUFFIX = (sysconfig.get_config_var('EXT_SUFFIX')
+                  or sysconfig.get_config_var('SO'))
+
+MB = 1024 * 1024
+
+MODULE_TEMPLATE = '''\
+""" Module {name}.
+"""
+
+def f{i}(x):
+    return x + {i}
+'''
+
+LOREM = (
+    "Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do "
+    "eiusmod tempor incididunt ut labore et dolore magna aliqua.\n")
+
+
+def record_digest(content):
+    digest = hashlib.sha256(content).digest()
+    return 'sha256=' + base64.urlsafe_b64encode(digest).rstrip(b'=').decode()
+
+
+def platform_tag():
+    """ A binary tag which distlib considers compatible.
+    """
+    for pyver, abi, arch in COMPATIBLE_TAGS:
+        if abi != 'none' and arch != 'any':
+            return '%s-%s-%s' % (pyver, abi, arch)
+    return 'py2.py3-none-any'   # pragma: NO COVER
+
+
+class WheelBuilder(object):
+    """ Accumulate files, then write them out as a wheel.
+    """
+    def __init__(self, name, version='1.0', tag='py2.py3-none-any',
+                 description="A synthetic distribution."):
+        self.name = name
+        self.version = version
+        self.tag = tag
+        self.description = description
+        self.files = []
+        self.top_level = set()
+        self.namespace_packages = set()
+
+    @property
+    def filename(self):
+        return '%s-%s-%s.whl' % (self.name, self.version, self.tag)
+
+    def add(self, path, content):
+        if not isinstance(content, bytes):
+            content = content.encode('utf-8')
+        self.files.append((path, content))
+        top = path.split('/')[0]
+        if '.' not in top or top.endswith('.py'):
+            self.top_level.add(top.split('.')[0])
+
+    def add_module(self, name, i=0):
+        path = name.replace('.', '/') + '.py'
+        self.add(path, MODULE_TEMPLATE.format(name=name, i=i))
+
+    def dist_info(self):
+        yield 'METADATA', (
+            "Metadata-Version: 2.0\n"
+            "Name: %s\n"
+            "Version: %s\n"
+            "Summary: A synthetic wheel\n"
+            "\n"
+            "%s" % (self.name, self.version, self.description))
+        yield 'WHEEL', (
+            "Wheel-Version: 1.0\n"
+            "Generator: humpty-benchmarks\n"
+            "Root-Is-Purelib: %s\n"
+            "Tag: %s\n" % (str(self.tag.endswith('-none-any')).lower(),
+                           self.tag))
+        yield 'top_level.txt', ''.join(
+            '%s\n' % name for name in sorted(self.top_level))
+        if self.namespace_packages:
+            yield 'namespace_packages.txt', ''.join(
+                '%s\n' % name for name in sorted(self.namespace_packages))
+
+    def build(self, destdir):
+        """ Write the wheel to ``destdir``.  Returns its path.
+        """
+        path = os.path.join(destdir, self.filename)
+        info_dir = '%s-%s.dist-info' % (self.name, self.version)
+        records = []
+        zf = ZipFile(path, 'w', ZIP_DEFLATED)
+        try:
+            files = list(self.files)
+            files.extend(('%s/%s' % (info_dir, fn), content)
+                         for fn, content in self.dist_info())
+            for arcname, content in files:
+                if not isinstance(content, bytes):
+                    content = content.encode('utf-8')
+                zf.writestr(arcname, content)
+                records.append('%s,%s,%d\n' % (
+                    arcname, record_digest(content), len(content)))
+            records.append('%s/RECORD,,\n' % info_dir)
+            zf.writestr('%s/RECORD' % info_dir, ''.join(records))
+        finally:
+            zf.close()
+        return path
+
+
+def tiny_files(scale):
+    """ Many small modules.
+    """
+    wheel = WheelBuilder('tiny_files')
+    for i in range(int(5000 * scale)):
+        pkg = 'tiny%d' % (i // 100)
+        if i % 100 == 0:
+            wheel.add('%s/__init__.py' % pkg, '')
+        wheel.add_module('%s.mod%d' % (pkg, i % 100), i)
+    return wheel
+
+
+def huge_files(scale):
+    """ A few large data files, of varying compressibility.
+    """
+    size = int(32 * MB * scale)
+    wheel = WheelBuilder('huge_files')
+    wheel.add('huge/__init__.py', '')
+    wheel.add('huge/random.dat', os.urandom(size))
+    wheel.add('huge/text.dat', (LOREM * (size // len(LOREM) + 1))[:size])
+    mixed = b''.join(os.urandom(512) + b'\0' * 512
+                     for i in range(size // 1024))
+    wheel.add('huge/mixed.dat', mixed)
+    return wheel
+
+
+def deep_namespace(scale):
+    """ A deep tree of namespace packages.
+    """
+    wheel = WheelBuilder('deep_namespace')
+    breadth = max(1, int(3 * scale))
+    depth = 6
+
+    def add_packages(parent, level):
+        for i in range(breadth):
+            name = '%s.ns%d' % (parent, i) if parent else 'ns%d' % i
+            if level < depth:
+                wheel.namespace_packages.add(name)
+                add_packages(name, level + 1)
+            else:
+                wheel.add('%s/__init__.py' % name.replace('.', '/'), '')
+                wheel.add_module('%s.leaf' % name, level)
+    add_packages('', 1)
+    return wheel
+
+
+def many_extensions(scale):
+    """ Many (fake) extension modules.
+    """
+    wheel = WheelBuilder('many_extensions', tag=platform_tag())
+    for i in range(int(500 * scale)):
+        pkg = 'exts%d' % (i // 50)
+        if i % 50 == 0:
+            wheel.add('%s/__init__.py' % pkg, '')
+        wheel.add('%s/ext%d%s' % (pkg, i, EXT_SUFFIX), os.urandom(16384))
+    return wheel
+
+
+def large_metadata(scale):
+    """ A very long description in METADATA.
+    """
+    size = int(4 * MB * scale)
+    description = (LOREM * (size // len(LOREM) + 1))[:size]
+    wheel = WheelBuilder('large_metadata', description=description)
+    wheel.add('large_metadata/__init__.py', '')
+    for i in range(10):
+        wheel.add_module('large_metadata.mod%d' % i, i)
+    return wheel
+
+
+SHAPES = dict((shape.__name__, shape) for shape in [
+    tiny_files,
+    huge_files,
+    deep_namespace,
+    many_extensions,
+    large_metadata,
+    ])
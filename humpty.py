@@ -5,25 +5,52 @@
 """
 from __future__ import absolute_import
 
-from collections import defaultdict
+__version__ = '0.2.1.post1.dev0'
+
+import base64
+import codecs
+import copy
+from collections import defaultdict, deque, OrderedDict
+from contextlib import contextmanager
 import email
-from itertools import chain
+import errno
+import fnmatch
+import hashlib
+from io import BytesIO
+from itertools import chain, cycle
+import json
 import logging
+import marshal
+import multiprocessing
 import os
 import posixpath
-import py_compile
+import re
 import shutil
+import struct
 import sys
 import tempfile
 from textwrap import dedent
-from zipfile import ZipFile, ZIP_DEFLATED
+import time
+import traceback
+import zlib
+from zipfile import (
+    BadZipfile,
+    ZipFile,
+    ZipInfo,
+    ZIP64_LIMIT,
+    ZIP_DEFLATED,
+    ZIP_STORED,
+    sizeFileHeader,
+    stringFileHeader,
+    structFileHeader,
+    )
 
 import click
-from distlib.markers import interpret
+from distlib import DistlibException
+from distlib.compat import detect_encoding
 import distlib.scripts
-from distlib.util import get_export_entry
-from distlib.wheel import Wheel
-import pkg_resources
+from distlib.util import CSVReader, cached_property, get_export_entry
+import six
 from six import binary_type, text_type, PY3
 
 log = logging.getLogger(__name__)
@@ -38,6 +65,27 @@ except ImportError:             # python < 3.4
             root, ext = os.path.splitext(path)
             return root + '.pyc'
 
+try:
+    from importlib.util import MAGIC_NUMBER
+except ImportError:             # python < 3.4
+    from imp import get_magic
+    MAGIC_NUMBER = get_magic()
+
+try:
+    from os import scandir
+except ImportError:             # python < 3.5
+    from scandir import scandir
+
+COPY_BUFSIZE = 1024 * 1024
+
+# 1980-01-01 00:00:00 UTC, the earliest time which a zip file can record
+ZIP_EPOCH = 315532800
+
+# The version of the running python, in the form used in egg names
+PYTHON_VERSION = '%d.%d' % sys.version_info[:2]
+
+DATA_DESCRIPTOR_SIGNATURE = 0x08074b50
+
 try:
     import sysconfig
 except ImportError:            # pragma: NO COVER
@@ -66,8 +114,91 @@ class file_cm(object):
         return getattr(self._fp, name)
 
 
+# Local equivalents of some helpers from pkg_resources.  Importing
+# pkg_resources is slow (it scans all installed distributions), so we
+# only do so when it can not be avoided.
+
+def safe_name(name):
+    """ Equivalent to :func:`pkg_resources.safe_name`.
+    """
+    return re.sub('[^A-Za-z0-9.]+', '-', name)
+
+
+_NORMALIZED_VERSION_RE = re.compile(r"""
+    \A
+    (?:(?:0|[1-9][0-9]*)!)?
+    (?:0|[1-9][0-9]*)(?:\.(?:0|[1-9][0-9]*))*
+    (?:(?:a|b|rc)(?:0|[1-9][0-9]*))?
+    (?:\.post(?:0|[1-9][0-9]*))?
+    (?:\.dev(?:0|[1-9][0-9]*))?
+    (?:\+[a-z0-9]+(?:\.[a-z0-9]+)*)?
+    \Z
+    """, re.VERBOSE)
+
+
+def safe_version(version):
+    """ Equivalent to :func:`pkg_resources.safe_version`.
+
+    Versions which are already in normalized :pep:`440` form (as they
+    are in most wheel file names) are returned unchanged.  Others are
+    handed off to :mod:`pkg_resources`.
+
+    """
+    if _NORMALIZED_VERSION_RE.match(version):
+        return version
+    import pkg_resources
+    return pkg_resources.safe_version(version)
+
+
+def to_filename(name):
+    """ Equivalent to :func:`pkg_resources.to_filename`.
+    """
+    return name.replace('-', '_')
+
+
+def yield_lines(strs):
+    """ Equivalent to :func:`pkg_resources.yield_lines`.
+
+    Yield the non-blank, non-comment lines of a string or of a
+    (possibly nested) sequence of strings.
+
+    """
+    if isinstance(strs, six.string_types):
+        for line in strs.splitlines():
+            line = line.strip()
+            if line and not line.startswith('#'):
+                yield line
+    else:
+        for ss in strs:
+            for line in yield_lines(ss):
+                yield line
+
+
+def split_sections(s):
+    """ Equivalent to :func:`pkg_resources.split_sections`.
+
+    Split a string (or sequence of lines) into ``(section, lines)``
+    pairs.  ``Section`` is ``None`` for any lines preceding the first
+    section header.
+
+    """
+    section = None
+    content = []
+    for line in yield_lines(s):
+        if line.startswith('['):
+            if not line.endswith(']'):
+                raise ValueError("Invalid section heading", line)
+            if section or content:
+                yield section, content
+            section = line[1:-1].strip()
+            content = []
+        else:
+            content.append(line)
+    yield section, content
+
+
 def unsplit_sections(sections):
-    """ This is essentially the inverse of pkg_resources.split_sections.
+    """ This is essentially the inverse of :func:`split_sections`.
     """
     lines = []
     for section, content in sections:
@@ -87,19 +218,468 @@ def bytes_(s, encoding='latin1', errors='strict'):
     return s
 
 
-def _get_requires_json(wheel_metadata):
+def source_date_epoch():
+    """ The timestamp to give to the members of reproducible eggs.
+
+    This is taken from ``$SOURCE_DATE_EPOCH``, if it is set, per the
+    `reproducible builds`_ specification.  Otherwise, or if it is
+    earlier, :data:`ZIP_EPOCH` is used.
+
+    .. _reproducible builds:
+       https://reproducible-builds.org/specs/source-date-epoch/
+
+    """
+    value = os.environ.get('SOURCE_DATE_EPOCH')
+    if not value:
+        return ZIP_EPOCH
+    try:
+        epoch = int(value)
+    except ValueError:
+        raise ValueError("Invalid SOURCE_DATE_EPOCH %r" % value)
+    return max(epoch, ZIP_EPOCH)
+
+
+def zipinfo_mtime(zinfo):
+    """ Get the modification time of a zip member as a unix timestamp.
+    """
+    return time.mktime(zinfo.date_time + (0, 0, -1))
+
+
+def compile_pyc(source, dfile, mtime):
+    """ Byte-compile python source.
+
+    Returns the content of the ``.pyc`` file, complete with header.
+    ``Dfile`` is the source file name to be used in tracebacks.
+    ``Mtime`` is the modification time of the source, to be recorded
+    in the header.
+
+    """
+    code = compile(source, dfile, 'exec', dont_inherit=True)
+    return pyc_header(mtime, len(source)) + marshal.dumps(code)
+
+
+def pyc_arcname(arcname, legacy=False):
+    """ Compute the archive name of the ``.pyc`` for a python source.
+
+    If ``legacy`` is true, the ``.pyc`` goes next to the source, rather
+    than in a :pep:`3147` ``__pycache__`` directory.
+
+    """
+    if legacy:
+        return arcname + 'c'
+    pyc_path = cache_from_source(os.path.join(*arcname.split('/')))
+    return '/'.join(pyc_path.split(os.path.sep))
+
+
+def _compile_job(job):
+    """ Byte-compile a module, possibly in a worker process.
+    """
+    path, source, dfile, mtime = job
+    try:
+        return path, compile_pyc(source, dfile, mtime), None
+    except Exception:
+        return path, None, traceback.format_exc()
+
+
+def pyc_header(mtime, source_size):
+    """ Construct the header for a ``.pyc`` file.
+    """
+    header = [MAGIC_NUMBER]
+    if sys.version_info >= (3, 7):
+        # PEP 552 flags: timestamp-based invalidation
+        header.append(struct.pack('<I', 0))
+    header.append(struct.pack('<I', int(mtime) & 0xFFFFFFFF))
+    if sys.version_info >= (3, 3):
+        header.append(struct.pack('<I', source_size & 0xFFFFFFFF))
+    return b''.join(header)
+
+
+def local_header_size(header, zinfo):
+    """ Compute the size of the local file header of a zip member.
+
+    ``Header`` is the fixed-size part of the header, and ``zinfo`` the
+    :class:`ZipInfo` of the member.  The member's data follows the
+    header.
+
+    """
+    fheader = struct.unpack(structFileHeader, header)
+    if fheader[0] != stringFileHeader:
+        raise ValueError("Bad magic number for file header of %s"
+                         % zinfo.filename)
+    # The file name and extra field follow the fixed-size part
+    return sizeFileHeader + fheader[10] + fheader[11]
+
+
+def iter_raw_member(fp, zinfo, bufsize=COPY_BUFSIZE):
+    """ Iterate over the raw (still compressed) data of a zip member.
+
+    ``Fp`` is the (seekable) file object of the zip archive, and
+    ``zinfo`` the :class:`ZipInfo` of the member.
+
+    """
+    fp.seek(zinfo.header_offset)
+    header_size = local_header_size(fp.read(sizeFileHeader), zinfo)
+    fp.seek(zinfo.header_offset + header_size)
+    remaining = zinfo.compress_size
+    while remaining > 0:
+        chunk = fp.read(min(bufsize, remaining))
+        if not chunk:
+            raise EOFError("Truncated data for %s" % zinfo.filename)
+        remaining -= len(chunk)
+        yield chunk
+
+
+def inflate(chunks, bufsize=COPY_BUFSIZE):
+    """ Inflate raw deflate data, provided as an iterable of chunks.
+
+    The size of each inflated chunk is limited to ``bufsize``, in case
+    the data is highly compressed.
+
+    """
+    decompressor = zlib.decompressobj(-15)
+    for data in chunks:
+        while data:
+            chunk = decompressor.decompress(data, bufsize)
+            data = decompressor.unconsumed_tail
+            if chunk:
+                yield chunk
+    chunk = decompressor.flush()
+    if chunk:
+        yield chunk
+
+
+def file_zipinfo(filename, arcname):
+    """ Construct a :class:`ZipInfo` for a file on disk.
+    """
+    st = os.stat(filename)
+    date_time = time.localtime(st.st_mtime)[:6]
+    zinfo = ZipInfo(arcname, date_time=date_time)
+    zinfo.external_attr = (st.st_mode & 0xFFFF) << 16
+    zinfo.file_size = st.st_size
+    return zinfo
+
+
+class EggZipFile(ZipFile):
+    """ A :class:`ZipFile` which supports writing pre-compressed members.
+
+    Members written with :meth:`write_chunks` or :meth:`write_file`
+    are deflated at ``compress_level`` (zlib's default if ``None``.)
+
+    """
+    def __init__(self, file, mode='r', compression=ZIP_STORED,
+                 compress_level=None):
+        ZipFile.__init__(self, file, mode, compression, allowZip64=True)
+        self.compress_level = compress_level
+
+    def write_raw(self, zinfo, chunks):
+        """ Write a member whose data is already compressed.
+
+        ``Zinfo`` must have its ``compress_type``, ``CRC``,
+        ``compress_size`` and ``file_size`` set to match the raw data,
+        which is provided as an iterable of byte strings in
+        ``chunks``.
+
+        """
+        self._start_member(zinfo)
+        self.fp.write(zinfo.FileHeader())
+        for chunk in chunks:
+            self.fp.write(chunk)
+        self._end_member(zinfo)
+
+    def write_chunks(self, zinfo, chunks):
+        """ Compress and write a member.
+
+        The data is provided as an iterable of byte strings in
+        ``chunks``.  It is compressed according to
+        ``zinfo.compress_type``, which must be either
+        ``ZIP_DEFLATED`` or ``ZIP_STORED``.  ``Zinfo.file_size``
+        should be set to the expected size of the data: it is used to
+        decide whether the member needs ZIP64 extensions.
+
+        If the archive is seekable, the local file header is rewritten
+        once the data has been written.  Otherwise the sizes and CRC
+        follow the data, in a data descriptor.
+
+        """
+        if zinfo.compress_type == ZIP_DEFLATED:
+            level = self.compress_level
+            if level is None:
+                level = zlib.Z_DEFAULT_COMPRESSION
+            compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+        elif zinfo.compress_type == ZIP_STORED:
+            compressor = None
+        else:
+            raise ValueError("Unsupported compression type %r"
+                             % zinfo.compress_type)
+        zip64 = zinfo.file_size * 1.05 > ZIP64_LIMIT
+        seekable = getattr(self, '_seekable', True)
+        if not seekable:
+            zinfo.flag_bits |= 0x08
+
+        self._start_member(zinfo)
+        zinfo.CRC = zinfo.compress_size = zinfo.file_size = 0
+        self.fp.write(zinfo.FileHeader(zip64))
+        crc = file_size = compress_size = 0
+        for chunk in chunks:
+            crc = zlib.crc32(chunk, crc)
+            file_size += len(chunk)
+            if compressor is not None:
+                chunk = compressor.compress(chunk)
+            compress_size += len(chunk)
+            self.fp.write(chunk)
+        if compressor is not None:
+            chunk = compressor.flush()
+            compress_size += len(chunk)
+            self.fp.write(chunk)
+
+        zinfo.CRC = crc & 0xffffffff
+        zinfo.file_size = file_size
+        zinfo.compress_size = compress_size
+        if seekable:
+            end = self.fp.tell()
+            self.fp.seek(zinfo.header_offset)
+            self.fp.write(zinfo.FileHeader(zip64))
+            self.fp.seek(end)
+        else:
+            self.fp.write(struct.pack(
+                '<LLQQ' if zip64 else '<LLLL', DATA_DESCRIPTOR_SIGNATURE,
+                zinfo.CRC, compress_size, file_size))
+        self._end_member(zinfo)
+
+    def write_file(self, filename, arcname, compress_type=None):
+        """ Write the file ``filename`` to the archive as ``arcname``.
+
+        This is like :meth:`ZipFile.write`, but compresses using
+        :meth:`write_chunks`.  Returns the :class:`ZipInfo` of the
+        new member.
+
+        """
+        zinfo = file_zipinfo(filename, arcname)
+        if compress_type is None:
+            compress_type = self.compression
+        zinfo.compress_type = compress_type
+        with open(filename, 'rb') as fp:
+            chunks = iter(lambda: fp.read(COPY_BUFSIZE), b'')
+            self.write_chunks(zinfo, chunks)
+        return zinfo
+
+    def _start_member(self, zinfo):
+        # Zipfile from python >= 3 tracks where the central directory
+        # goes in start_dir; under python 2 it goes at the end of fp.
+        start_dir = getattr(self, 'start_dir', None)
+        if start_dir is not None and getattr(self, '_seekable', True):
+            self.fp.seek(start_dir)
+        zinfo.header_offset = self.fp.tell()
+        self._writecheck(zinfo)
+        self._didModify = True
+
+    def _end_member(self, zinfo):
+        self.filelist.append(zinfo)
+        self.NameToInfo[zinfo.filename] = zinfo
+        if getattr(self, 'start_dir', None) is not None:
+            self.start_dir = self.fp.tell()
+
+
+class EggDirectory(object):
+    """ Write the members of an unpacked egg to the directory ``path``.
+
+    This supports the same writing methods as :class:`EggZipFile`,
+    so either may be passed to :meth:`EggWriter.write_egg`.  The
+    file permissions and modification times are taken from the
+    :class:`ZipInfo` of each member.
+
+    """
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path)
+
+    def close(self):
+        pass
+
+    def write_raw(self, zinfo, chunks):
+        """ Write a member from its compressed data.
+        """
+        if zinfo.compress_type == ZIP_DEFLATED:
+            chunks = inflate(chunks)
+        elif zinfo.compress_type != ZIP_STORED:
+            raise ValueError("Unsupported compression type %r"
+                             % zinfo.compress_type)
+        self.write_chunks(zinfo, chunks)
+
+    def write_chunks(self, zinfo, chunks):
+        """ Write a member.
+
+        The data is provided as an iterable of byte strings in
+        ``chunks``.
+
+        """
+        path = self._member_path(zinfo.filename)
+        size = 0
+        with open(path, 'wb') as fp:
+            for chunk in chunks:
+                fp.write(chunk)
+                size += len(chunk)
+        zinfo.file_size = zinfo.compress_size = size
+        mode = zinfo.external_attr >> 16 & 0o7777
+        if mode:
+            os.chmod(path, mode)
+        mtime = zipinfo_mtime(zinfo)
+        os.utime(path, (mtime, mtime))
+
+    def write_file(self, filename, arcname, compress_type=None):
+        """ Copy the file ``filename`` to the member ``arcname``.
+
+        Returns a :class:`ZipInfo` describing the new member.
+
+        """
+        zinfo = file_zipinfo(filename, arcname)
+        zinfo.compress_size = zinfo.file_size
+        shutil.copy2(filename, self._member_path(arcname))
+        return zinfo
+
+    def _member_path(self, arcname):
+        parts = arcname.split('/')
+        if (not all(parts) or '..' in parts
+                or os.path.isabs(arcname) or ':' in parts[0]):
+            raise ValueError("Bad member name %r" % arcname)
+        path = os.path.join(self.path, *parts)
+        dirname = os.path.dirname(path)
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        return path
+
+
+def marker_context(python_version):
+    """ The environment in which to evaluate markers for an egg
+    targeting ``python_version``.
+
+    This is ``None`` (meaning the running environment) for the running
+    version of python.  Otherwise, the python version variables are
+    overridden.  (The patch level of the target is unknown, so
+    ``python_full_version`` is taken to be ``X.Y.0``.)
+
+    """
+    if python_version is None or python_version == PYTHON_VERSION:
+        return None
+    return {
+        'python_version': python_version,
+        'python_full_version': python_version + '.0',
+        }
+
+
+_marker_cache = {}
+
+MARKER_CACHE_SIZE = 1024
+
+
+def compile_marker(marker):
+    """ Parse an environment marker.
+
+    This returns distlib's parse tree for ``marker``.  The trees are
+    cached by marker string, so that each marker is parsed only once.
+    (Many requirements of a distribution usually share a few
+    markers.)  A :exc:`SyntaxError` is raised, as by
+    :func:`distlib.markers.interpret`, if the marker is invalid.
+
+    Returns ``None`` if distlib can not parse markers separately from
+    evaluating them.
+
+    """
+    try:
+        return _marker_cache[marker]
+    except KeyError:
+        pass
+    try:
+        from distlib.markers import parse_marker
+    except ImportError:         # pragma: NO COVER
+        # distlib < 0.2.5
+        return None
+    try:
+        expr, rest = parse_marker(marker)
+    except Exception as exc:
+        raise SyntaxError("Unable to interpret marker syntax: %s: %s"
+                          % (marker, exc))
+    if rest and rest[0] != '#':
+        raise SyntaxError("unexpected trailing data in marker: %s: %s"
+                          % (marker, rest))
+    if len(_marker_cache) >= MARKER_CACHE_SIZE:
+        _marker_cache.clear()
+    _marker_cache[marker] = expr
+    return expr
+
+
+def evaluate_marker(marker, context=None):
+    """ Evaluate an environment marker in ``context``.
+
+    This is :func:`distlib.markers.interpret`, except that the parse
+    tree of the marker (see :func:`compile_marker`) is reused.
+
+    """
+    expr = compile_marker(marker)
+    if expr is None:            # pragma: NO COVER
+        from distlib.markers import interpret
+        return interpret(marker, context)
+    from distlib.markers import DEFAULT_CONTEXT, evaluator
+    execution_context = dict(DEFAULT_CONTEXT)
+    if context:
+        execution_context.update(context)
+    return evaluator.evaluate(expr, execution_context)
+
+
+def marker_extras(marker):
+    """ Find the extras for which a marker might differ.
+
+    If ``marker`` refers to ``extra`` only in ``==`` and ``!=``
+    comparisons with string literals, this returns the set of those
+    literals.  For any other value of ``extra``, the marker evaluates
+    the same as when no extra is given.  Otherwise (or if the marker
+    can not be parsed) this returns ``None``.
+
+    The marker's cached parse tree is used (see
+    :func:`compile_marker`.)
+
+    """
+    try:
+        expr = compile_marker(marker)
+    except SyntaxError:
+        return None
+    if expr is None:            # pragma: NO COVER
+        return None
+    extras = set()
+
+    def check(expr):
+        if not isinstance(expr, dict):
+            return expr != 'extra'
+        op, lhs, rhs = expr['op'], expr['lhs'], expr['rhs']
+        if 'extra' not in (lhs, rhs):
+            return check(lhs) and check(rhs)
+        other = rhs if lhs == 'extra' else lhs
+        if op not in ('==', '!=') or not isinstance(other, six.string_types) \
+                or other[:1] not in ('"', "'"):
+            return False
+        extras.add(other[1:-1])
+        return True
+
+    if not check(expr):
+        return None
+    return extras
+
+
+def _get_requires_json(wheel_metadata, context=None):
     """ Compute requirements, grouped by extra.
 
     This expects wheel_metadata.run_requires to be in the JSON format
     as described at
     https://www.python.org/dev/peps/pep-0426/#dependencies
 
+    Markers are evaluated in ``context`` (see :func:`marker_context`.)
+
     """
     by_extra = defaultdict(set)
     for req in wheel_metadata.run_requires:
         extra = req.get('extra')
         marker = req.get('environment')
-        if not marker or interpret(marker):
+        if not marker or evaluate_marker(marker, context):
             by_extra[extra].update(req['requires'])
 
     for extra in sorted(by_extra.keys(),
@@ -107,25 +687,46 @@ def _get_requires_json(wheel_metadata):
         yield extra, sorted(by_extra[extra])
 
 
-def _get_requires_rfc822(wheel_metadata):
+def _get_requires_rfc822(wheel_metadata, context=None):
     """ Compute requirements, grouped by extra.
 
     This expects wheel_metadata.run_requires to be a list of strings,
     as when metadata comes from legacy RFC822 formatted metadata.
 
+    Markers are evaluated in ``context`` (see :func:`marker_context`.)
+    Each requirement is split, and its marker parsed (see
+    :func:`compile_marker`), just once.  The marker is evaluated
+    without an extra and, if false, only for the extras which it
+    names (see :func:`marker_extras`.)
+
     """
-    run_requires = wheel_metadata.run_requires
+    extras = wheel_metadata.extras
+    known_extras = set(extras)
 
-    def get_reqs(extra=None):
-        for req in run_requires:
-            assert isinstance(req, text_type)
-            req_, sep, marker = req.rpartition(';')
-            if not sep:
-                yield req
-            elif interpret(marker.lstrip(), {'extra': extra}):
-                yield req_.rstrip()
+    def evaluate(marker, extra):
+        return evaluate_marker(marker, dict(context or {}, extra=extra))
+
+    reqs = []
+    by_extra = defaultdict(list)
+    for req in wheel_metadata.run_requires:
+        assert isinstance(req, text_type)
+        req_, sep, marker = req.rpartition(';')
+        if not sep:
+            reqs.append(req)
+            continue
+        req_, marker = req_.rstrip(), marker.lstrip()
+        if evaluate(marker, None):
+            reqs.append(req_)
+            continue
+        # For extras not named by the marker, it is false, as it was
+        # without an extra
+        named = marker_extras(marker)
+        if named is None:
+            named = extras
+        for extra in named:
+            if extra in known_extras and evaluate(marker, extra):
+                by_extra[extra].append(req_)
 
-    reqs = list(get_reqs())
     if reqs:
         yield None, reqs
 
@@ -134,8 +735,8 @@ def _get_requires_rfc822(wheel_metadata):
     def is_conditional(req):
         return req not in unconditional
 
-    for extra in wheel_metadata.extras:
-        reqs = list(filter(is_conditional, get_reqs(extra)))
+    for extra in extras:
+        reqs = list(filter(is_conditional, by_extra[extra]))
         if reqs:
             yield extra, reqs
 
@@ -147,13 +748,17 @@ class EggInfoBase(object):
     pairs, where each pair represents a metadata file which should be
     written to the packages ``EGG-INFO`` directory.
 
+    The metadata is computed from the wheel just once, when first
+    needed, so the inputs should not be changed after that.
+
     """
     def __init__(self, wheel_metadata, installed_files, metadata_files,
-                 zip_safe=False):
+                 zip_safe=False, marker_context=None):
         self.wheel_metadata = wheel_metadata
         self.installed_files = installed_files
         self.metadata_files = metadata_files
         self.zip_safe = zip_safe
+        self.marker_context = marker_context
 
     def files(self):
         # XXX: dependency_links.txt?
@@ -178,8 +783,13 @@ class EggInfoBase(object):
 
     __iter__ = files
 
-    @property
+    @cached_property
     def pkg_info(self):
+        """ The lines of ``PKG-INFO``.
+        """
+        return list(self._pkg_info())
+
+    def _pkg_info(self):
         index_data = self._get_index_data()
 
         yield "Metadata-Version: 1.1"
@@ -218,7 +828,7 @@ class EggInfoBase(object):
     def namespace_packages(self):  # pragma: NO COVER
         raise NotImplementedError()
 
-    @property
+    @cached_property
     def top_level(self):
         top_level = set()
         for path in self.installed_files:
@@ -233,7 +843,7 @@ class EggInfoBase(object):
             top_level.add(top)
         return sorted(top_level)
 
-    @property
+    @cached_property
     def native_libs(self):
         # wheel (at least as of 0.24.0) does not generate a native_libs.txt
         def is_ext_mod(fn):
@@ -289,17 +899,17 @@ class EggInfo_Legacy(EggInfoBase):
         body = msg.get_payload(decode=True)
         return bytes_(body).decode('utf-8')
 
-    @property
+    @cached_property
     def entry_points(self):
-        sections = pkg_resources.split_sections(
+        sections = split_sections(
             self._read_metadata('entry_points.txt'))
         return [(section, lines) for section, lines in sections if lines]
 
-    @property
+    @cached_property
     def namespace_packages(self):
         return list(self._read_metadata('namespace_packages.txt'))
 
-    @property
+    @cached_property
     def top_level(self):
         # FIXME: maybe depend on wheel version?
         if self._metadata_exists('top_level.txt'):
@@ -308,11 +918,11 @@ class EggInfo_Legacy(EggInfoBase):
             # wheel < 0.10 does not write a top_level.txt
             return super(EggInfo_Legacy, self).top_level
 
-    @property
+    @cached_property
     def eager_resources(self):
         return list(self._read_metadata('eager_resources.txt'))
 
-    @property
+    @cached_property
     def requires(self):
         wheel_metadata = self.wheel_metadata
         is_legacy = wheel_metadata._legacy is not None
@@ -329,14 +939,14 @@ class EggInfo_Legacy(EggInfoBase):
             # in the "JSON" format described by PEP-426.
             get_requires = _get_requires_json
 
-        return list(get_requires(wheel_metadata))
+        return list(get_requires(wheel_metadata, self.marker_context))
 
     def _read_metadata(self, name):
         """ Read a .txt format metadata file from .whl file.
         """
         content = self.metadata_files.get(name, b'')
         content = content.decode('utf-8')
-        return pkg_resources.yield_lines(content)
+        return yield_lines(content)
 
     def _metadata_exists(self, name):
         return name in self.metadata_files
@@ -351,64 +961,411 @@ class EggInfo(EggInfoBase):
     this type, so this code is untested.
 
     """
-    @property
+    @cached_property
     def entry_points(self):
         return [
-            (section, ["%s = %s" % item for item in entries.items()])
-            for section, entries in self.wheel_metadata.exports.items()
+            (section, ["%s = %s" % item for item in sorted(entries.items())])
+            for section, entries in sorted(
+                self.wheel_metadata.exports.items())
             ]
 
-    @property
+    @cached_property
     def namespace_packages(self):
         return self.wheel_metadata.namespaces
 
-    @property
+    @cached_property
     def eager_resources(self):
         # FIXME: not sure what to do.
         return []
 
-    @property
+    @cached_property
     def requires(self):
-        return list(_get_requires_json(self.wheel_metadata))
+        return list(_get_requires_json(self.wheel_metadata,
+                                       self.marker_context))
+
+
+class WheelArchive(object):
+    """ An open wheel archive.
+
+    The archive's central directory is read just once, when the
+    archive is opened.  The list of members and the contents of the
+    ``.dist-info`` directory are cached, so that the archive may be
+    shared by all the steps of a conversion.
+
+    ``Wheel`` is the :class:`distlib.wheel.Wheel` for the archive.
+    The archive is read from the seekable binary file object
+    ``fileobj``, if one is given, otherwise from the file named by
+    ``wheel``.  (In the former case, :attr:`path` is ``None``, and
+    ``fileobj`` is not closed by :meth:`close`.)
+
+    If ``use_mmap`` is true, and the archive is a real file, the
+    archive is memory-mapped.  Raw and stored members are then sliced
+    directly out of the map, without copying, and deflated members
+    are inflated straight from it.
+
+    If :attr:`verify_reads` is set, each member is checked against
+    ``RECORD`` the first time it is read in full (by :meth:`read`,
+    :meth:`iter_content` or :meth:`iter_raw`.)  A
+    :exc:`DistlibException` is raised, once the member has been read,
+    if it does not match.  :meth:`verify` then checks only the
+    members which have not yet been verified.
+
+    If :attr:`verify_digests` is cleared, members are checked only
+    for their presence in ``RECORD`` and their sizes, as given by the
+    zip directory, and for their CRC-32s.  No member is hashed, but
+    deflated members read raw are still inflated, in order to check
+    their CRC-32s.
+
+    """
+    INFLATE_BUFSIZE = 64 * 1024
 
+    verify_reads = False
+    verify_digests = True
 
-def list_installed_files(wheel):
-    wheel_file = os.path.join(wheel.dirname, wheel.filename)
-    info_pfx = "{0.name}-{0.version}.dist-info/".format(wheel)
-    data_pfx = "{0.name}-{0.version}.data/".format(wheel)
-    purelib_pfx = "{0.name}-{0.version}.data/purelib/".format(wheel)
-    platlib_pfx = "{0.name}-{0.version}.data/platlib/".format(wheel)
+    def __init__(self, wheel, fileobj=None, use_mmap=False):
+        self.wheel = wheel
+        self.name = wheel.name
+        self.version = wheel.version
+        self.filename = wheel.filename
 
-    installed = set()
-    with file_cm(ZipFile(wheel_file, 'r')) as zf:
-        for path in zf.namelist():
-            if path.endswith('/'):
-                # directory
-                continue        # pragma: NO COVER
-            elif path.startswith(info_pfx):
-                continue
-            elif path.startswith(purelib_pfx):
-                installed_path = path[len(purelib_pfx):]
-            elif path.startswith(platlib_pfx):
-                installed_path = path[len(platlib_pfx):]
-            elif path.startswith(data_pfx):
+        name_version = '%s-%s' % (wheel.name, wheel.version)
+        self.info_pfx = '%s.dist-info/' % name_version
+        self.data_pfx = '%s.data/' % name_version
+
+        if fileobj is None:
+            self.path = os.path.join(wheel.dirname, wheel.filename)
+            self.fp = open(self.path, 'rb')
+        else:
+            if hasattr(fileobj, 'seekable') and not fileobj.seekable():
+                raise ValueError("The wheel file object must be seekable")
+            self.path = None
+            self.fp = fileobj
+        self.mmap = self.view = None
+        self.verified = set()
+        try:
+            if use_mmap:
+                self._map()
+            self.zipfile = ZipFile(self.fp, 'r')
+        except Exception:
+            self._unmap()
+            if fileobj is None:
+                self.fp.close()
+            raise
+        self.infolist = self.zipfile.infolist()
+        self.namelist = [zinfo.filename for zinfo in self.infolist]
+
+    def _map(self):
+        import mmap
+        try:
+            fileno = self.fp.fileno()
+            self.mmap = mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+        except (AttributeError, EnvironmentError, ValueError) as exc:
+            # E.g. in-memory file objects, or empty files
+            log.debug("Not memory-mapping %s: %s", self.filename, exc)
+            return
+        # Under python 2, slicing the mmap itself is the best we can do
+        self.view = memoryview(self.mmap) if PY3 else self.mmap
+
+    def _unmap(self):
+        if self.mmap is not None:
+            try:
+                if self.view is not self.mmap:
+                    self.view.release()
+                self.mmap.close()
+            except BufferError:
+                # Slices of the map are still referenced (e.g. from
+                # the traceback of a failed conversion.)  The map is
+                # closed when they are garbage collected.
+                log.debug("Not closing the memory map of %s: "
+                          "it is still in use", self.filename)
+            self.mmap = self.view = None
+
+    def close(self):
+        self.zipfile.close()
+        self._unmap()
+        if self.path is not None:
+            self.fp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, typ, inst, tb):
+        self.close()
+
+    def open(self, zinfo):
+        return file_cm(self.zipfile.open(zinfo))
+
+    @cached_property
+    def sha256(self):
+        """ The hex SHA-256 digest of the wheel file.
+        """
+        hasher = hashlib.sha256()
+        if self.view is not None:
+            hasher.update(self.view)
+        else:
+            fp = self.fp
+            fp.seek(0)
+            for chunk in iter(lambda: fp.read(COPY_BUFSIZE), b''):
+                hasher.update(chunk)
+        return hasher.hexdigest()
+
+    def read(self, zinfo):
+        if self._can_slice(zinfo) or self._must_verify(zinfo):
+            return b''.join(self.iter_content(zinfo))
+        return self.zipfile.read(zinfo)
+
+    def iter_raw(self, zinfo, bufsize=COPY_BUFSIZE):
+        """ Iterate over the raw (still compressed) data of a member.
+        """
+        if self.view is None:
+            chunks = iter_raw_member(self.fp, zinfo, bufsize)
+        else:
+            chunks = self._iter_slices(zinfo, bufsize)
+        if self._must_verify(zinfo) \
+                and zinfo.compress_type in (ZIP_STORED, ZIP_DEFLATED):
+            chunks = self._verify_raw(zinfo, chunks)
+        return chunks
+
+    def iter_content(self, zinfo, bufsize=COPY_BUFSIZE):
+        """ Iterate over the (uncompressed) content of a member.
+        """
+        chunks = self._iter_content(zinfo, bufsize)
+        if self._must_verify(zinfo):
+            chunks = self._verify_content(zinfo, chunks)
+        return chunks
+
+    def _iter_content(self, zinfo, bufsize):
+        if not self._can_slice(zinfo):
+            return self._iter_open(zinfo, bufsize)
+        if zinfo.compress_type == ZIP_STORED:
+            chunks = self._iter_slices(zinfo, bufsize)
+        else:
+            chunks = self._iter_inflated(zinfo, bufsize)
+        return self._check_crc(zinfo, chunks)
+
+    def _can_slice(self, zinfo):
+        # Only unencrypted members which we know how to decompress
+        return (self.view is not None
+                and not zinfo.flag_bits & 0x01
+                and zinfo.compress_type in (ZIP_STORED, ZIP_DEFLATED))
+
+    def _iter_open(self, zinfo, bufsize):
+        with self.open(zinfo) as fp:
+            for chunk in iter(lambda: fp.read(bufsize), b''):
+                yield chunk
+
+    def _iter_slices(self, zinfo, bufsize):
+        view = self.view
+        offset = zinfo.header_offset
+        start = offset + local_header_size(
+            view[offset:offset + sizeFileHeader], zinfo)
+        end = start + zinfo.compress_size
+        if end > len(view):
+            raise EOFError("Truncated data for %s" % zinfo.filename)
+        for pos in range(start, end, bufsize):
+            yield view[pos:min(pos + bufsize, end)]
+
+    def _iter_inflated(self, zinfo, bufsize):
+        return inflate(self._iter_slices(zinfo, self.INFLATE_BUFSIZE), bufsize)
+
+    @staticmethod
+    def _check_crc(zinfo, chunks):
+        crc = size = 0
+        for chunk in chunks:
+            crc = zlib.crc32(chunk, crc)
+            size += len(chunk)
+            yield chunk
+        if crc & 0xffffffff != zinfo.CRC or size != zinfo.file_size:
+            raise BadZipfile("Bad CRC-32 for file %r" % zinfo.filename)
+
+    @cached_property
+    def metadata_files(self):
+        return read_metadata_files(self)
+
+    @cached_property
+    def installed_files(self):
+        return list_installed_files(self)
+
+    @cached_property
+    def info(self):
+        """ The contents of the ``WHEEL`` metadata file, as a dict.
+        """
+        content = self.metadata_files['WHEEL'].decode('utf-8')
+        return dict(email.message_from_string(content))
+
+    @cached_property
+    def metadata(self):
+        """ The distribution metadata, as a :class:`distlib.metadata.Metadata`.
+
+        This mimics :attr:`distlib.wheel.Wheel.metadata`, but reads
+        the metadata from the cached ``.dist-info`` contents.
+
+        """
+        from distlib.metadata import Metadata, WHEEL_METADATA_FILENAME
+
+        for fn in (WHEEL_METADATA_FILENAME, 'METADATA'):
+            content = self.metadata_files.get(fn)
+            if content is not None:
+                metadata = Metadata(
+                    fileobj=codecs.getreader('utf-8')(BytesIO(content)))
+                if metadata:
+                    return metadata
+        raise ValueError("Invalid wheel, because metadata is missing")
+
+    def verify(self):
+        """ Verify the sizes and digests of the members against RECORD.
+
+        This is equivalent to :meth:`distlib.wheel.Wheel.verify`,
+        except that members which have already been verified are not
+        checked again.
+
+        """
+        for zinfo in self.infolist:
+            if zinfo.filename in self.verified:
                 continue
+            if self.verify_digests:
+                chunks = self._iter_content(zinfo, COPY_BUFSIZE)
+                for chunk in self._verify_content(zinfo, chunks):
+                    pass
             else:
-                installed_path = path
-            installed.add(installed_path)
+                self._record_digest(zinfo)
+                self.verified.add(zinfo.filename)
+
+    @cached_property
+    def records(self):
+        """ The rows of ``RECORD``, keyed by path.
+        """
+        # Read RECORD directly: it is not itself verified, and the
+        # other metadata files may be verified as they are read.
+        records = {}
+        record = BytesIO(self.zipfile.read(self.info_pfx + 'RECORD'))
+        with CSVReader(stream=record) as reader:
+            for row in reader:
+                records[row[0]] = row
+        return records
+
+    def _must_verify(self, zinfo):
+        return self.verify_reads and zinfo.filename not in self.verified
+
+    def _record_digest(self, zinfo):
+        """ Check a member's path and size against RECORD.
+
+        Returns a ``(hasher, digest)`` pair, where ``digest`` is the
+        digest recorded for the member, or ``None`` if the member's
+        content need not be checked.
+
+        """
+        arcname = zinfo.filename
+        if not isinstance(arcname, text_type):
+            arcname = arcname.decode('utf-8')   # pragma: NO COVER
+        if '..' in arcname.split('/'):
+            raise DistlibException("invalid entry in wheel: %r" % arcname)
+        if arcname.endswith(('/', '/RECORD.jws')):
+            return None, None
+        row = self.records.get(arcname)
+        if row is None:
+            raise DistlibException("no entry in RECORD for %s" % arcname)
+        if row[2] and str(zinfo.file_size) != row[2]:
+            raise DistlibException("size mismatch for %s" % arcname)
+        if not row[1] or not self.verify_digests:
+            return None, None
+        kind, value = row[1].split('=', 1)
+        return hashlib.new(kind), value
+
+    def _verified(self, zinfo, hasher, digest):
+        if hasher is not None and record_digest(hasher) != digest:
+            raise DistlibException("digest mismatch for %s" % zinfo.filename)
+        self.verified.add(zinfo.filename)
+
+    def _verify_content(self, zinfo, chunks):
+        hasher, digest = self._record_digest(zinfo)
+        for chunk in chunks:
+            if hasher is not None:
+                hasher.update(chunk)
+            yield chunk
+        self._verified(zinfo, hasher, digest)
+
+    def _verify_raw(self, zinfo, chunks):
+        hasher, digest = self._record_digest(zinfo)
+        crc = None
+        if hasher is None:
+            # Check the CRC-32 instead, as is done when a member is
+            # inflated.  (Otherwise a raw copy would check nothing.)
+            hasher = crc = _CRC32()
+        if zinfo.compress_type == ZIP_STORED:
+            for chunk in chunks:
+                hasher.update(chunk)
+                yield chunk
+        else:
+            # Inflate the data as it goes by, in order to hash it
+            decompressor = zlib.decompressobj(-15)
+            for chunk in chunks:
+                yield chunk
+                data = chunk
+                while data:
+                    hasher.update(decompressor.decompress(data,
+                                                          COPY_BUFSIZE))
+                    data = decompressor.unconsumed_tail
+            hasher.update(decompressor.flush())
+        if crc is not None:
+            if crc.crc & 0xffffffff != zinfo.CRC \
+                    or crc.size != zinfo.file_size:
+                raise BadZipfile("Bad CRC-32 for file %r" % zinfo.filename)
+            hasher = None
+        self._verified(zinfo, hasher, digest)
+
+
+class _CRC32(object):
+    """ Compute a CRC-32, with the interface of a :mod:`hashlib` hasher.
+    """
+    def __init__(self):
+        self.crc = self.size = 0
+
+    def update(self, data):
+        self.crc = zlib.crc32(data, self.crc)
+        self.size += len(data)
+
+
+def record_digest(hasher):
+    """ Format a digest in the style used by wheel ``RECORD`` files.
+    """
+    digest = base64.urlsafe_b64encode(hasher.digest()).rstrip(b'=')
+    return digest.decode('ascii')
+
+
+def list_installed_files(archive):
+    info_pfx = archive.info_pfx
+    data_pfx = archive.data_pfx
+    purelib_pfx = data_pfx + 'purelib/'
+    platlib_pfx = data_pfx + 'platlib/'
+
+    installed = set()
+    for path in archive.namelist:
+        if path.endswith('/'):
+            # directory
+            continue            # pragma: NO COVER
+        elif path.startswith(info_pfx):
+            continue
+        elif path.startswith(purelib_pfx):
+            installed_path = path[len(purelib_pfx):]
+        elif path.startswith(platlib_pfx):
+            installed_path = path[len(platlib_pfx):]
+        elif path.startswith(data_pfx):
+            continue
+        else:
+            installed_path = path
+        installed.add(installed_path)
     return installed
 
 
-def read_metadata_files(wheel):
-    wheel_file = os.path.join(wheel.dirname, wheel.filename)
-    info_pfx = "{0.name}-{0.version}.dist-info/".format(wheel)
+def read_metadata_files(archive):
+    info_pfx = archive.info_pfx
     metadata_files = {}
-    with file_cm(ZipFile(wheel_file, 'r')) as zf:
-        for path in zf.namelist():
-            if path.startswith(info_pfx) and not path.endswith('/'):
-                with file_cm(zf.open(path)) as fp:
-                    name = path[len(info_pfx):]
-                    metadata_files[name] = fp.read()
+    for zinfo in archive.infolist:
+        path = zinfo.filename
+        if path.startswith(info_pfx) and not path.endswith('/'):
+            name = path[len(info_pfx):]
+            metadata_files[name] = archive.read(zinfo)
     return metadata_files
 
 
@@ -432,17 +1389,18 @@ def get_wheel_version(wheel):
     return tuple(map(int, wheel.info['Wheel-Version'].split('.')))
 
 
-def egg_metadata(wheel, egg_metadata_class=None):
-    if get_wheel_version(wheel) < (1, 1):
+def egg_metadata(archive, egg_metadata_class=None, python_version=None):
+    if get_wheel_version(archive) < (1, 1):
         egg_metadata_class = EggInfo_Legacy
     else:
         egg_metadata_class = EggInfo
 
     return egg_metadata_class(
-        wheel.metadata,
-        installed_files=list_installed_files(wheel),
-        metadata_files=read_metadata_files(wheel),
-        zip_safe=False)
+        archive.metadata,
+        installed_files=archive.installed_files,
+        metadata_files=archive.metadata_files,
+        zip_safe=False,
+        marker_context=marker_context(python_version))
 
 
 class StubLoaders(object):
@@ -452,7 +1410,10 @@ class StubLoaders(object):
 
     An instance of this class is an iterable of ``filename, content``
     pairs, where each pair represents a stub-loader file which should be
-    written to the packages egg.
+    written to the packages egg.  The files should be given a
+    modification time of ``date_time``, to match the timestamps
+    recorded in the byte-compiled stubs.  The stubs are not
+    byte-compiled if ``compile`` is false.
 
     """
     NAMESPACE_STUB = dedent("""
@@ -472,9 +1433,19 @@ class StubLoaders(object):
         __bootstrap__()
         """).lstrip()
 
-    def __init__(self, egg_info, egg_name=''):
+    def __init__(self, egg_info, egg_name='', mtime=None, legacy_pyc=False,
+                 compile=True):
         self.egg_info = egg_info
         self.egg_name = egg_name
+        self.legacy_pyc = legacy_pyc
+        self.compile = compile
+        if mtime is None:
+            mtime = time.time()
+        # Zip files record timestamps with a resolution of two seconds
+        date_time = time.localtime(mtime)[:6]
+        self.date_time = date_time[:5] + (date_time[5] & ~1,)
+        self.mtime = time.mktime(self.date_time + (0, 0, -1))
+        self._code_cache = {}
 
     def __iter__(self):
         # XXX: don't need namespace stubs for py3k, if egg is unpacked,
@@ -486,7 +1457,8 @@ class StubLoaders(object):
 
         for arcname, content in stubs:
             yield arcname, content
-            yield self.byte_compile(arcname, content)
+            if self.compile:
+                yield self.byte_compile(arcname, content)
 
     def namespace_stubs(self):
         """ Create __init__.py for namespace packages
@@ -512,116 +1484,1175 @@ class StubLoaders(object):
                 yield stubname, content
 
     def byte_compile(self, arcname, content):
-        py_path = os.path.join(*arcname.split('/'))
-        pyc_path = cache_from_source(py_path)
-        arcname_pyc = '/'.join(pyc_path.split(os.path.sep))
-
+        arcname_pyc = pyc_arcname(arcname, self.legacy_pyc)
         diagnostic_name = posixpath.join(self.egg_name, arcname)
-        with tempfile.NamedTemporaryFile() as dst:
-            with tempfile.NamedTemporaryFile() as src:
-                src.write(content)
-                src.flush()
-                py_compile.compile(src.name, dst.name, diagnostic_name, True)
-            return arcname_pyc, dst.read()
+        code = self._compile(content, diagnostic_name)
+        pyc = pyc_header(self.mtime, len(content)) + marshal.dumps(code)
+        return arcname_pyc, pyc
+
+    def _compile(self, content, filename):
+        # All namespace stubs have the same source.  Compile it once,
+        # then just change the filename.
+        code = self._code_cache.get(content)
+        if code is None:
+            code = compile(content, filename, 'exec', dont_inherit=True)
+            self._code_cache[content] = code
+        elif code.co_filename != filename:
+            if hasattr(code, 'replace'):
+                code = _rename_code(code, filename)
+            else:               # pragma: NO COVER
+                # python < 3.8
+                code = compile(content, filename, 'exec', dont_inherit=True)
+        return code
+
+
+def _rename_code(code, filename):
+    """ Copy a code object, with a new ``co_filename``.
+
+    The code objects nested in its constants (those of functions and
+    classes) are renamed too.
+    """
+    consts = tuple(
+        _rename_code(const, filename) if isinstance(const, type(code))
+        else const
+        for const in code.co_consts)
+    return code.replace(co_filename=filename, co_consts=consts)
 
 
-class EggWriter(object):
-    def __init__(self, wheel_file):
-        wheel = Wheel(wheel_file)
+def unique_suffix():
+    """ A suffix for temporary file names, unique to this thread.
+    """
+    import threading
+    return '%d.%d' % (os.getpid(), threading.current_thread().ident)
 
-        if not wheel.is_compatible():
-            # Workaround for https://bitbucket.org/pypa/distlib/issues/93
-            log.warning(
-                "WARNING: Distlib reports that %s is not compatible "
-                "with this platform. "
-                "(Note that on some versions of python, "
-                "distlib's detection of compatible ABIs is broken. "
-                "See distlib issue #93.)",
-                wheel_file)
-        wheel.verify()
 
-        self.wheel = wheel
+def replace_file(src, dst):
+    """ Rename ``src`` to ``dst``, replacing ``dst`` if it exists.
+    """
+    if hasattr(os, 'replace'):
+        os.replace(src, dst)
+    else:                       # pragma: NO COVER
+        # python < 3.3
+        if os.name == 'nt' and os.path.exists(dst):
+            os.unlink(dst)
+        os.rename(src, dst)
 
-    def build_egg(self, destdir):
-        wheel = self.wheel
-        outfile = os.path.join(destdir, self.egg_name)
-        egg_info = egg_metadata(wheel)
-        log.warning("Converting %s to %s", wheel.filename, outfile)
 
-        if not os.path.isdir(destdir):
-            log.info("Creating dist directory %s", destdir)
-            os.makedirs(destdir)
+def remove_path(path):
+    """ Remove a file or a directory tree.
+    """
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    else:
+        os.unlink(path)
 
-        with file_cm(ZipFile(outfile, 'w', ZIP_DEFLATED)) as zf:
-            builddir = tempfile.mkdtemp()
-            try:
-                for arcname, filename in self.unpack_wheel(builddir):
-                    zf.write(filename, arcname)
-            finally:
-                shutil.rmtree(builddir)
 
-            stub_loaders = StubLoaders(egg_info, self.egg_name)
-            for arcname, content in stub_loaders:
-                zf.writestr(arcname, content)
+def replace_path(src, dst):
+    """ Rename ``src`` to ``dst``, replacing ``dst`` if it exists.
 
-            for filename, content in egg_info:
-                arcname = 'EGG-INFO/%s' % filename
-                zf.writestr(arcname, content)
+    Unlike :func:`replace_file`, either of ``src`` or ``dst`` may be a
+    directory.  An existing directory is first moved aside, so
+    ``dst`` is missing only momentarily.
 
-        return outfile
+    """
+    if not os.path.lexists(dst):
+        os.rename(src, dst)
+    elif not os.path.isdir(src) and not os.path.isdir(dst):
+        replace_file(src, dst)
+    else:
+        oldpath = '%s.old%s' % (dst, unique_suffix())
+        os.rename(dst, oldpath)
+        try:
+            os.rename(src, dst)
+        except Exception:
+            os.rename(oldpath, dst)
+            raise
+        remove_path(oldpath)
 
-    def unpack_wheel(self, libdir):
-        wheel = self.wheel
-        name_version = '%s-%s' % (wheel.name, wheel.version)
-        data_dir = os.path.join(libdir, '%s.data' % name_version)
-        egginfo_dir = os.path.join(libdir, 'EGG-INFO')
-        paths = {
-            'purelib': libdir,
-            'platlib': libdir,
-            'scripts': os.path.join(egginfo_dir, 'scripts'),
-            }
-        for where in 'prefix', 'headers', 'data':
-            paths[where] = os.path.join(data_dir, where)
 
-        for path in paths.values():
-            if not os.path.isdir(path):
-                log.debug("Creating directory %s", path)
-                os.makedirs(path)
+def link_or_copy(src, dst):
+    """ Hard-link ``src`` to ``dst``, or copy it if that fails.
 
-        maker = ScriptCopyer(None, None)
-        wheel.install(paths, maker, warner=warner)
+    If ``src`` is a directory, each of the files within it is linked
+    (or copied.)  ``Dst`` is replaced atomically if it exists.
 
-        subdirs = [()]
-        while subdirs:
-            path = subdirs.pop(0)
-            for fn in os.listdir(os.path.join(libdir, *path)):
-                topdir = len(path) == 0
-                fpath = path + (fn,)
-                filepath = os.path.join(libdir, *fpath)
-                if os.path.isdir(filepath):
-                    if topdir and fn.lower().endswith('.dist-info'):
-                        # Omit .dist-info directory
+    """
+    tmppath = '%s.tmp%s' % (dst, unique_suffix())
+    try:
+        if os.path.isdir(src):
+            for dirpath, dirnames, filenames in os.walk(src):
+                dstdir = os.path.join(tmppath, os.path.relpath(dirpath, src))
+                os.makedirs(dstdir)
+                for fn in filenames:
+                    _link_or_copy_file(os.path.join(dirpath, fn),
+                                       os.path.join(dstdir, fn))
+        else:
+            _link_or_copy_file(src, tmppath)
+        replace_path(tmppath, dst)
+    finally:
+        # (Renaming a hard link over another link to the same file
+        # succeeds, but leaves it in place.)
+        if os.path.lexists(tmppath):
+            remove_path(tmppath)
+
+
+def _link_or_copy_file(src, dst):
+    try:
+        os.link(src, dst)
+    except (AttributeError, OSError):
+        shutil.copy2(src, dst)
+
+
+@contextmanager
+def ignore_errors(*errnos):
+    """ Suppress ``OSError`` (or ``IOError``) with any of ``errnos``.
+
+    This is for operations which may race with other processes,
+    e.g. those sharing an :class:`EggCache`.
+
+    """
+    try:
+        yield
+    except (IOError, OSError) as exc:
+        if exc.errno not in errnos:
+            raise
+
+
+def path_size(path):
+    """ The total size of the file, or directory tree, at ``path``.
+    """
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(dirpath, fn))
+               for dirpath, dirnames, filenames in os.walk(path)
+               for fn in filenames)
+
+
+class EggCache(object):
+    """ A persistent, size-bounded, cache of built eggs.
+
+    Eggs are stored in ``directory``, under the SHA-256 digest of the
+    wheel they were built from, as ``<directory>/<digest>/<egg_name>``.
+    Both zipped and unpacked (directory) eggs may be cached.
+
+    If ``max_size`` (in bytes) is given, the least recently used eggs
+    are evicted as needed to keep the total size of the cache below
+    that.
+
+    """
+    def __init__(self, directory, max_size=None):
+        self.directory = directory
+        self.max_size = max_size
+
+    def path(self, digest, egg_name):
+        return os.path.join(self.directory, digest, egg_name)
+
+    def get(self, digest, egg_name):
+        """ Get the path to a cached egg, or ``None``.
+        """
+        path = self.path(digest, egg_name)
+        try:
+            # Mark the egg as recently used
+            os.utime(path, None)
+        except (IOError, OSError) as exc:
+            if exc.errno != errno.ENOENT:
+                raise
+            return None
+        return path
+
+    def put(self, egg, digest, retries=3):
+        """ Add an egg to the cache.
+
+        The cache may be shared by concurrent processes.  If another
+        process evicts the egg's directory while the egg is being
+        added, this is retried up to ``retries`` times.
+
+        """
+        path = self.path(digest, os.path.basename(egg))
+        dirname = os.path.dirname(path)
+        for attempt in range(retries + 1):
+            with ignore_errors(errno.EEXIST):
+                os.makedirs(dirname)
+            try:
+                link_or_copy(egg, path)
+                break
+            except (IOError, OSError) as exc:
+                if exc.errno != errno.ENOENT or attempt == retries:
+                    raise
+        with ignore_errors(errno.ENOENT):
+            os.utime(path, None)
+        log.debug("Added %s to cache", path)
+        self.evict()
+
+    # The temporary files of conversions in progress
+    _tmpfile_re = re.compile(r'\.(tmp|old)\d+\.\d+\Z')
+
+    def entries(self):
+        """ List cached eggs as ``(mtime, size, path)``, oldest first.
+
+        Eggs which are concurrently added or evicted may or may not
+        be listed.
+
+        """
+        entries = []
+        for digest in os.listdir(self.directory):
+            dirname = os.path.join(self.directory, digest)
+            if not os.path.isdir(dirname):
+                continue
+            with ignore_errors(errno.ENOENT):
+                for fn in os.listdir(dirname):
+                    if self._tmpfile_re.search(fn):
                         continue
-                    subdirs.append(fpath)
+                    path = os.path.join(dirname, fn)
+                    with ignore_errors(errno.ENOENT):
+                        mtime = os.stat(path).st_mtime
+                        entries.append((mtime, path_size(path), path))
+        return sorted(entries)
+
+    def evict(self):
+        """ Remove least recently used eggs until the cache fits.
+        """
+        if self.max_size is None:
+            return
+        entries = self.entries()
+        total = sum(size for mtime, size, path in entries)
+        for mtime, size, path in entries:
+            if total <= self.max_size:
+                break
+            log.debug("Evicting %s from cache", path)
+            # (Another process may have evicted it already, or be
+            # adding another egg to its directory.)
+            with ignore_errors(errno.ENOENT):
+                remove_path(path)
+            total -= size
+            with ignore_errors(errno.ENOENT, errno.ENOTEMPTY, errno.EEXIST):
+                os.rmdir(os.path.dirname(path))
+
+
+class ConversionCancelled(Exception):
+    """ The conversion was cancelled.  See :meth:`ConversionStats.cancel`.
+    """
+
+
+class ConversionStats(object):
+    """ Timings and counters for the conversion of a wheel.
+
+    ``Times`` maps the name of each phase of the conversion to the
+    number of seconds spent in it.  Phases may nest; time spent in a
+    nested phase is not also charged to the enclosing phase, so the
+    times add up to the :attr:`total`.  ``Counters`` maps the names of
+    counters (e.g. ``files``, ``bytes``) to their counts.
+
+    Pass an instance to :class:`EggWriter` to collect the statistics
+    of a conversion.  Subclasses may override :meth:`phase_started`,
+    :meth:`phase_finished` and :meth:`count` in order to follow the
+    progress of the conversion, and another thread may :meth:`cancel`
+    it.
+
+    """
+    clock = staticmethod(getattr(time, 'perf_counter', time.time))
+
+    cancelled = False
+
+    def __init__(self):
+        self.times = OrderedDict()
+        self.counters = OrderedDict()
+        self._stack = []
+        self._mark = None
+
+    @contextmanager
+    def phase(self, name):
+        """ Time a phase of the conversion.
+        """
+        if self.cancelled:
+            raise ConversionCancelled()
+        self._charge()
+        self._stack.append(name)
+        self.times.setdefault(name, 0.0)
+        start = self._mark
+        self.phase_started(name)
+        try:
+            yield
+        finally:
+            self._charge()
+            self._stack.pop()
+            self.phase_finished(name, self._mark - start)
+
+    def _charge(self):
+        now = self.clock()
+        if self._stack:
+            self.times[self._stack[-1]] += now - self._mark
+        self._mark = now
+
+    def phase_started(self, name):
+        """ Called when a phase starts.
+        """
+
+    def phase_finished(self, name, seconds):
+        """ Called when a phase ends.
+
+        ``Seconds`` is the time elapsed since the phase started,
+        including the time spent in any nested phases.
+
+        """
+
+    def count(self, name, n=1):
+        """ Increment a counter.
+        """
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def cancel(self):
+        """ Abort the conversion.
+
+        This may be called from any thread.  The conversion raises
+        :exc:`ConversionCancelled` when it next starts a phase (at
+        the latest, before writing the next member of the egg), and
+        removes any partially written egg.
+
+        """
+        self.cancelled = True
+
+    @property
+    def total(self):
+        return sum(self.times.values())
+
+    def as_dict(self):
+        """ The statistics, as a (JSON serializable) ``dict``.
+        """
+        return {
+            'seconds': self.total,
+            'phases': dict(self.times),
+            'counters': dict(self.counters),
+            }
+
+
+def format_stats(stats):
+    """ Format the :meth:`ConversionStats.as_dict` of a conversion.
+
+    Returns a list of lines.
+    """
+    lines = ["  %-20s %9.1fms" % ('total', stats['seconds'] * 1000)]
+    for name, seconds in sorted(stats['phases'].items(),
+                                key=lambda item: -item[1]):
+        lines.append("    %-18s %9.1fms" % (name, seconds * 1000))
+    for name, count in sorted(stats['counters'].items()):
+        lines.append("  %-20s %10d" % (name, count))
+    return lines
+
+
+def sum_stats(stats):
+    """ Add up the :meth:`ConversionStats.as_dict` of several
+    conversions.
+    """
+    total = {'seconds': 0.0, 'phases': {}, 'counters': {}}
+    for item in stats:
+        total['seconds'] += item['seconds']
+        for key in 'phases', 'counters':
+            for name, value in item[key].items():
+                total[key][name] = total[key].get(name, 0) + value
+    return total
+
+
+class EggWriter(object):
+    """ Convert a wheel to an egg.
+
+    By default, the contents of the wheel are streamed directly from
+    the wheel archive into the egg.  If ``streaming`` is false, the
+    wheel is instead installed into a temporary directory using
+    distlib's :meth:`Wheel.install <distlib.wheel.Wheel.install>`, and
+    the egg is built from there.
+
+    When streaming, if ``raw_copy`` is true, deflated wheel members
+    which need no changes are copied into the egg without
+    decompressing and recompressing them.
+
+    The wheel archive is held open (as a :class:`WheelArchive`) until
+    :meth:`close` is called.  ``EggWriter`` may also be used as a
+    context manager.
+
+    Each egg records, in ``EGG-INFO/humpty.txt``, the SHA-256 digest
+    of the wheel it was built from, along with the versions of humpty
+    and python used to build it.  :meth:`build_egg` will not rebuild
+    an egg whose record matches.
+
+    If an :class:`EggCache` is passed in ``cache``, eggs are copied
+    from it when possible, and newly built eggs are added to it.
+
+    When streaming, python modules are byte-compiled if ``compile`` is
+    true.  If ``compile`` is ``None`` (the default) they are compiled
+    unless :data:`sys.dont_write_bytecode` is set, as distlib's
+    installer does.  Compilation is done in ``compile_workers``
+    processes.  If ``legacy_pyc`` is true, ``.pyc`` files are placed
+    next to their sources, rather than in ``__pycache__`` directories.
+    (Python 3 can only import the former from a zipped egg.)  Stub
+    loaders are always byte-compiled.
+
+    The members of the egg are compressed according to
+    ``compression``, which is one of the keys of
+    :attr:`COMPRESSION_TYPES`.  When deflating, ``compress_level``
+    (0-9) sets the zlib compression level.  Members whose names end
+    with one of :attr:`STORED_EXTENSIONS` are assumed to be already
+    compressed, and are always stored.  Members are only copied raw
+    from the wheel if their compression matches and no explicit
+    ``compress_level`` has been given.
+
+    If ``unzip`` is true, an unpacked egg (a directory) is built
+    instead of a zip file.
+
+    ``Wheel_file`` is usually the path to the wheel, but it may
+    also be a seekable binary file object, or the contents of the
+    wheel as a ``bytearray``, ``memoryview`` or (under python 3)
+    ``bytes``.  In that case, the wheel's ``filename`` (from which
+    its name, version and tags are parsed) must be given, unless the
+    file object has a ``name``.  Wheels which are not read from a
+    path can only be converted when ``streaming``.  Use
+    :meth:`build_egg_file` to write the egg to a file object rather
+    than to a directory.
+
+    If ``use_mmap`` is true, the wheel is memory-mapped (see
+    :class:`WheelArchive`.)  This can speed up the conversion of
+    large wheels.
+
+    ``Verify`` is one of :attr:`VERIFY_MODES`.  By default
+    (``'full'``), the members of the wheel are checked against the
+    digests in its ``RECORD``.  ``'fast'`` checks only that each
+    member is listed in ``RECORD`` with the right size, relying on
+    the CRC-32 checks of the zip format to catch corruption.
+    ``'none'`` skips verification altogether, for wheels which are
+    trusted: members copied raw from the wheel are then not checked
+    at all, so a corrupt wheel may produce a corrupt egg.  (When not
+    ``streaming``, distlib's installer checks the digests regardless.)
+
+    If ``reproducible`` is true, the egg depends only on the wheel and
+    the build options: its members are written in sorted order, all
+    with the timestamp given by :func:`source_date_epoch`, and with
+    their permissions normalized to ``0644`` (or ``0755`` for
+    executables.)  Converting the same wheel twice (with the same
+    versions of python and zlib, in the same time zone) then produces
+    byte-identical eggs.
+
+    The egg is built for ``python_version`` (``'X.Y'``), by default
+    the running version of python.  This determines the name of the
+    egg, and the environment in which the markers of its requirements
+    are evaluated.  Modules can only be byte-compiled for the running
+    python, so eggs for other versions contain no ``.pyc`` files, and
+    can only be built when ``streaming``.  Use :meth:`retarget` to
+    build eggs for several versions of python from one opening of the
+    wheel.
+
+    Timings and counters for the conversion are collected in
+    ``stats``, a :class:`ConversionStats`.  (One is created if none is
+    passed.)
+
+    """
+    BUILD_INFO_NAME = 'humpty.txt'
+
+    VERIFY_MODES = ('full', 'fast', 'none')
+
+    COMPRESSION_TYPES = {
+        'store': ZIP_STORED,
+        'deflate': ZIP_DEFLATED,
+        }
+
+    STORED_EXTENSIONS = (
+        '.so', '.pyd', '.dll', '.dylib',
+        '.gz', '.tgz', '.bz2', '.xz', '.zip', '.whl', '.egg', '.jar',
+        '.png', '.jpg', '.jpeg', '.gif', '.ico',
+        )
+
+    def __init__(self, wheel_file, streaming=True, raw_copy=True,
+                 cache=None, compile=None, legacy_pyc=False,
+                 compile_workers=1, compression='deflate',
+                 compress_level=None, unzip=False, stats=None,
+                 filename=None, use_mmap=False, verify='full',
+                 reproducible=False, python_version=None):
+        if compression not in self.COMPRESSION_TYPES:
+            raise ValueError("Unknown compression %r" % compression)
+        if verify not in self.VERIFY_MODES:
+            raise ValueError("Unknown verify mode %r" % verify)
+        self.compile = compile
+        self.streaming = streaming
+        self._set_python_version(python_version)
+        if compress_level is not None and not 0 <= compress_level <= 9:
+            raise ValueError("Bad compression level %r" % compress_level)
+
+        if stats is None:
+            stats = ConversionStats()
+        self.stats = stats
+
+        self.reproducible = reproducible
+        self.date_time = None
+        if reproducible:
+            self.source_date_epoch = source_date_epoch()
+            date_time = time.gmtime(self.source_date_epoch)[:6]
+            # Zip files record timestamps with a resolution of two seconds
+            self.date_time = date_time[:5] + (date_time[5] & ~1,)
+
+        fileobj = None
+        if isinstance(wheel_file, (bytearray, memoryview)) \
+                or (PY3 and isinstance(wheel_file, bytes)):
+            fileobj = BytesIO(wheel_file)
+        elif hasattr(wheel_file, 'read'):
+            fileobj = wheel_file
+        if fileobj is None:
+            filename = wheel_file
+        else:
+            if filename is None:
+                filename = getattr(wheel_file, 'name', None)
+            if not isinstance(filename, six.string_types):
+                raise ValueError("The filename of the wheel is required "
+                                 "when it is not read from a path")
+            if not streaming:
+                raise ValueError("Only a wheel read from a path can be "
+                                 "converted with streaming=False")
+
+        with stats.phase('open'):
+            from distlib.wheel import Wheel
+            wheel = Wheel(filename)
+            archive = WheelArchive(wheel, fileobj, use_mmap)
+
+        if not wheel.is_compatible():
+            # Workaround for https://bitbucket.org/pypa/distlib/issues/93
+            log.warning(
+                "WARNING: Distlib reports that %s is not compatible "
+                "with this platform. "
+                "(Note that on some versions of python, "
+                "distlib's detection of compatible ABIs is broken. "
+                "See distlib issue #93.)",
+                filename)
+
+        self.wheel = wheel
+        self.archive = archive
+        self.raw_copy = raw_copy
+        self.cache = cache
+        self.legacy_pyc = legacy_pyc
+        self.compile_workers = compile_workers
+        self.compression = compression
+        self.compress_level = compress_level
+        self.unzip = unzip
+        self.verify = verify
+
+    def _set_python_version(self, python_version):
+        if python_version is None:
+            python_version = PYTHON_VERSION
+        elif not re.match(r'\d+\.\d+\Z', python_version):
+            raise ValueError("Bad python version %r" % python_version)
+        if python_version != PYTHON_VERSION:
+            if self.compile:
+                raise ValueError(
+                    "Can not byte-compile for python %s under python %s"
+                    % (python_version, PYTHON_VERSION))
+            if not self.streaming:
+                # Distlib's installer byte-compiles for the running python
+                raise ValueError("Eggs for other versions of python can "
+                                 "only be built when streaming")
+        self.python_version = python_version
+
+    def retarget(self, python_version):
+        """ Get a writer for the same wheel, built for another version
+        of python.
+
+        The new writer shares this one's :class:`WheelArchive` (and its
+        ``stats``), so the wheel is opened and hashed, and its
+        metadata is read and its members verified, only once.  Only
+        the original writer need be closed.  Each egg is still built
+        separately, however: the members of the wheel are read (and
+        inflated or copied raw) again for each.
+
+        """
+        writer = copy.copy(self)
+        writer._set_python_version(python_version)
+        return writer
+
+    def close(self):
+        self.archive.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, typ, inst, tb):
+        self.close()
+
+    def build_egg(self, destdir, force=False):
+        """ Build the egg in ``destdir``.
+
+        Unless ``force`` is true, the egg is not rebuilt if it is
+        already up to date.  Returns the path to the egg.
+
+        """
+        with self.stats.phase('build'):
+            return self._build_egg(destdir, force)
+
+    def _build_egg(self, destdir, force):
+        stats = self.stats
+        wheel = self.wheel
+        outfile = os.path.join(destdir, self.egg_name)
+        if not force and self.is_up_to_date(outfile):
+            log.warning("Skipping %s: %s is up to date",
+                        wheel.filename, outfile)
+            return outfile
+
+        if not os.path.isdir(destdir):
+            log.info("Creating dist directory %s", destdir)
+            try:
+                os.makedirs(destdir)
+            except OSError:
+                # A concurrent conversion may have just created it
+                if not os.path.isdir(destdir):
+                    raise
+
+        cache = self.cache
+        if cache is not None and not force:
+            with stats.phase('cache'):
+                try:
+                    cached = cache.get(self.archive.sha256, self.egg_name)
+                    if cached is not None and self.is_up_to_date(cached):
+                        log.warning("Copying %s from cache to %s",
+                                    wheel.filename, outfile)
+                        link_or_copy(cached, outfile)
+                        return outfile
+                except (IOError, OSError) as exc:
+                    # The cache is only an optimization
+                    log.warning("WARNING: Can not copy %s from cache: %s",
+                                self.egg_name, exc)
+
+        egg_info = self._egg_info()
+        log.warning("Converting %s to %s", wheel.filename, outfile)
+
+        # Write to a temporary file (or directory), then move it into
+        # place.  This way we never leave a partially written egg, nor
+        # do we write through a hard link into the cache.
+        tmpfile = '%s.tmp%s' % (outfile, unique_suffix())
+        success = False
+        try:
+            if self.unzip:
+                zf = EggDirectory(tmpfile)
+            else:
+                zf = EggZipFile(tmpfile, 'w', self.compress_type,
+                                self.compress_level)
+            with file_cm(zf):
+                self.write_egg(zf, egg_info)
+                with stats.phase('finalize'):
+                    zf.close()
+            with stats.phase('finalize'):
+                replace_path(tmpfile, outfile)
+            success = True
+        finally:
+            if not success and os.path.lexists(tmpfile):
+                remove_path(tmpfile)
+
+        if cache is not None:
+            with stats.phase('cache'):
+                try:
+                    cache.put(outfile, self.archive.sha256)
+                except (IOError, OSError) as exc:
+                    # The egg has been built, regardless
+                    log.warning("WARNING: Can not add %s to cache: %s",
+                                outfile, exc)
+        return outfile
+
+    def build_egg_file(self, fileobj):
+        """ Build the egg, writing it (as a zip file) to ``fileobj``.
+
+        ``Fileobj`` is a writable binary file object.  Under python 3
+        it need not be seekable.  Unlike :meth:`build_egg`, this
+        neither checks whether the egg is up to date nor uses the
+        cache, and nothing is written to the filesystem.
+
+        """
+        if self.unzip:
+            raise ValueError("Can not write an unpacked egg to a file")
+        stats = self.stats
+        with stats.phase('build'):
+            egg_info = self._egg_info()
+            log.warning("Converting %s to %s",
+                        self.wheel.filename, self.egg_name)
+            zf = EggZipFile(fileobj, 'w', self.compress_type,
+                            self.compress_level)
+            with file_cm(zf):
+                self.write_egg(zf, egg_info)
+                with stats.phase('finalize'):
+                    zf.close()
+
+    def _egg_info(self):
+        stats = self.stats
+        archive = self.archive
+        if self.verify != 'none':
+            archive.verify_digests = self.verify == 'full'
+            if self.streaming:
+                # Verify the members as they are copied into the egg,
+                # rather than reading them all an extra time up front.
+                # Any not copied are verified by write_egg.
+                archive.verify_reads = True
+            else:
+                with stats.phase('verify'):
+                    archive.verify()
+        with stats.phase('metadata'):
+            return egg_metadata(self.archive,
+                                python_version=self.python_version)
+
+    def write_egg(self, zf, egg_info):
+        """ Write the contents of the egg.
+
+        ``Zf`` is the :class:`EggZipFile` (or :class:`EggDirectory`)
+        of the egg being written, and ``egg_info`` its metadata.
+
+        """
+        stats = self.stats
+        if self.streaming:
+            with stats.phase('copy'):
+                self.copy_wheel(zf)
+        else:
+            builddir = tempfile.mkdtemp()
+            try:
+                with stats.phase('install'):
+                    self.install_wheel(builddir)
+                with stats.phase('walk'):
+                    files = list(self.walk_unpacked(builddir))
+                with stats.phase('write'):
+                    self._write_unpacked(zf, files)
+            finally:
+                shutil.rmtree(builddir)
+
+        with stats.phase('stubs'):
+            mtime = None
+            if self.reproducible:
+                mtime = time.mktime(self.date_time + (0, 0, -1))
+            stub_loaders = StubLoaders(egg_info, self.egg_name, mtime,
+                                       legacy_pyc=self.legacy_pyc,
+                                       compile=self.is_native)
+            date_time = stub_loaders.date_time
+            for arcname, content in stub_loaders:
+                self._write_content(zf, arcname, content, date_time)
+
+        with stats.phase('egg-info'):
+            for filename, content in egg_info:
+                arcname = 'EGG-INFO/%s' % filename
+                self._write_content(zf, arcname, content, date_time)
+
+            build_info = join_lines(
+                "%s: %s" % item for item in self.build_info)
+            self._write_content(zf, 'EGG-INFO/%s' % self.BUILD_INFO_NAME,
+                                build_info, date_time)
+
+        if self.verify != 'none':
+            with stats.phase('verify'):
+                self.archive.verify()
+
+    def _write_unpacked(self, zf, files):
+        """ Write the files of the installed wheel to the egg.
+
+        ``Files`` is a list of ``(arcname, filename)`` pairs, as
+        generated by :meth:`walk_unpacked`.  For a reproducible egg,
+        the ``.pyc`` files written by distlib's installer, whose
+        headers record the time of the installation, are replaced by
+        ones compiled with the normalized timestamp.
+
+        """
+        pycs = set()
+        if self.reproducible:
+            arcnames = set(arcname for arcname, filename in files)
+            pycs = set(pyc_arcname(arcname, legacy=not PY3)
+                       for arcname in arcnames if arcname.endswith('.py'))
+            pycs &= arcnames
+            mtime = time.mktime(self.date_time + (0, 0, -1))
+        for arcname, filename in files:
+            if arcname in pycs:
+                continue
+            self._write_file(zf, arcname, filename)
+            pyc = pyc_arcname(arcname, legacy=not PY3)
+            if arcname.endswith('.py') and pyc in pycs:
+                with open(filename, 'rb') as fp:
+                    source = fp.read()
+                with self.stats.phase('compile'):
+                    content = compile_pyc(
+                        source, posixpath.join(self.egg_name, arcname), mtime)
+                self._write_content(zf, pyc, content, self.date_time)
+
+    def _write_file(self, zf, arcname, filename):
+        compress_type = self._compress_type_for(arcname)
+        if not self.reproducible:
+            self._wrote(zf.write_file(filename, arcname, compress_type))
+            return
+        zinfo = self._normalize(file_zipinfo(filename, arcname))
+        zinfo.compress_type = compress_type
+        with open(filename, 'rb') as fp:
+            zf.write_chunks(zinfo, iter(lambda: fp.read(COPY_BUFSIZE), b''))
+        self._wrote(zinfo)
+
+    def _normalize(self, zinfo):
+        """ Normalize the timestamp and permissions of a member of a
+        reproducible egg.
+        """
+        if self.reproducible:
+            zinfo.date_time = self.date_time
+            executable = zinfo.external_attr >> 16 & 0o111
+            zinfo.external_attr = (0o100755 if executable else 0o100644) << 16
+        return zinfo
+
+    def _write_content(self, zf, arcname, content, date_time):
+        zinfo = ZipInfo(arcname, date_time=date_time)
+        zinfo.compress_type = self._compress_type_for(arcname)
+        zinfo.external_attr = 0o100644 << 16
+        zinfo.file_size = len(content)
+        zf.write_chunks(zinfo, [content])
+        self._wrote(zinfo)
+
+    def _wrote(self, zinfo):
+        count = self.stats.count
+        count('files')
+        count('bytes', zinfo.file_size)
+        count('compressed_bytes', zinfo.compress_size)
+
+    @property
+    def compress_type(self):
+        return self.COMPRESSION_TYPES[self.compression]
+
+    def _compress_type_for(self, arcname):
+        if arcname.lower().endswith(self.STORED_EXTENSIONS):
+            return ZIP_STORED
+        return self.compress_type
+
+    @property
+    def byte_compile_modules(self):
+        if not self.is_native:
+            return False
+        if self.compile is None:
+            return not sys.dont_write_bytecode
+        return self.compile
+
+    def script_maker(self):
+        """ A :class:`ScriptCopyer` for the scripts of the egg.
+
+        Python hashbang lines are pointed at the running interpreter
+        or, for an egg for another version of python, at
+        ``pythonX.Y``.
+
+        """
+        maker = ScriptCopyer(None, None)
+        if not self.is_native:
+            maker.executable = 'python%s' % self.python_version
+        return maker
+
+    @property
+    def is_native(self):
+        """ Whether the egg is for the running version of python.
+        """
+        return self.python_version == PYTHON_VERSION
+
+    @property
+    def build_info(self):
+        """ Fingerprint of the inputs to the conversion.
+
+        This is a list of ``(key, value)`` pairs.
+        """
+        if not self.byte_compile_modules:
+            byte_compile = 'none'
+        elif self.legacy_pyc:
+            byte_compile = 'legacy'
+        else:
+            byte_compile = 'default'
+        compression = self.compression
+        if self.compress_level is not None and compression != 'store':
+            compression = '%s-%d' % (compression, self.compress_level)
+        build_info = [
+            ('Wheel-SHA256', self.archive.sha256),
+            ('Humpty-Version', __version__),
+            ('Python-Version', self.python_version),
+            ('Byte-Compile', byte_compile),
+            ('Compression', compression),
+            ('Streaming', 'yes' if self.streaming else 'no'),
+            ('Raw-Copy', 'yes' if self.streaming and self.raw_copy else 'no'),
+            ]
+        if self.reproducible:
+            build_info.append(
+                ('Source-Date-Epoch', '%d' % self.source_date_epoch))
+        return build_info
+
+    def is_up_to_date(self, egg):
+        """ Determine whether an existing egg was built from our wheel.
+        """
+        try:
+            if self.unzip:
+                if not os.path.isdir(egg):
+                    return False
+                path = os.path.join(egg, 'EGG-INFO', self.BUILD_INFO_NAME)
+                with open(path, 'rb') as fp:
+                    content = fp.read()
+            else:
+                if not os.path.isfile(egg):
+                    return False
+                arcname = 'EGG-INFO/%s' % self.BUILD_INFO_NAME
+                with file_cm(ZipFile(egg)) as zf:
+                    content = zf.read(arcname)
+        except (IOError, OSError, KeyError, BadZipfile):
+            return False
+        msg = email.message_from_string(content.decode('utf-8'))
+        return sorted(msg.items()) == sorted(self.build_info)
+
+    def copy_wheel(self, zf):
+        """ Copy the contents of the wheel to the egg.
+
+        ``Zf`` is the :class:`EggZipFile` (or :class:`EggDirectory`)
+        of the egg being written.
+
+        """
+        archive = self.archive
+        stats = self.stats
+        entries = self.stream_wheel()
+        if self.byte_compile_modules:
+            entries = self.byte_compile(entries)
+        for zinfo, src, content in entries:
+            if content is not None:
+                with stats.phase('write'):
+                    zinfo.file_size = len(content)
+                    zf.write_chunks(zinfo, [content])
+            elif self.raw_copy and self._can_copy_raw(zinfo, src):
+                with stats.phase('raw-copy'):
+                    zinfo.compress_type = src.compress_type
+                    zinfo.flag_bits = src.flag_bits & 0x06
+                    zinfo.CRC = src.CRC
+                    zinfo.compress_size = src.compress_size
+                    zf.write_raw(zinfo, archive.iter_raw(src))
+                stats.count('raw_copies')
+            else:
+                with stats.phase('recompress'):
+                    self._copy_member(zf, zinfo, archive, src)
+                stats.count('recompressed')
+            self._wrote(zinfo)
+
+    def _can_copy_raw(self, zinfo, src):
+        # Only copy unencrypted members which are already compressed
+        # the way we want them
+        if src.flag_bits & 0x01 or src.compress_type != zinfo.compress_type:
+            return False
+        return src.compress_type == ZIP_STORED or self.compress_level is None
+
+    @staticmethod
+    def _copy_member(zf, zinfo, archive, src):
+        zf.write_chunks(zinfo, archive.iter_content(src))
+
+    def stream_wheel(self):
+        """ Map the members of the wheel archive to members of the egg.
+
+        This generates ``(zinfo, src, content)`` triples, one for each
+        file to be written to the egg.  ``Zinfo`` is the
+        :class:`ZipInfo` for the egg member; ``src`` is the
+        :class:`ZipInfo` of the wheel member from which it derives.
+        ``Content`` is the content to write, or ``None`` if the wheel
+        member is to be copied verbatim.
+
+        This is the equivalent of :meth:`unpack_wheel`, without the
+        round trip through the filesystem.
+
+        """
+        archive = self.archive
+        data_pfx = archive.data_pfx
+        maker = self.script_maker()
+        infolist = archive.infolist
+        if self.reproducible:
+            infolist = sorted(infolist, key=lambda zinfo: zinfo.filename)
+
+        for src in infolist:
+            path = src.filename
+            if path.endswith('/'):
+                continue        # directory
+            is_script = False
+            if path.startswith(data_pfx):
+                where, _, relpath = path[len(data_pfx):].partition('/')
+                if where in ('purelib', 'platlib'):
+                    path = relpath
+                elif where == 'scripts':
+                    path = 'EGG-INFO/scripts/%s' % relpath
+                    is_script = not relpath.endswith('.exe')
+
+            top, sep, tail = path.partition('/')
+            if sep and top.lower().endswith('.dist-info'):
+                # Omit .dist-info directory
+                continue
+            if not sep and top.endswith('-nspkg.pth'):
+                # Omit *-nspkg.pth file
+                continue
+
+            zinfo = self._egg_zipinfo(path, src)
+            if is_script:
+                zinfo.external_attr = (0o100755 << 16)
+                content = maker.copy_script(archive.read(src))
+                yield zinfo, src, content
+            else:
+                yield zinfo, src, None
+
+    def byte_compile(self, entries):
+        """ Add byte-compiled modules to a stream of egg members.
+
+        ``Entries`` is an iterable of ``(zinfo, src, content)``
+        triples, as generated by :meth:`stream_wheel`.  This generates
+        the same triples, with an additional one for the ``.pyc``
+        file following each python module.
+
+        If ``compile_workers`` is greater than one, the modules are
+        compiled in a pool of that many worker processes.  The
+        ``.pyc`` files are still generated in order, though not
+        necessarily immediately after their sources, unless the egg
+        is ``reproducible``.  (Then the members which follow a module
+        are held back until its ``.pyc`` is ready.)
+
+        """
+        archive = self.archive
+        pool = None
+        if self.compile_workers > 1:
+            if multiprocessing.current_process().daemon:
+                # Daemonic processes (e.g. --jobs workers) can not
+                # have children.
+                log.debug("Not byte-compiling in parallel: "
+                          "running in a daemon process")
+            else:
+                pool = multiprocessing.Pool(self.compile_workers)
+        max_pending = 4 * self.compile_workers
+        # Pending ``(src, async_result)`` pairs, for the .pyc files
+        # being compiled and, when ordered, ``(entry, None)`` for the
+        # members held back behind them
+        pending = deque()
+        ordered = self.reproducible
+        try:
+            for entry in entries:
+                zinfo, src, content = entry
+                path = zinfo.filename
+                is_module = (path.endswith('.py')
+                             and not path.startswith('EGG-INFO/'))
+                if is_module and content is None:
+                    # Read (and verify) the module before it is copied,
+                    # so that the copy need not verify it again.
+                    content = archive.read(src)
+                if ordered and pending:
+                    pending.append((entry, None))
+                else:
+                    yield entry
+                if not is_module:
+                    continue
+                job = (path, content, posixpath.join(self.egg_name, path),
+                       zipinfo_mtime(zinfo))
+                if pool is None:
+                    with self.stats.phase('compile'):
+                        result = _compile_job(job)
+                    for entry in self._compiled(src, result):
+                        yield entry
+                    continue
+                pending.append((src, pool.apply_async(_compile_job, (job,))))
+                while pending and (len(pending) > max_pending
+                                   or pending[0][1] is None
+                                   or pending[0][1].ready()):
+                    for entry in self._pending_result(*pending.popleft()):
+                        yield entry
+
+            while pending:
+                for entry in self._pending_result(*pending.popleft()):
+                    yield entry
+            if pool is not None:
+                pool.close()
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+
+    def _pending_result(self, item, async_result):
+        if async_result is None:
+            # A member held back behind a .pyc
+            return [item]
+        with self.stats.phase('compile'):
+            result = async_result.get()
+        return self._compiled(item, result)
+
+    def _compiled(self, src, result):
+        path, pyc, error = result
+        if error is not None:
+            # Don't give up if byte-compilation fails
+            log.warning("Byte-compilation of %s failed:\n%s", path, error)
+            self.stats.count('compile_failures')
+        else:
+            self.stats.count('compiled')
+            arcname = pyc_arcname(path, self.legacy_pyc)
+            yield self._egg_zipinfo(arcname, src), src, pyc
+
+    def _egg_zipinfo(self, arcname, src):
+        zinfo = ZipInfo(arcname, date_time=src.date_time)
+        zinfo.external_attr = src.external_attr
+        zinfo.compress_type = self._compress_type_for(arcname)
+        zinfo.file_size = src.file_size
+        return self._normalize(zinfo)
+
+    def unpack_wheel(self, libdir):
+        """ Install the wheel into ``libdir``, and list its contents.
+
+        This generates ``(arcname, filename)`` pairs for the files
+        which belong in the egg.
+
+        """
+        self.install_wheel(libdir)
+        return self.walk_unpacked(libdir)
+
+    def install_wheel(self, libdir):
+        """ Install the wheel into ``libdir`` using distlib.
+        """
+        wheel = self.wheel
+        name_version = '%s-%s' % (wheel.name, wheel.version)
+        data_dir = os.path.join(libdir, '%s.data' % name_version)
+        egginfo_dir = os.path.join(libdir, 'EGG-INFO')
+        paths = {
+            'purelib': libdir,
+            'platlib': libdir,
+            'scripts': os.path.join(egginfo_dir, 'scripts'),
+            }
+        for where in 'prefix', 'headers', 'data':
+            paths[where] = os.path.join(data_dir, where)
+
+        for path in paths.values():
+            if not os.path.isdir(path):
+                log.debug("Creating directory %s", path)
+                os.makedirs(path)
+
+        maker = self.script_maker()
+        wheel.install(paths, maker, warner=warner)
+
+    @staticmethod
+    def walk_unpacked(libdir):
+        """ List the files of an installed wheel which belong in the egg.
+
+        This generates ``(arcname, filename)`` pairs, breadth-first,
+        and in sorted order within each directory.
+
+        """
+        subdirs = deque([(libdir, '')])
+        while subdirs:
+            dirpath, prefix = subdirs.popleft()
+            topdir = not prefix
+            entries = sorted(scandir(dirpath), key=lambda entry: entry.name)
+            for entry in entries:
+                fn = entry.name
+                if entry.is_dir():
+                    if topdir and fn.lower().endswith('.dist-info'):
+                        # Omit .dist-info directory
+                        continue
+                    subdirs.append((entry.path, prefix + fn + '/'))
                 else:
                     if topdir and fn.endswith('-nspkg.pth'):
                         # Omit *-nspkg.pth file
                         continue
-                    arcname = posixpath.join(*fpath)
-                    yield arcname, filepath
+                    yield prefix + fn, entry.path
 
     @property
     def egg_name(self):
         wheel = self.wheel
-        name = pkg_resources.safe_name(wheel.name)
-        version = pkg_resources.safe_version(wheel.version)
-        pyver = 'py%d.%d' % sys.version_info[:2]
-        bits = [pkg_resources.to_filename(name),
-                pkg_resources.to_filename(version),
+        name = safe_name(wheel.name)
+        version = safe_version(wheel.version)
+        pyver = 'py%s' % self.python_version
+        bits = [to_filename(name),
+                to_filename(version),
                 pyver]
         if any(abi != 'none' or arch != 'any'
                for pyver, abi, arch in wheel.tags):
             # not pure python
+            import pkg_resources
             bits.append(pkg_resources.get_build_platform())
         return '-'.join(bits) + '.egg'
 
@@ -642,6 +2673,386 @@ class ScriptCopyer(distlib.scripts.ScriptMaker):
             return []
         return super(ScriptCopyer, self).make(specification, options)
 
+    def copy_script(self, content):
+        """ Adjust the hashbang line of a script.
+
+        This is the in-memory equivalent of copying a script with
+        :meth:`make`.  ``Content`` is the content of the script, which
+        is returned with any python hashbang line replaced by one for
+        the current interpreter.
+
+        """
+        first_line, sep, rest = content.partition(b'\n')
+        match = distlib.scripts.FIRST_LINE_RE.match(first_line.rstrip(b'\r'))
+        if not match:
+            return content
+        post_interp = match.group(1) or b''
+        encoding, lines = detect_encoding(BytesIO(content).readline)
+        return self._get_shebang(encoding, post_interp) + rest
+
+
+class _LogCapture(logging.Handler):
+    """ Collect log records, in a form that can be pickled.
+    """
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(
+                record.exc_info)
+            record.exc_info = None
+        self.records.append(record)
+
+
+def _init_worker(log_level):
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.setLevel(log_level)
+
+
+def _build_egg(wheel, dist_dir, force, options, python_versions=(None,)):
+    """ Convert a wheel to an egg for each of ``python_versions``.
+
+    A version of ``None`` means the version given by the
+    ``python_version`` in ``options`` (if any.)
+
+    Returns the list of eggs (``None`` for each which failed) and the
+    statistics of the conversion.  The statistics include, as
+    ``build_info``, the :attr:`EggWriter.build_info` of each egg
+    (``None`` for each which failed.)
+
+    """
+    stats = ConversionStats()
+    eggs = []
+    build_info = []
+    try:
+        with EggWriter(wheel, stats=stats, **options) as writer:
+            for python_version in python_versions:
+                target = writer
+                if python_version is not None:
+                    target = writer.retarget(python_version)
+                eggs.append(target.build_egg(dist_dir, force=force))
+                build_info.append(OrderedDict(target.build_info))
+    except Exception as exc:
+        log.error("Failed to convert %s: %s", wheel, exc)
+        log.debug("Traceback:", exc_info=True)
+        eggs.extend([None] * (len(python_versions) - len(eggs)))
+        build_info.extend([None] * (len(python_versions) - len(build_info)))
+    stats = stats.as_dict()
+    stats['build_info'] = build_info
+    return eggs, stats
+
+
+def _build_egg_job(job):
+    """ Convert a wheel in a worker process.
+
+    Log records are captured and returned so that the parent can
+    emit them in order.
+
+    """
+    wheel = job[0]
+    capture = _LogCapture()
+    root = logging.getLogger()
+    root.addHandler(capture)
+    try:
+        eggs, stats = _build_egg(*job)
+    finally:
+        root.removeHandler(capture)
+    return wheel, eggs, stats, capture.records
+
+
+def build_eggs(wheels, dist_dir, jobs=1, force=False, stats_callback=None,
+               python_versions=None, **options):
+    """ Convert wheels to eggs.
+
+    This generates a ``(wheel, egg)`` pair for each wheel in
+    ``wheels``, in order.  ``Egg`` is the path to the egg, or ``None``
+    if the conversion failed.  Failures are logged, but do not stop
+    the conversion of the remaining wheels.
+
+    If ``jobs`` is greater than one, the wheels are converted
+    concurrently in a pool of that many worker processes.  ``Wheels``
+    may be any iterable; it is consumed only a few wheels ahead of
+    the conversions.  Unless
+    ``force`` is true, eggs which are already up to date are not
+    rebuilt.  Any remaining keyword arguments are passed to
+    :class:`EggWriter`.
+
+    If ``python_versions`` (a list of ``'X.Y'`` strings) is given, an
+    egg is built from each wheel for each of those versions of python
+    (see :meth:`EggWriter.retarget`), and a ``(wheel, egg)`` pair is
+    generated for each egg, in the order of ``python_versions``.
+    (There is always a pair for each version, even if the conversion
+    fails.)
+
+    If ``stats_callback`` is given, it is called as
+    ``stats_callback(wheel, stats)`` after each conversion, where
+    ``stats`` is the :meth:`ConversionStats.as_dict` of the
+    conversion.  Its ``build_info`` is a list of the
+    :attr:`EggWriter.build_info` (as a ``dict``) of each egg built,
+    or ``None`` for each which failed.
+
+    """
+    python_versions = tuple(python_versions or (None,))
+    if jobs == 1:
+        for wheel in wheels:
+            eggs, stats = _build_egg(wheel, dist_dir, force, options,
+                                     python_versions)
+            if stats_callback is not None:
+                stats_callback(wheel, stats)
+            for egg in eggs:
+                yield wheel, egg
+        return
+
+    pool = multiprocessing.Pool(jobs, _init_worker,
+                                (logging.getLogger().getEffectiveLevel(),))
+    try:
+        # Create the dist directory up front, so that the workers
+        # don't race to create it.
+        if not os.path.isdir(dist_dir):
+            log.info("Creating dist directory %s", dist_dir)
+            os.makedirs(dist_dir)
+
+        def finish(result):
+            wheel, eggs, stats, records = result.get()
+            for record in records:
+                logging.getLogger(record.name).handle(record)
+            if stats_callback is not None:
+                stats_callback(wheel, stats)
+            return [(wheel, egg) for egg in eggs]
+
+        # (Pool.imap would consume all of wheels up front.)
+        max_pending = 2 * jobs
+        pending = deque()
+        for wheel in wheels:
+            job = (wheel, dist_dir, force, options, python_versions)
+            pending.append(pool.apply_async(_build_egg_job, (job,)))
+            while pending and (len(pending) > max_pending
+                               or pending[0].ready()):
+                for item in finish(pending.popleft()):
+                    yield item
+        while pending:
+            for item in finish(pending.popleft()):
+                yield item
+    finally:
+        pool.close()
+        pool.join()
+
+
+def find_wheels(directory, recursive=False, patterns=('*.whl',)):
+    """ Find wheels in ``directory``.
+
+    This generates the paths of the files in ``directory`` whose names
+    match any of the glob ``patterns``.  If ``recursive`` is true,
+    subdirectories are searched as well.  Each directory is listed in
+    sorted order.
+
+    """
+    for dirpath, dirnames, filenames in os.walk(directory):
+        dirnames.sort()
+        for fn in sorted(filenames):
+            if any(fnmatch.fnmatch(fn, pattern) for pattern in patterns):
+                yield os.path.join(dirpath, fn)
+        if not recursive:
+            break
+
+
+def read_wheel_list(fp):
+    """ Read wheel paths, one per line, from the file ``fp``.
+
+    Blank lines and lines starting with ``#`` are ignored.
+    """
+    for line in fp:
+        line = line.strip()
+        if line and not line.startswith('#'):
+            yield line
+
+
+# The asyncio API is only available (and only tested) under python 3
+
+def _convert(wheel, dist_dir, force, stats, options):  # pragma: NO COVER
+    with EggWriter(wheel, stats=stats, **options) as writer:
+        return writer.build_egg(dist_dir, force=force)
+
+
+def convert_wheel(wheel, dist_dir, force=False, stats=None, loop=None,
+                  executor=None, **options):  # pragma: NO COVER
+    """ Convert a wheel to an egg without blocking the :mod:`asyncio`
+    event loop.
+
+    The conversion is run in ``executor`` (by default, the loop's
+    default executor.)  This returns an :mod:`asyncio` future for the
+    path to the egg, so that, from a coroutine::
+
+        egg = await convert_wheel(wheel, dist_dir)
+
+    Cancelling the future aborts the conversion (see
+    :meth:`ConversionStats.cancel`), and any partially written egg is
+    removed.  For this to work, ``executor`` must run the conversion
+    in a thread of this process.
+
+    ``Stats``, if given, is the :class:`ConversionStats` in which to
+    collect the statistics of the conversion.  Any remaining keyword
+    arguments are passed to :class:`EggWriter`.
+
+    """
+    import asyncio
+    if loop is None:
+        loop = asyncio.get_event_loop()
+    if stats is None:
+        stats = ConversionStats()
+    future = loop.run_in_executor(
+        executor, _convert, wheel, dist_dir, force, stats, options)
+
+    def cancel_conversion(future):
+        if future.cancelled():
+            stats.cancel()
+    future.add_done_callback(cancel_conversion)
+    return future
+
+
+def convert_wheels(wheels, dist_dir, concurrency=None, force=False,
+                   loop=None, **options):  # pragma: NO COVER
+    """ Convert wheels to eggs without blocking the :mod:`asyncio`
+    event loop.
+
+    This returns an :class:`AsyncConversions`, an asynchronous
+    iterator which yields a ``(wheel, egg)`` pair for each wheel in
+    ``wheels``, in the order the conversions complete::
+
+        async with convert_wheels(wheels, dist_dir) as conversions:
+            async for wheel, egg in conversions:
+                ...
+
+    As with :func:`build_eggs`, ``egg`` is ``None`` if the conversion
+    failed, and failures are logged.  Up to ``concurrency`` (by
+    default, the number of CPUs) wheels are converted at once, each in
+    its own thread.  ``Wheels`` may be any iterable; it is consumed
+    only as conversions complete.  Any remaining keyword arguments are
+    passed to :class:`EggWriter`.
+
+    """
+    return AsyncConversions(wheels, dist_dir, concurrency, force, loop,
+                            options)
+
+
+class AsyncConversions(object):  # pragma: NO COVER
+    """ An asynchronous iterator over the results of conversions.
+
+    See :func:`convert_wheels`.  Leaving the ``async with`` block
+    (or awaiting :meth:`aclose`) cancels any conversions still in
+    progress.
+
+    """
+    def __init__(self, wheels, dist_dir, concurrency=None, force=False,
+                 loop=None, options=None):
+        import asyncio
+        from concurrent.futures import ThreadPoolExecutor
+        if loop is None:
+            loop = asyncio.get_event_loop()
+        if concurrency is None:
+            concurrency = multiprocessing.cpu_count()
+        self.loop = loop
+        self.concurrency = concurrency
+        self.executor = ThreadPoolExecutor(concurrency)
+        self.dist_dir = dist_dir
+        self.force = force
+        self.options = options or {}
+        self._wheels = iter(wheels)
+        self._running = {}
+        self._results = deque()
+        self._waiter = None
+
+    def __aiter__(self):
+        return self
+
+    def __anext__(self):
+        if self._waiter is not None and not self._waiter.done():
+            raise RuntimeError("__anext__ called while another call to "
+                               "__anext__ is pending")
+        self._waiter = self.loop.create_future()
+        self._deliver()
+        return self._waiter
+
+    def __aenter__(self):
+        future = self.loop.create_future()
+        future.set_result(self)
+        return future
+
+    def __aexit__(self, typ, inst, tb):
+        return self.aclose()
+
+    def aclose(self):
+        """ Cancel any conversions in progress.
+
+        This returns an awaitable which completes once the cancelled
+        conversions have stopped, and removed their partial output.
+
+        """
+        self._wheels = None
+        for future in list(self._running):
+            future.cancel()
+        if self._waiter is not None:
+            self._waiter.cancel()
+        return self.loop.run_in_executor(None, self.executor.shutdown)
+
+    def _deliver(self):
+        waiter = self._waiter
+        if waiter is None or waiter.done():
+            return
+        try:
+            self._start_conversions()
+        except Exception as exc:
+            waiter.set_exception(exc)
+            return
+        if self._results:
+            waiter.set_result(self._results.popleft())
+        elif not self._running:
+            self.executor.shutdown(wait=False)
+            waiter.set_exception(StopAsyncIteration())  # noqa: F821
+
+    def _start_conversions(self):
+        while self._wheels is not None \
+                and len(self._running) < self.concurrency:
+            try:
+                wheel = next(self._wheels)
+            except StopIteration:
+                self._wheels = None
+                break
+            future = convert_wheel(wheel, self.dist_dir, self.force,
+                                   loop=self.loop, executor=self.executor,
+                                   **self.options)
+            self._running[future] = wheel
+            future.add_done_callback(self._finished)
+
+    def _finished(self, future):
+        wheel = self._running.pop(future)
+        if future.cancelled():
+            return
+        exc = future.exception()
+        if exc is None:
+            egg = future.result()
+        else:
+            log.error("Failed to convert %s: %s", wheel, exc)
+            log.debug("Traceback:",
+                      exc_info=(type(exc), exc, exc.__traceback__))
+            egg = None
+        self._results.append((wheel, egg))
+        self._deliver()
+
+
+def _check_python_versions(ctx, param, value):
+    for python_version in value:
+        if not re.match(r'\d+\.\d+\Z', python_version):
+            raise click.BadParameter(
+                "expected X.Y, got %r" % python_version)
+    return value
+
 
 @click.command()
 @click.option(
@@ -651,20 +3062,520 @@ class ScriptCopyer(distlib.scripts.ScriptMaker):
     help="Build eggs into <dir>.  Default is <cwd>/dist.",
     metavar='DIR',
     )
+@click.option(
+    '-j', '--jobs',
+    type=click.IntRange(0, None),
+    default=1,
+    help="Convert up to N wheels in parallel.  "
+    "Zero means one per CPU.  Default is 1.",
+    metavar='N',
+    )
+@click.option(
+    '-f', '--force',
+    is_flag=True,
+    help="Rebuild eggs even if they are up to date.",
+    )
+@click.option(
+    '--cache-dir',
+    type=click.Path(file_okay=False),
+    envvar='HUMPTY_CACHE_DIR',
+    help="Cache built eggs in <dir>.  [env: HUMPTY_CACHE_DIR]",
+    metavar='DIR',
+    )
+@click.option(
+    '--cache-size',
+    type=click.IntRange(0, None),
+    envvar='HUMPTY_CACHE_SIZE',
+    help="Limit the size of the egg cache to MB megabytes.  "
+    "[env: HUMPTY_CACHE_SIZE]",
+    metavar='MB',
+    )
+@click.option(
+    '--compile/--no-compile',
+    default=None,
+    help="Byte-compile python modules.  "
+    "The default is to compile unless PYTHONDONTWRITEBYTECODE is set.",
+    )
+@click.option(
+    '--legacy-pyc',
+    is_flag=True,
+    help="Put .pyc files next to their sources rather than in "
+    "__pycache__ directories.  (Python 3 can only import the former "
+    "from zipped eggs.)",
+    )
+@click.option(
+    '--compile-jobs',
+    type=click.IntRange(0, None),
+    default=1,
+    help="Byte-compile using N processes.  "
+    "Zero means one per CPU.  Default is 1.",
+    metavar='N',
+    )
+@click.option(
+    '--compression',
+    type=click.Choice(sorted(EggWriter.COMPRESSION_TYPES)),
+    default='deflate',
+    help="How to compress the members of the egg.  Default is deflate.",
+    )
+@click.option(
+    '--compress-level',
+    type=click.IntRange(0, 9),
+    help="Zlib compression level, from 0 (fastest) to 9 (smallest).",
+    metavar='N',
+    )
+@click.option(
+    '-Z', '--unzip',
+    is_flag=True,
+    help="Build unpacked eggs (directories) rather than zip files.",
+    )
+@click.option(
+    '--mmap', 'use_mmap',
+    is_flag=True,
+    help="Memory-map the wheels, rather than reading them.  "
+    "This may be faster for large wheels.",
+    )
+@click.option(
+    '--verify',
+    type=click.Choice(EggWriter.VERIFY_MODES),
+    default='full',
+    help="How to verify wheels against their RECORD: full (check "
+    "digests), fast (check only sizes and CRCs) or none (check "
+    "nothing, not even the CRCs of members copied without "
+    "recompression).  Default is full.",
+    )
+@click.option(
+    '--no-verify',
+    is_flag=True,
+    help="Do not verify wheels.  The same as --verify=none.",
+    )
+@click.option(
+    '--python-version', 'python_versions',
+    multiple=True,
+    callback=_check_python_versions,
+    help="Build eggs for python X.Y, rather than for the running python.  "
+    "May be repeated, to build eggs for several versions from one opening "
+    "and verification of each wheel.  Eggs for other versions are not "
+    "byte-compiled.",
+    metavar='X.Y',
+    )
+@click.option(
+    '--reproducible',
+    is_flag=True,
+    help="Build byte-for-byte reproducible eggs, with sorted members, "
+    "normalized permissions and fixed timestamps (from "
+    "SOURCE_DATE_EPOCH, if set.)",
+    )
+@click.option(
+    '--stats',
+    is_flag=True,
+    help="Print timings and counts for each conversion.",
+    )
+@click.option(
+    '--stats-json',
+    type=click.File('w'),
+    help="Write timings and counts for each conversion, as JSON, "
+    "to FILE.",
+    metavar='FILE',
+    )
+@click.option(
+    '--from-dir',
+    type=click.Path(exists=True, file_okay=False),
+    multiple=True,
+    help="Convert the wheels in <dir>.  May be repeated.",
+    metavar='DIR',
+    )
+@click.option(
+    '-r', '--recursive',
+    is_flag=True,
+    help="Also convert wheels in subdirectories of --from-dir.",
+    )
+@click.option(
+    '--glob',
+    multiple=True,
+    help="Only convert files in --from-dir which match PATTERN.  "
+    "May be repeated.  Default is *.whl.",
+    metavar='PATTERN',
+    )
+@click.option(
+    '--from-file',
+    type=click.File('r'),
+    multiple=True,
+    help="Convert the wheels listed, one per line, in FILE.  "
+    "Use - to read from stdin.  May be repeated.",
+    metavar='FILE',
+    )
 @click.argument(
     'wheels',
     nargs=-1,
-    required=True,
     type=click.Path(exists=True, dir_okay=False),
     )
-def main(dist_dir, wheels):
+def main(dist_dir, jobs, force, cache_dir, cache_size,
+         compile, legacy_pyc, compile_jobs, compression, compress_level,
+         unzip, use_mmap, verify, no_verify, python_versions, reproducible,
+         stats, stats_json, from_dir, recursive, glob, from_file, wheels):
     """ Convert wheels to eggs.
     """
+    if not (wheels or from_dir or from_file):
+        raise click.UsageError("No wheels given.")
 
     logging.basicConfig(level=logging.WARNING, format="%(message)s")
 
-    for wheel in wheels:
-        EggWriter(wheel).build_egg(dist_dir)
+    if jobs == 0:
+        jobs = multiprocessing.cpu_count()
+    if compile_jobs == 0:
+        compile_jobs = multiprocessing.cpu_count()
+    if no_verify:
+        verify = 'none'
+    if compile and set(python_versions) - set([PYTHON_VERSION]):
+        raise click.UsageError(
+            "Can not --compile for a --python-version other than %s."
+            % PYTHON_VERSION)
+
+    cache = None
+    if cache_dir is not None:
+        max_size = cache_size * 1024 * 1024 if cache_size is not None else None
+        cache = EggCache(cache_dir, max_size)
+
+    all_stats = []
+
+    def stats_callback(wheel, wheel_stats):
+        all_stats.append((wheel, wheel_stats))
+
+    patterns = glob or ('*.whl',)
+    wheels = chain(
+        wheels,
+        chain.from_iterable(find_wheels(directory, recursive, patterns)
+                            for directory in from_dir),
+        chain.from_iterable(read_wheel_list(fp) for fp in from_file))
+
+    results = list(build_eggs(wheels, dist_dir, jobs=jobs, force=force,
+                              stats_callback=stats_callback,
+                              cache=cache, compile=compile,
+                              legacy_pyc=legacy_pyc,
+                              compile_workers=compile_jobs,
+                              compression=compression,
+                              compress_level=compress_level,
+                              unzip=unzip, use_mmap=use_mmap,
+                              verify=verify, reproducible=reproducible,
+                              python_versions=python_versions))
+    failed = [wheel for wheel, egg in results if egg is None]
+
+    if len(python_versions) > 1:
+        # There is an egg for each version, in order, for each wheel
+        summary = [(wheel, egg, " (python %s)" % python_version)
+                   for (wheel, egg), python_version
+                   in zip(results, cycle(python_versions))]
+        heading = "Built %d of %d eggs:"
+    else:
+        summary = [(wheel, egg, "") for wheel, egg in results]
+        heading = "Converted %d of %d wheels:"
+    if len(summary) > 1:
+        log.warning(heading, len(summary) - len(failed), len(summary))
+        for wheel, egg, target in summary:
+            if egg is None:
+                log.warning("  FAILED  %s%s", wheel, target)
+            else:
+                log.warning("  ok      %s -> %s", wheel, egg)
+
+    total = sum_stats(wheel_stats for wheel, wheel_stats in all_stats)
+    if stats:
+        for wheel, wheel_stats in all_stats:
+            log.warning("Statistics for %s:", wheel)
+            for line in format_stats(wheel_stats):
+                log.warning("%s", line)
+        if len(all_stats) > 1:
+            log.warning("Total:")
+            for line in format_stats(total):
+                log.warning("%s", line)
+
+    if stats_json is not None:
+        eggs = defaultdict(list)
+        for wheel, egg in results:
+            eggs[wheel].append(egg)
+        json.dump({
+            'wheels': [dict(wheel_stats, wheel=wheel, egg=eggs[wheel][0],
+                            eggs=eggs[wheel])
+                       for wheel, wheel_stats in all_stats],
+            'total': total,
+            }, stats_json, indent=2, sort_keys=True)
+        stats_json.write('\n')
+
+    if failed:
+        sys.exit(1)
+
+
+def _init_server_worker(log_level):
+    _init_worker(log_level)
+    # Load everything a conversion needs now, rather than during
+    # the first conversion.
+    import distlib.markers      # noqa: F401
+    import distlib.metadata     # noqa: F401
+    import distlib.wheel        # noqa: F401
+    import py_compile           # noqa: F401
+
+
+class ConversionRequestError(ValueError):
+    """ A malformed conversion request.
+    """
+
+
+class ConversionServer(object):
+    """ Convert wheels to eggs on request.
+
+    Requests are read from connections to the Unix domain socket
+    ``socket_path``, one JSON object per line.  Each must contain the
+    absolute path of a ``wheel``, and may contain a ``dist_dir``
+    (which defaults to ``dist_dir``), a ``force`` flag, and a dict of
+    ``options`` for :class:`EggWriter` (any of
+    :attr:`REQUEST_OPTIONS`.)  A JSON object is written back, on a
+    single line, for each request.  It contains the ``egg`` (the
+    path to the egg, or ``null`` if the conversion failed), the
+    ``stats`` of the conversion, the ``log`` messages emitted, and
+    the ``seconds`` spent waiting for and performing the conversion.
+    Malformed requests get a response of the form ``{"ok": false,
+    "error": ...}``.
+
+    The conversions are performed in a pool of ``jobs`` worker
+    processes.  At most ``queue_size`` requests may be waiting for a
+    worker; further requests are refused with an error of ``busy``.
+    Any remaining keyword arguments are passed to :class:`EggWriter`.
+
+    Each connection is served in its own thread.  Use
+    :meth:`serve_forever`, :meth:`shutdown` and :meth:`server_close`
+    as for a :mod:`socketserver` server.
+
+    """
+    REQUEST_OPTIONS = frozenset([
+        'compile',
+        'compress_level',
+        'compression',
+        'legacy_pyc',
+        'python_version',
+        'reproducible',
+        'unzip',
+        'use_mmap',
+        'verify',
+        ])
+
+    def __init__(self, socket_path, dist_dir='dist', jobs=1, queue_size=16,
+                 **options):
+        import threading
+        self.dist_dir = os.path.abspath(dist_dir)
+        self.options = options
+        self.slots = threading.BoundedSemaphore(jobs + queue_size)
+        # Start the workers first, so they do not inherit the socket
+        self.pool = multiprocessing.Pool(
+            jobs, _init_server_worker,
+            (logging.getLogger().getEffectiveLevel(),))
+        try:
+            self.server = _make_socket_server(socket_path, self.convert)
+        except Exception:
+            self.pool.terminate()
+            raise
+
+    @property
+    def server_address(self):
+        return self.server.server_address
+
+    def serve_forever(self, poll_interval=0.5):
+        self.server.serve_forever(poll_interval)
+
+    def shutdown(self):
+        self.server.shutdown()
+
+    def server_close(self):
+        self.server.server_close()
+        self.pool.terminate()
+        self.pool.join()
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+
+    def convert(self, request):
+        """ Perform a conversion request, returning the response.
+        """
+        if not isinstance(request, dict):
+            raise ConversionRequestError("request must be a JSON object")
+        wheel = self._get_path(request, 'wheel')
+        dist_dir = self._get_path(request, 'dist_dir', self.dist_dir)
+        force = bool(request.get('force', False))
+        options = request.get('options', {})
+        if not isinstance(options, dict):
+            raise ConversionRequestError("options must be a JSON object")
+        unknown = set(options) - self.REQUEST_OPTIONS
+        if unknown:
+            raise ConversionRequestError(
+                "unknown options: %s" % ', '.join(sorted(unknown)))
+
+        if not self.slots.acquire(False):
+            return {'ok': False, 'error': 'busy'}
+        try:
+            start = time.time()
+            job = (wheel, dist_dir, force, dict(self.options, **options))
+            result = self.pool.apply_async(_build_egg_job, (job,))
+            wheel, (egg,), stats, records = result.get()
+            seconds = time.time() - start
+        finally:
+            self.slots.release()
+
+        for record in records:
+            logging.getLogger(record.name).handle(record)
+        return {
+            'ok': egg is not None,
+            'wheel': wheel,
+            'egg': egg,
+            'seconds': seconds,
+            'stats': stats,
+            'log': [record.getMessage() for record in records],
+            }
+
+    @staticmethod
+    def _get_path(request, key, default=None):
+        path = request.get(key, default)
+        if not isinstance(path, six.string_types):
+            raise ConversionRequestError("%s must be a string" % key)
+        if not os.path.isabs(path):
+            raise ConversionRequestError("%s must be an absolute path" % key)
+        return path
+
+
+def _make_socket_server(socket_path, convert):
+    """ Create a threading server on the Unix domain socket
+    ``socket_path``.
+
+    Each line read from a connection is parsed as JSON, and passed to
+    ``convert``, which returns the response (see
+    :class:`ConversionServer`.)  The server classes are built here,
+    so that :mod:`socketserver` is only imported when serving.
+
+    """
+    from six.moves import socketserver
+
+    class ConversionHandler(socketserver.StreamRequestHandler):
+        def handle(self):
+            for line in iter(self.rfile.readline, b''):
+                if not line.strip():
+                    continue
+                try:
+                    response = convert(json.loads(line.decode('utf-8')))
+                except ValueError as exc:
+                    response = {'ok': False, 'error': str(exc)}
+                self.wfile.write(json.dumps(response).encode('utf-8')
+                                 + b'\n')
+                self.wfile.flush()
+
+    class SocketServer(socketserver.ThreadingMixIn,
+                       socketserver.UnixStreamServer):
+        daemon_threads = True
+
+    return SocketServer(socket_path, ConversionHandler)
+
+
+def _check_socket_path(socket_path):
+    """ Make sure no other server is listening on ``socket_path``.
+
+    A stale socket, left behind by a server which is no longer
+    running, is removed.
+
+    """
+    import socket
+    if not os.path.exists(socket_path):
+        return
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+    except socket.error:
+        log.info("Removing stale socket %s", socket_path)
+        os.unlink(socket_path)
+    else:
+        raise click.UsageError(
+            "A server is already listening on %s." % socket_path)
+    finally:
+        sock.close()
+
+
+@click.command()
+@click.option(
+    '-s', '--socket', 'socket_path',
+    type=click.Path(dir_okay=False),
+    required=True,
+    help="Listen on the Unix domain socket PATH.",
+    metavar='PATH',
+    )
+@click.option(
+    '-d', '--dist-dir',
+    type=click.Path(writable=True, file_okay=False),
+    default='dist',
+    help="Build eggs into <dir> unless the request says otherwise.  "
+    "Default is <cwd>/dist.",
+    metavar='DIR',
+    )
+@click.option(
+    '-j', '--jobs',
+    type=click.IntRange(0, None),
+    default=1,
+    help="Convert up to N wheels in parallel.  "
+    "Zero means one per CPU.  Default is 1.",
+    metavar='N',
+    )
+@click.option(
+    '--queue-size',
+    type=click.IntRange(0, None),
+    default=16,
+    help="Refuse requests when N are already waiting.  Default is 16.",
+    metavar='N',
+    )
+@click.option(
+    '--cache-dir',
+    type=click.Path(file_okay=False),
+    envvar='HUMPTY_CACHE_DIR',
+    help="Cache built eggs in <dir>.  [env: HUMPTY_CACHE_DIR]",
+    metavar='DIR',
+    )
+@click.option(
+    '--cache-size',
+    type=click.IntRange(0, None),
+    envvar='HUMPTY_CACHE_SIZE',
+    help="Limit the size of the egg cache to MB megabytes.  "
+    "[env: HUMPTY_CACHE_SIZE]",
+    metavar='MB',
+    )
+def serve(socket_path, dist_dir, jobs, queue_size, cache_dir, cache_size):
+    """ Convert wheels to eggs on request.
+
+    Requests are read, one JSON object per line, from connections to
+    a Unix domain socket.
+    """
+    import signal
+    import socket
+    if not hasattr(socket, 'AF_UNIX'):
+        raise click.UsageError(     # pragma: NO COVER
+            "Unix domain sockets are not supported on this platform.")
+
+    logging.basicConfig(level=logging.WARNING, format="%(message)s")
+
+    if jobs == 0:
+        jobs = multiprocessing.cpu_count()
+
+    cache = None
+    if cache_dir is not None:
+        max_size = cache_size * 1024 * 1024 if cache_size is not None else None
+        cache = EggCache(cache_dir, max_size)
+
+    _check_socket_path(socket_path)
+    server = ConversionServer(socket_path, dist_dir, jobs=jobs,
+                              queue_size=queue_size, cache=cache)
+
+    def terminate(signum, frame):
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, terminate)
+    log.warning("Listening on %s", socket_path)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
 
 
 if __name__ == '__main__':
@@ -1,19 +1,22 @@
 # -*- coding: utf-8 -*-
 import os
+import re
 import sys
 
 from setuptools import setup
 from setuptools.command.test import test as TestCommand
 
-VERSION = '0.2.1.post1.dev0'
-
 here = os.path.abspath(os.path.dirname(__file__))
+
+with open(os.path.join(here, 'humpty.py')) as fp:
+    VERSION = re.search(r"^__version__ = '(.*)'$", fp.read(), re.M).group(1)
 README = open(os.path.join(here, 'README.rst')).read()
 CHANGES = open(os.path.join(here, 'CHANGES.rst')).read()
 
 requires = [
     'click',
     'distlib',
+    'scandir; python_version < "3.5"',
     'setuptools',
     'six',
     ]
@@ -76,6 +79,7 @@ setup(
     entry_points={
         'console_scripts': [
             'humpty = humpty:main',
+            'humpty-serve = humpty:serve',
             ],
         },
 
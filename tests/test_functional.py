@@ -5,7 +5,9 @@ from __future__ import absolute_import
 
 from contextlib import contextmanager
 import imp
+import json
 import posixpath
+import sys
 from zipfile import ZipFile
 
 from click.testing import CliRunner
@@ -121,6 +123,137 @@ def test_main(packages, tmpdir):
     assert egg.fnmatch("dist1-*")
 
 
+def test_main_jobs(packages, tmpdir):
+    from humpty import main
+
+    wheels = [packages.get_wheel('dist1'), packages.get_wheel('dist2')]
+
+    runner = CliRunner()
+    result = runner.invoke(main, ['-d', str(tmpdir), '--jobs', '2']
+                           + list(map(str, wheels)))
+    assert result.exit_code == 0
+
+    eggs = sorted(egg.basename for egg in tmpdir.listdir(fil="*.egg"))
+    assert len(eggs) == 2
+    assert eggs[0].startswith("dist1-")
+    assert eggs[1].startswith("dist2-")
+
+
+@pytest.mark.parametrize('jobs', ['1', '2'])
+def test_main_failure(packages, tmpdir, jobs):
+    from humpty import main
+
+    bad_wheel = tmpdir.join('bad-1.0-py2.py3-none-any.whl')
+    bad_wheel.write("not a zip file")
+    wheel = packages.get_wheel('dist1')
+    distdir = tmpdir.join('dist')
+
+    runner = CliRunner()
+    result = runner.invoke(main, ['-d', str(distdir), '-j', jobs,
+                                  str(bad_wheel), str(wheel)])
+    assert result.exit_code == 1
+
+    # The good wheel is still converted
+    eggs = list(distdir.listdir(fil="*.egg"))
+    assert len(eggs) == 1
+    assert eggs[0].fnmatch("dist1-*")
+
+
+def test_main_python_versions_failure(packages, tmpdir, caplog):
+    from humpty import main, PYTHON_VERSION
+
+    bad_wheel = tmpdir.join('bad-1.0-py2.py3-none-any.whl')
+    bad_wheel.write("not a zip file")
+    wheel = packages.get_wheel('dist1')
+    distdir = tmpdir.join('dist')
+    other_version = '2.7' if PYTHON_VERSION != '2.7' else '3.6'
+
+    runner = CliRunner()
+    result = runner.invoke(main, ['-d', str(distdir),
+                                  '--python-version', PYTHON_VERSION,
+                                  '--python-version', other_version,
+                                  str(bad_wheel), str(wheel)])
+    assert result.exit_code == 1
+    assert len(distdir.listdir(fil="*.egg")) == 2
+    assert "Built 2 of 4 eggs:" in caplog.text
+    for python_version in PYTHON_VERSION, other_version:
+        assert "FAILED  %s (python %s)" % (bad_wheel, python_version) \
+            in caplog.text
+
+
+@pytest.mark.parametrize('jobs', ['1', '2'])
+def test_main_stats_json(packages, tmpdir, jobs, caplog):
+    from humpty import main
+
+    wheels = [packages.get_wheel('dist1'), packages.get_wheel('dist2')]
+    stats_json = tmpdir.join('stats.json')
+
+    runner = CliRunner()
+    result = runner.invoke(main, ['-d', str(tmpdir), '-j', jobs, '--stats',
+                                  '--stats-json', str(stats_json)]
+                           + list(map(str, wheels)))
+    assert result.exit_code == 0
+    assert 'Statistics for' in caplog.text
+
+    stats = json.loads(stats_json.read())
+    assert [item['wheel'] for item in stats['wheels']] \
+        == list(map(str, wheels))
+    assert all(item['egg'].endswith('.egg') for item in stats['wheels'])
+    for item in stats['wheels']:
+        build_info, = item['build_info']
+        assert build_info['Streaming'] == 'yes'
+        assert build_info['Raw-Copy'] == 'yes'
+        assert build_info['Python-Version'] == '%d.%d' % sys.version_info[:2]
+    assert stats['total']['counters']['files'] == sum(
+        item['counters']['files'] for item in stats['wheels'])
+
+
+def test_main_from_dir(packages, tmpdir):
+    from humpty import main
+
+    wheelhouse = tmpdir.join('wheelhouse')
+    for dist_name, subdir in [('dist1', '.'), ('dist2', 'sub')]:
+        wheel = packages.get_wheel(dist_name)
+        wheel.copy(wheelhouse.join(subdir).ensure(dir=True))
+    wheelhouse.join('README.txt').write('not a wheel')
+    distdir = tmpdir.join('dist')
+
+    runner = CliRunner()
+    result = runner.invoke(main, ['-d', str(distdir),
+                                  '--from-dir', str(wheelhouse)])
+    assert result.exit_code == 0
+    assert [egg.basename[:6] for egg in distdir.listdir()] == ['dist1-']
+
+    result = runner.invoke(main, ['-d', str(distdir), '-r',
+                                  '--from-dir', str(wheelhouse),
+                                  '--glob', 'dist2-*'])
+    assert result.exit_code == 0
+    eggs = sorted(egg.basename[:6] for egg in distdir.listdir())
+    assert eggs == ['dist1-', 'dist2-']
+
+
+def test_main_from_stdin(packages, tmpdir):
+    from humpty import main
+
+    wheels = [packages.get_wheel('dist1'), packages.get_wheel('dist2')]
+    distdir = tmpdir.join('dist')
+
+    runner = CliRunner()
+    result = runner.invoke(main, ['-d', str(distdir), '--from-file', '-'],
+                           input=''.join('%s\n' % wheel for wheel in wheels))
+    assert result.exit_code == 0
+    assert len(distdir.listdir(fil="*.egg")) == 2
+
+
+def test_main_no_wheels(tmpdir):
+    from humpty import main
+
+    runner = CliRunner()
+    result = runner.invoke(main, ['-d', str(tmpdir)])
+    assert result.exit_code == 2
+    assert 'No wheels given' in result.output
+
+
 @contextmanager
 def fileobj(fp):
     try:
@@ -3,15 +3,22 @@
 """
 from __future__ import absolute_import
 
+import errno
 import imp
+import multiprocessing
 import os
 import posixpath
+import struct
+import subprocess
 import sys
-from zipfile import ZipFile
+import time
+import zlib
+from zipfile import ZipFile, ZipInfo, ZIP_DEFLATED, ZIP_STORED
 
 from pkg_resources import parse_version, require
+import py
 import pytest
-from six import int2byte, unichr, StringIO
+from six import int2byte, unichr, BytesIO, StringIO, PY3
 
 try:
     import sysconfig
@@ -50,6 +57,251 @@ class Test_file_cm(object):
         assert fp.getvalue() == 'x'
 
 
+def test_compile_pyc():
+    from humpty import compile_pyc, MAGIC_NUMBER
+    import marshal
+    pyc = compile_pyc(b"answer = 42\n", 'foo/bar.py', 1234)
+    assert pyc.startswith(MAGIC_NUMBER)
+    code = marshal.loads(pyc[16:] if sys.version_info >= (3, 7)
+                         else pyc[12:] if sys.version_info >= (3, 3)
+                         else pyc[8:])
+    assert code.co_filename == 'foo/bar.py'
+    namespace = {}
+    exec(code, namespace)
+    assert namespace['answer'] == 42
+
+
+class UnseekableWriter(object):
+    """ A write-only, unseekable, binary stream.
+    """
+    def __init__(self):
+        self.buf = BytesIO()
+
+    def write(self, data):
+        return self.buf.write(data)
+
+    def flush(self):
+        pass
+
+    def getvalue(self):
+        return self.buf.getvalue()
+
+
+@pytest.fixture
+def src_zip(tmpdir):
+    path = str(tmpdir.join('src.zip'))
+    zf = ZipFile(path, 'w', ZIP_DEFLATED)
+    zf.writestr('a.txt', b'a' * 1000)
+    zf.writestr('b.txt', b'b' * 1000)
+    zf.close()
+    return path
+
+
+class TestEggZipFile(object):
+    def test_write_raw(self, src_zip, tmpdir):
+        from humpty import EggZipFile, iter_raw_member
+        dst_zip = str(tmpdir.join('dst.zip'))
+        with open(src_zip, 'rb') as fp:
+            src_zf = ZipFile(fp)
+            dst_zf = EggZipFile(dst_zip, 'w', ZIP_DEFLATED)
+            for src in src_zf.infolist():
+                dst_zf.write_raw(src, iter_raw_member(fp, src, bufsize=7))
+            dst_zf.writestr('c.txt', b'c')
+            dst_zf.close()
+            src_zf.close()
+
+        zf = ZipFile(dst_zip)
+        assert zf.testzip() is None
+        assert zf.read('a.txt') == b'a' * 1000
+        assert zf.read('b.txt') == b'b' * 1000
+        assert zf.read('c.txt') == b'c'
+        zf.close()
+
+    @pytest.mark.parametrize('compress_type', [ZIP_DEFLATED, ZIP_STORED])
+    def test_write_chunks(self, tmpdir, compress_type):
+        from humpty import EggZipFile
+        dst_zip = str(tmpdir.join('dst.zip'))
+        dst_zf = EggZipFile(dst_zip, 'w', compress_level=9)
+        zinfo = ZipInfo('a.txt')
+        zinfo.compress_type = compress_type
+        dst_zf.write_chunks(zinfo, [b'a' * 1000, b'b' * 1000])
+        dst_zf.writestr('c.txt', b'c')
+        dst_zf.close()
+
+        zf = ZipFile(dst_zip)
+        assert zf.testzip() is None
+        assert zf.read('a.txt') == b'a' * 1000 + b'b' * 1000
+        assert zf.getinfo('a.txt').compress_type == compress_type
+        assert zf.read('c.txt') == b'c'
+        zf.close()
+
+    @pytest.mark.skipif(sys.version_info < (3, 5),
+                        reason="ZipFile can not write unseekable streams")
+    @pytest.mark.parametrize('file_size', [0, 10 ** 10])
+    def test_write_chunks_unseekable(self, file_size):
+        from humpty import EggZipFile
+        out = UnseekableWriter()
+        dst_zf = EggZipFile(out, 'w', ZIP_DEFLATED)
+        zinfo = ZipInfo('a.txt')
+        # A large expected file_size forces ZIP64 extensions
+        zinfo.file_size = file_size
+        dst_zf.write_chunks(zinfo, [b'a' * 1000, b'b' * 1000])
+        dst_zf.writestr('c.txt', b'c')
+        dst_zf.close()
+
+        zf = ZipFile(BytesIO(out.getvalue()))
+        assert zf.testzip() is None
+        assert zf.read('a.txt') == b'a' * 1000 + b'b' * 1000
+        assert zf.getinfo('a.txt').flag_bits & 0x08
+        assert zf.read('c.txt') == b'c'
+        zf.close()
+
+    def test_write_chunks_bad_compress_type(self, tmpdir):
+        from humpty import EggZipFile
+        dst_zf = EggZipFile(str(tmpdir.join('dst.zip')), 'w')
+        zinfo = ZipInfo('a.txt')
+        zinfo.compress_type = 99
+        with pytest.raises(ValueError):
+            dst_zf.write_chunks(zinfo, [b'a'])
+        dst_zf.close()
+
+    def test_write_file(self, tmpdir):
+        from humpty import EggZipFile
+        src = tmpdir.join('src.txt')
+        src.write('x' * 1000)
+        src.chmod(0o755)
+        dst_zip = str(tmpdir.join('dst.zip'))
+        dst_zf = EggZipFile(dst_zip, 'w', ZIP_DEFLATED)
+        dst_zf.write_file(str(src), 'x.txt')
+        dst_zf.close()
+
+        zf = ZipFile(dst_zip)
+        assert zf.read('x.txt') == b'x' * 1000
+        zinfo = zf.getinfo('x.txt')
+        assert zinfo.compress_type == ZIP_DEFLATED
+        assert zinfo.external_attr >> 16 & 0o777 == 0o755
+        zf.close()
+
+    def test_iter_raw_member_bad_header(self, src_zip):
+        from humpty import iter_raw_member
+        with open(src_zip, 'rb') as fp:
+            zinfo = ZipFile(fp).getinfo('b.txt')
+            zinfo.header_offset += 1
+            with pytest.raises(ValueError):
+                list(iter_raw_member(fp, zinfo))
+
+
+class TestEggDirectory(object):
+    @pytest.fixture
+    def egg_dir(self, tmpdir):
+        from humpty import EggDirectory
+        return EggDirectory(str(tmpdir.join('foo.egg')))
+
+    def test_write_chunks(self, egg_dir, tmpdir):
+        zinfo = ZipInfo('a/b.txt', date_time=(2000, 1, 2, 3, 4, 6))
+        zinfo.external_attr = 0o100755 << 16
+        egg_dir.write_chunks(zinfo, [b'a', b'b'])
+        path = tmpdir.join('foo.egg', 'a', 'b.txt')
+        assert path.read_binary() == b'ab'
+        st = path.stat()
+        assert st.mode & 0o777 == 0o755
+        assert time.localtime(st.mtime)[:6] == (2000, 1, 2, 3, 4, 6)
+
+    def test_write_raw(self, egg_dir, tmpdir, src_zip):
+        from humpty import iter_raw_member
+        with open(src_zip, 'rb') as fp:
+            for src in ZipFile(fp).infolist():
+                egg_dir.write_raw(src, iter_raw_member(fp, src, bufsize=7))
+        assert tmpdir.join('foo.egg', 'a.txt').read() == 'a' * 1000
+
+    def test_write_file(self, egg_dir, tmpdir):
+        src = tmpdir.join('src.txt')
+        src.write('x')
+        egg_dir.write_file(str(src), 'EGG-INFO/x.txt')
+        assert tmpdir.join('foo.egg', 'EGG-INFO', 'x.txt').read() == 'x'
+
+    @pytest.mark.parametrize('arcname', [
+        '../evil.py', '/evil.py', 'a//b.py', 'a/../../b.py'])
+    def test_bad_member_name(self, egg_dir, arcname):
+        with pytest.raises(ValueError):
+            egg_dir.write_chunks(ZipInfo(arcname), [b''])
+
+
+def test_pyc_arcname():
+    from humpty import pyc_arcname
+    assert pyc_arcname('foo/bar.py', legacy=True) == 'foo/bar.pyc'
+    assert pyc_arcname('foo/bar.py') in with_byte_compiled(['foo/bar.py'])
+
+
+def test_compile_job_failure():
+    from humpty import _compile_job
+    path, pyc, error = _compile_job(('bad.py', b'def (', 'bad.py', 0))
+    assert path == 'bad.py'
+    assert pyc is None
+    assert 'SyntaxError' in error
+
+
+@pytest.mark.parametrize('name', ['foo', 'Foo_Bar', 'foo bar', 'a.b-c'])
+def test_safe_name(name):
+    from humpty import safe_name
+    import pkg_resources
+    assert safe_name(name) == pkg_resources.safe_name(name)
+
+
+@pytest.mark.parametrize('version', [
+    '1.0', '1.0.post1', '2!1.0rc1.dev3', '1.0+local.7',
+    '1.0-1', '1.01', '1.0.RC1', 'not a version',
+    ])
+def test_safe_version(version):
+    from humpty import safe_version
+    import pkg_resources
+    assert safe_version(version) == pkg_resources.safe_version(version)
+
+
+def test_to_filename():
+    from humpty import to_filename
+    assert to_filename('foo-bar') == 'foo_bar'
+
+
+def test_yield_lines():
+    from humpty import yield_lines
+    lines = ["  a\n\n# comment\n b ", ["c", ["d\n"]]]
+    assert list(yield_lines(lines)) == ['a', 'b', 'c', 'd']
+
+
+def test_split_sections():
+    from humpty import split_sections
+    content = "a\n[foo]\nb\nc\n[ bar ]\n[baz]\nd\n"
+    assert list(split_sections(content)) == [
+        (None, ['a']),
+        ('foo', ['b', 'c']),
+        ('bar', []),
+        ('baz', ['d']),
+        ]
+
+
+def test_split_sections_bad_heading():
+    from humpty import split_sections
+    with pytest.raises(ValueError):
+        list(split_sections("[foo"))
+
+
+def test_no_heavy_imports():
+    # Importing humpty should be quick
+    script = (
+        "import sys, humpty\n"
+        "heavy = ['pkg_resources', 'distlib.wheel', 'distlib.metadata',\n"
+        "         'distlib.markers']\n"
+        "print(' '.join(mod for mod in heavy if mod in sys.modules))\n"
+        )
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [os.path.dirname(os.path.dirname(os.path.abspath(__file__)))]
+        + sys.path)
+    output = subprocess.check_output([sys.executable, '-c', script], env=env)
+    assert output.decode('ascii').strip() == ''
+
+
 def test_unsplit_sections():
     from humpty import unsplit_sections
     content = unsplit_sections([
@@ -68,6 +320,28 @@ def test_join_lines():
     assert join_lines([u'ø']) == b'\xc3\xb8\n'
 
 
+@pytest.mark.parametrize('value, expected', [
+    (None, 315532800),
+    ('', 315532800),
+    ('0', 315532800),
+    ('1700000000', 1700000000),
+    ])
+def test_source_date_epoch(monkeypatch, value, expected):
+    from humpty import source_date_epoch
+    if value is None:
+        monkeypatch.delenv('SOURCE_DATE_EPOCH', raising=False)
+    else:
+        monkeypatch.setenv('SOURCE_DATE_EPOCH', value)
+    assert source_date_epoch() == expected
+
+
+def test_source_date_epoch_invalid(monkeypatch):
+    from humpty import source_date_epoch
+    monkeypatch.setenv('SOURCE_DATE_EPOCH', 'yesterday')
+    with pytest.raises(ValueError):
+        source_date_epoch()
+
+
 def test_bytes():
     from humpty import bytes_
     all_bytes = b''.join(map(int2byte, range(256)))
@@ -76,6 +350,92 @@ def test_bytes():
     assert bytes_(chars256) == all_bytes
 
 
+# A python version which is not the running one
+FOREIGN_PYTHON_VERSION = '2.7' if PY3 else '3.6'
+
+
+def test_marker_context():
+    from humpty import marker_context
+    assert marker_context(None) is None
+    assert marker_context('%d.%d' % sys.version_info[:2]) is None
+    assert marker_context('2.6') == {
+        'python_version': '2.6',
+        'python_full_version': '2.6.0',
+        }
+
+
+@pytest.fixture
+def parse_marker_calls(monkeypatch):
+    # Record calls to distlib's parse_marker
+    from distlib import markers
+    parse_marker = getattr(markers, 'parse_marker', None)
+    if parse_marker is None:    # pragma: NO COVER
+        pytest.skip("distlib does not have parse_marker")
+    calls = []
+
+    def wrapper(marker):
+        calls.append(marker)
+        return parse_marker(marker)
+    monkeypatch.setattr(markers, 'parse_marker', wrapper)
+    monkeypatch.setattr('humpty._marker_cache', {})
+    return calls
+
+
+def test_evaluate_marker(parse_marker_calls):
+    from humpty import evaluate_marker
+    for n in range(3):
+        assert evaluate_marker(u"extra == 'a'", {'extra': 'a'})
+        assert not evaluate_marker(u"extra == 'a'", {'extra': 'b'})
+        assert evaluate_marker(u"python_version > '1'")
+        assert not evaluate_marker(u"python_version > '1'",
+                                   {'python_version': '0.9'})
+    assert parse_marker_calls == [u"extra == 'a'", u"python_version > '1'"]
+
+
+@pytest.mark.parametrize('marker', [
+    u"extra == 'a' garbage",
+    u"extra ==",
+    ])
+def test_evaluate_marker_syntax_error(marker):
+    from humpty import evaluate_marker
+    with pytest.raises(SyntaxError):
+        evaluate_marker(marker)
+
+
+def test_evaluate_marker_comment():
+    from humpty import evaluate_marker
+    assert evaluate_marker(u"extra == 'a' # comment", {'extra': 'a'})
+
+
+def test_compile_marker_cache_bounded(monkeypatch):
+    from humpty import compile_marker, _marker_cache
+    monkeypatch.setattr('humpty.MARKER_CACHE_SIZE', 2)
+    _marker_cache.clear()
+    for n in range(5):
+        compile_marker(u"python_version >= '%d'" % n)
+    assert len(_marker_cache) <= 2
+
+
+@pytest.mark.parametrize('marker, expected', [
+    (u"extra == 'a'", {'a'}),
+    (u'"a" == extra', {'a'}),
+    (u"extra == 'a' or extra != 'b'", {'a', 'b'}),
+    (u"(extra == 'a') and sys_platform == 'x'", {'a'}),
+    (u"sys_platform == 'x'", set()),
+    (u"extra in 'abc'", None),
+    (u"extra == sys_platform", None),
+    (u"extra", None),
+    (u"extra == 'a' garbage", None),
+    ])
+def test_marker_extras(marker, expected):
+    from humpty import marker_extras
+    try:
+        from distlib.markers import parse_marker  # noqa: F401
+    except ImportError:         # pragma: NO COVER
+        pytest.skip("distlib does not have parse_marker")
+    assert marker_extras(marker) == expected
+
+
 class DummyWheelMetadata(object):
     exports = {}
     namespaces = []
@@ -153,6 +513,25 @@ class EggInfoTestBase(object):
             'Platform: UNKNOWN',
             ]
 
+    @pytest.mark.parametrize('name', [
+        'pkg_info', 'top_level', 'native_libs', 'entry_points',
+        'namespace_packages', 'eager_resources', 'requires',
+        ])
+    def test_metadata_cached(self, egg_info, name):
+        assert getattr(egg_info, name) is getattr(egg_info, name)
+
+    def test_index_data_computed_once(self, egg_info, monkeypatch):
+        calls = []
+        get_index_data = egg_info._get_index_data
+
+        def _get_index_data():
+            calls.append(None)
+            return get_index_data()
+        monkeypatch.setattr(egg_info, '_get_index_data', _get_index_data)
+        list(egg_info.files())
+        list(egg_info.files())
+        assert len(calls) == 1
+
     def test_pkg_info_download_url(self, egg_info, index_data):
         index_data['download_url'] = 'http://example.org'
         assert 'Download-URL: http://example.org' in egg_info.pkg_info
@@ -255,6 +634,31 @@ class TestEggInfo_Legacy(EggInfoTestBase):
             ('addon', ['bar', 'baz']),
             ]
 
+    def test_requires_rfc822_other_extras(self, egg_info, wheel_metadata):
+        wheel_metadata.run_requires = [
+            u"foo ; extra != 'a'",
+            u"bar ; extra == 'b' or extra == 'c'",
+            u"baz ; extra != 'a' and sys_platform == 'goober'",
+            u"qux ; extra == platform_machine",
+            ]
+        wheel_metadata.extras = ['a', 'b', 'c']
+        assert egg_info.requires == [
+            (None, ['foo']),
+            ('b', ['bar']),
+            ('c', ['bar']),
+            ]
+
+    def test_requires_rfc822_each_marker_once(self, egg_info, wheel_metadata,
+                                              parse_marker_calls):
+        wheel_metadata.extras = ['x%d' % n for n in range(20)]
+        wheel_metadata.run_requires = [
+            u"req%d ; extra == 'x%d'" % (n, n % 20) for n in range(100)
+            ]
+        requires = dict(egg_info.requires)
+        assert requires['x3'] == ['req3', 'req23', 'req43', 'req63', 'req83']
+        assert sorted(parse_marker_calls) == sorted(
+            u"extra == 'x%d'" % n for n in range(20))
+
     def test_requires_json(self, egg_info, wheel_metadata):
         wheel_metadata._legacy = None
         wheel_metadata.run_requires = [
@@ -276,6 +680,27 @@ class TestEggInfo_Legacy(EggInfoTestBase):
             ('addon', ['bar', 'baz']),
             ]
 
+    @pytest.mark.parametrize('legacy', [True, False])
+    def test_requires_marker_context(self, wheel_metadata, installed_files,
+                                     metadata_files, legacy):
+        from humpty import EggInfo_Legacy, marker_context
+        if legacy:
+            wheel_metadata.run_requires = [
+                u"old ; python_version < '3'",
+                u"new ; python_version >= '3'",
+                ]
+        else:
+            wheel_metadata._legacy = None
+            wheel_metadata.run_requires = [
+                {'requires': ["old"], 'environment': "python_version < '3'"},
+                {'requires': ["new"], 'environment': "python_version >= '3'"},
+                ]
+        for python_version, expected in [('2.6', 'old'), ('3.0', 'new')]:
+            egg_info = EggInfo_Legacy(
+                wheel_metadata, installed_files, metadata_files,
+                marker_context=marker_context(python_version))
+            assert egg_info.requires == [(None, [expected])]
+
 
 class TestEggInfo(EggInfoTestBase):
     @pytest.fixture
@@ -356,23 +781,27 @@ class DummyWheel(object):
 
 
 @pytest.fixture
-def wheel_files():
+def wheel_version():
+    return '1.0'
+
+
+@pytest.fixture
+def wheel_files(wheel_version):
     return {
         'mod.py': b'# mod.py\n',
         'pkg/mod2.py': b"# mod2.py\n",
         'distname-1.0.data/purelib/mod3.py': b"# mod3.py\n",
         'distname-1.0.data/platlib/ext' + EXT_SUFFIX: b"",
         'distname-1.0.data/other/junk.txt': b"Junk\n",
-        'distname-1.0.dist-info/WHEEL': b"Wheel-Version: 1.0\n",
-        'distname-1.0.dist-info/METADATA': b"Metadata-Version: 2.0\n",
+        'distname-1.0.dist-info/WHEEL': (
+            b"Wheel-Version: " + wheel_version.encode('ascii') + b"\n"),
+        'distname-1.0.dist-info/METADATA': (
+            b"Metadata-Version: 2.0\n"
+            b"Name: distname\n"
+            b"Version: 1.0\n"),
         }
 
 
-@pytest.fixture
-def wheel_version():
-    return '1.0'
-
-
 @pytest.fixture
 def wheel_is_mountable():
     return True
@@ -395,9 +824,239 @@ def dummy_wheel(tmpdir, wheel_files, wheel_version, wheel_is_mountable):
         metadata=DummyWheelMetadata())
 
 
-def test_list_installed_files(dummy_wheel):
+@pytest.fixture
+def wheel_archive(dummy_wheel):
+    from humpty import WheelArchive
+    archive = WheelArchive(dummy_wheel)
+    yield archive
+    archive.close()
+
+
+class TestWheelArchive(object):
+    @pytest.fixture
+    def record(self):
+        return None
+
+    @pytest.fixture(params=[False, True], ids=['read', 'mmap'])
+    def wheel_archive(self, dummy_wheel, request):
+        from humpty import WheelArchive
+        archive = WheelArchive(dummy_wheel, use_mmap=request.param)
+        assert (archive.mmap is not None) == request.param
+        yield archive
+        archive.close()
+
+    @pytest.fixture
+    def wheel_files(self, wheel_files, record):
+        import base64
+        import hashlib
+        if record is None:
+            record = []
+            for path, content in sorted(wheel_files.items()):
+                digest = base64.urlsafe_b64encode(
+                    hashlib.sha256(content).digest()).rstrip(b'=')
+                record.append("%s,sha256=%s,%d" % (
+                    path, digest.decode('ascii'), len(content)))
+            record.append('distname-1.0.dist-info/RECORD,,')
+        wheel_files['distname-1.0.dist-info/RECORD'] = (
+            '\n'.join(record) + '\n').encode('utf-8')
+        return wheel_files
+
+    def test_namelist(self, wheel_archive, wheel_files):
+        assert sorted(wheel_archive.namelist) == sorted(wheel_files)
+
+    def test_metadata_files_cached(self, wheel_archive):
+        assert wheel_archive.metadata_files is wheel_archive.metadata_files
+        assert wheel_archive.metadata_files['WHEEL'] \
+            == b"Wheel-Version: 1.0\n"
+
+    def test_info(self, wheel_archive):
+        assert wheel_archive.info['Wheel-Version'] == '1.0'
+
+    def test_metadata(self, wheel_archive):
+        assert wheel_archive.metadata.name == 'distname'
+        assert wheel_archive.metadata.version == '1.0'
+
+    def test_metadata_missing(self, wheel_archive):
+        wheel_archive.metadata_files.pop('METADATA')
+        with pytest.raises(ValueError):
+            wheel_archive.metadata
+
+    def test_verify(self, wheel_archive):
+        wheel_archive.verify()
+
+    @pytest.mark.parametrize('record', [
+        ['mod.py,,3'],
+        ['mod.py,sha256=bad,'],
+        ])
+    def test_verify_mismatch(self, wheel_archive, record):
+        from distlib import DistlibException
+        with pytest.raises(DistlibException):
+            wheel_archive.verify()
+
+    def test_verify_missing_record(self, wheel_archive):
+        from distlib import DistlibException
+        del wheel_archive.records['mod.py']
+        with pytest.raises(DistlibException):
+            wheel_archive.verify()
+
+    @pytest.mark.parametrize('record', [['mod.py,sha256=bad,']])
+    @pytest.mark.parametrize('how', ['read', 'iter_content', 'iter_raw'])
+    def test_verify_reads(self, wheel_archive, record, how):
+        from distlib import DistlibException
+        wheel_archive.verify_reads = True
+        zinfo = wheel_archive.zipfile.getinfo('mod.py')
+        with pytest.raises(DistlibException):
+            if how == 'read':
+                wheel_archive.read(zinfo)
+            else:
+                list(getattr(wheel_archive, how)(zinfo))
+        assert 'mod.py' not in wheel_archive.verified
+
+    def test_verify_without_digests(self, wheel_archive):
+        wheel_archive.records['mod.py'][1] = 'sha256=bad'
+        wheel_archive.verify_digests = False
+        wheel_archive.verify()
+        assert set(wheel_archive.verified) == set(wheel_archive.namelist)
+
+    def test_verify_without_digests_checks_raw_crc(self, wheel_archive):
+        from copy import copy
+        from zipfile import BadZipfile
+        wheel_archive.verify_reads = True
+        wheel_archive.verify_digests = False
+        zinfo = copy(wheel_archive.zipfile.getinfo('mod.py'))
+        zinfo.CRC ^= 1
+        with pytest.raises(BadZipfile):
+            list(wheel_archive.iter_raw(zinfo))
+        assert 'mod.py' not in wheel_archive.verified
+
+    def test_verify_without_digests_checks_size(self, wheel_archive):
+        from distlib import DistlibException
+        wheel_archive.records['mod.py'][2] = '1'
+        wheel_archive.verify_digests = False
+        with pytest.raises(DistlibException):
+            wheel_archive.verify()
+
+    def test_verify_skips_verified(self, wheel_archive, monkeypatch):
+        wheel_archive.verify_reads = True
+        zinfo = wheel_archive.zipfile.getinfo('mod.py')
+        wheel_archive.read(zinfo)
+        assert 'mod.py' in wheel_archive.verified
+
+        read = []
+        iter_content = wheel_archive._iter_content
+
+        def _iter_content(zinfo, bufsize):
+            read.append(zinfo.filename)
+            return iter_content(zinfo, bufsize)
+        monkeypatch.setattr(wheel_archive, '_iter_content', _iter_content)
+        wheel_archive.verify()
+        assert 'mod.py' not in read
+        assert set(wheel_archive.verified) == set(wheel_archive.namelist)
+
+    def test_sha256(self, wheel_archive, dummy_wheel):
+        import hashlib
+        path = os.path.join(dummy_wheel.dirname, dummy_wheel.filename)
+        with open(path, 'rb') as fp:
+            expected = hashlib.sha256(fp.read()).hexdigest()
+        assert wheel_archive.sha256 == expected
+
+    def test_context_manager(self, dummy_wheel):
+        from humpty import WheelArchive
+        with WheelArchive(dummy_wheel) as archive:
+            pass
+        assert archive.fp.closed
+
+    def test_close_unmaps(self, dummy_wheel):
+        from humpty import WheelArchive
+        with WheelArchive(dummy_wheel, use_mmap=True) as archive:
+            mapping = archive.mmap
+            archive.read(archive.infolist[0])
+        assert mapping.closed
+        assert archive.mmap is None
+
+    def test_mmap_fileobj(self, dummy_wheel):
+        from humpty import WheelArchive
+        path = os.path.join(dummy_wheel.dirname, dummy_wheel.filename)
+        with open(path, 'rb') as fp:
+            archive = WheelArchive(dummy_wheel, BytesIO(fp.read()),
+                                   use_mmap=True)
+        # In-memory files can not be mapped
+        assert archive.mmap is None
+        archive.verify()
+        archive.close()
+
+
+class TestWheelArchiveContent(object):
+    content = {
+        'stored.txt': (b'stored' * 1000, ZIP_STORED),
+        'deflated.txt': (b'deflated' * 100000, ZIP_DEFLATED),
+        'empty.txt': (b'', ZIP_DEFLATED),
+        }
+
+    @pytest.fixture
+    def wheel(self, tmpdir):
+        from distlib.wheel import Wheel
+        path = tmpdir.join('distname-1.0-py2.py3-none-any.whl')
+        zf = ZipFile(str(path), 'w')
+        for name, (content, compress_type) in sorted(self.content.items()):
+            zf.writestr(ZipInfo(name), content, compress_type)
+        zf.close()
+        return Wheel(str(path))
+
+    @pytest.fixture(params=[False, True], ids=['read', 'mmap'])
+    def archive(self, wheel, request):
+        from humpty import WheelArchive
+        archive = WheelArchive(wheel, use_mmap=request.param)
+        yield archive
+        archive.close()
+
+    @pytest.mark.parametrize('name', sorted(content))
+    def test_content(self, archive, name):
+        zinfo = archive.zipfile.getinfo(name)
+        expected = self.content[name][0]
+        assert archive.read(zinfo) == expected
+        chunks = list(archive.iter_content(zinfo, bufsize=4096))
+        assert all(len(chunk) <= 4096 for chunk in chunks)
+        assert b''.join(chunks) == expected
+
+    @pytest.mark.parametrize('name', sorted(content))
+    def test_iter_raw(self, archive, wheel, name):
+        from humpty import iter_raw_member
+        zinfo = archive.zipfile.getinfo(name)
+        with open(os.path.join(wheel.dirname, wheel.filename), 'rb') as fp:
+            expected = b''.join(iter_raw_member(fp, zinfo))
+        raw = b''.join(bytes(chunk) for chunk in archive.iter_raw(zinfo))
+        assert raw == expected
+
+    def test_bad_crc(self, wheel):
+        from zipfile import BadZipfile
+        from humpty import WheelArchive
+        path = os.path.join(wheel.dirname, wheel.filename)
+        with open(path, 'rb') as fp:
+            data = fp.read()
+        with open(path, 'wb') as fp:
+            fp.write(data.replace(b'storedstored', b'storedSTORED', 1))
+        with WheelArchive(wheel, use_mmap=True) as archive:
+            with pytest.raises(BadZipfile):
+                archive.read(archive.zipfile.getinfo('stored.txt'))
+
+    def test_truncated(self, archive):
+        zinfo = archive.zipfile.getinfo('stored.txt')
+        zinfo.compress_size += 10 ** 6
+        with pytest.raises(EOFError):
+            list(archive.iter_raw(zinfo))
+
+
+def test_installed_files_cached(wheel_archive):
     from humpty import list_installed_files
-    assert list_installed_files(dummy_wheel) == set([
+    assert wheel_archive.installed_files is wheel_archive.installed_files
+    assert wheel_archive.installed_files \
+        == list_installed_files(wheel_archive)
+
+
+def test_list_installed_files(wheel_archive):
+    from humpty import list_installed_files
+    assert list_installed_files(wheel_archive) == set([
         'mod.py',
         'pkg/mod2.py',
         'mod3.py',
@@ -405,11 +1064,11 @@ def test_list_installed_files(dummy_wheel):
         ])
 
 
-def test_read_metadata_files(dummy_wheel):
+def test_read_metadata_files(wheel_archive, wheel_files):
     from humpty import read_metadata_files
-    assert read_metadata_files(dummy_wheel) == {
-        'WHEEL': b"Wheel-Version: 1.0\n",
-        'METADATA': b"Metadata-Version: 2.0\n",
+    assert read_metadata_files(wheel_archive) == {
+        'WHEEL': wheel_files['distname-1.0.dist-info/WHEEL'],
+        'METADATA': wheel_files['distname-1.0.dist-info/METADATA'],
         }
 
 
@@ -419,18 +1078,18 @@ def test_is_zip_safe(dummy_wheel, wheel_is_mountable):
     assert is_zip_safe(dummy_wheel) is bool(wheel_is_mountable)
 
 
-def test_get_wheel_version(dummy_wheel):
+def test_get_wheel_version(wheel_archive):
     from humpty import get_wheel_version
-    assert get_wheel_version(dummy_wheel) == (1, 0)
+    assert get_wheel_version(wheel_archive) == (1, 0)
 
 
 @pytest.mark.parametrize('wheel_version, egg_info_class', [
     ('1.0', 'EggInfo_Legacy'),
     ('1.1', 'EggInfo'),
     ])
-def test_egg_metadata(dummy_wheel, egg_info_class):
+def test_egg_metadata(wheel_archive, egg_info_class):
     from humpty import egg_metadata
-    egg_info = egg_metadata(dummy_wheel)
+    egg_info = egg_metadata(wheel_archive)
     assert type(egg_info).__name__ == egg_info_class
 
 
@@ -495,11 +1154,336 @@ class TestStubLoaders(object):
         stubs = dict(stub_loaders.namespace_stubs())
         assert set(stubs) == set(['foo/__init__.py', 'foo/bar/__init__.py'])
 
+    def test_no_compile(self, egg_info, egg_name):
+        from humpty import StubLoaders
+        egg_info.namespace_packages = ['foo']
+        stub_loaders = StubLoaders(egg_info, egg_name, compile=False)
+        assert set(dict(stub_loaders)) == set(['foo/__init__.py'])
+
     def test_extension_stub_loaders(self, stub_loaders, egg_info):
         egg_info.native_libs = ['ext' + EXT_SUFFIX]
         loaders = dict(stub_loaders.extension_stub_loaders())
         assert set(loaders) == set(['ext.py'])
 
+    def test_date_time_is_even(self, egg_info):
+        from humpty import StubLoaders
+        stub_loaders = StubLoaders(egg_info, mtime=1234567891)
+        assert stub_loaders.date_time[5] % 2 == 0
+        assert 1234567889 <= stub_loaders.mtime <= 1234567891
+
+    def test_byte_compile(self, stub_loaders, egg_info, egg_name):
+        import marshal
+        from humpty import MAGIC_NUMBER
+        egg_info.namespace_packages = ['foo', 'foo.bar']
+        stubs = dict(stub_loaders)
+        for package in egg_info.namespace_packages:
+            path = posixpath.join(*package.split('.') + ['__init__.py'])
+            pyc_path, = with_byte_compiled([path]) - set([path])
+            pyc = stubs[pyc_path]
+            assert pyc.startswith(MAGIC_NUMBER)
+            header_size = (16 if sys.version_info >= (3, 7)
+                           else 12 if sys.version_info >= (3, 3)
+                           else 8)
+            code = marshal.loads(pyc[header_size:])
+            assert code.co_filename == posixpath.join(egg_name, path)
+
+    def test_byte_compile_nested_filenames(self, stub_loaders, egg_info,
+                                           egg_name):
+        import marshal
+        # Both stubs have the same source, so share a compiled template
+        egg_info.native_libs = ['ext' + EXT_SUFFIX, 'sub/ext' + EXT_SUFFIX]
+        stubs = dict(stub_loaders)
+        header_size = (16 if sys.version_info >= (3, 7)
+                       else 12 if sys.version_info >= (3, 3)
+                       else 8)
+        for path in 'ext.py', 'sub/ext.py':
+            pyc_path, = with_byte_compiled([path]) - set([path])
+            code = marshal.loads(stubs[pyc_path][header_size:])
+            bootstrap, = [const for const in code.co_consts
+                          if isinstance(const, type(code))]
+            assert bootstrap.co_name == '__bootstrap__'
+            assert bootstrap.co_filename == posixpath.join(egg_name, path)
+
+
+class TestEggCache(object):
+    @pytest.fixture
+    def max_size(self):
+        return None
+
+    @pytest.fixture
+    def cache(self, tmpdir, max_size):
+        from humpty import EggCache
+        return EggCache(str(tmpdir.join('cache')), max_size)
+
+    def make_egg(self, tmpdir, name, size=10):
+        egg = py.path.local.make_numbered_dir('src', tmpdir).join(name)
+        egg.write(b'x' * size, mode='wb')
+        return str(egg)
+
+    def test_get_missing(self, cache):
+        assert cache.get('abc', 'foo.egg') is None
+
+    def test_put_get(self, cache, tmpdir):
+        egg = self.make_egg(tmpdir, 'foo.egg')
+        cache.put(egg, 'abc')
+        cached = cache.get('abc', 'foo.egg')
+        assert cached == cache.path('abc', 'foo.egg')
+        with open(cached, 'rb') as fp:
+            assert fp.read() == b'x' * 10
+        assert cache.get('def', 'foo.egg') is None
+
+    @pytest.mark.parametrize('max_size', [25])
+    def test_evicts_least_recently_used(self, cache, tmpdir):
+        for n, digest in enumerate(['a', 'b']):
+            egg = self.make_egg(tmpdir, 'foo.egg')
+            cache.put(egg, digest)
+            os.utime(cache.path(digest, 'foo.egg'), (n, n))
+        cache.get('a', 'foo.egg')   # touch
+
+        cache.put(self.make_egg(tmpdir, 'foo.egg'), 'c')
+        assert cache.get('a', 'foo.egg') is not None
+        assert cache.get('b', 'foo.egg') is None
+        assert cache.get('c', 'foo.egg') is not None
+        assert not os.path.exists(os.path.dirname(cache.path('b', '')))
+
+    @pytest.mark.parametrize('max_size', [25])
+    def test_unzipped_egg(self, cache, tmpdir):
+        egg = py.path.local.make_numbered_dir('src', tmpdir).join('foo.egg')
+        egg.join('EGG-INFO', 'PKG-INFO').write('x' * 10, ensure=True)
+        egg.join('foo.py').write('x' * 10)
+        cache.put(str(egg), 'a')
+        cached = py.path.local(cache.get('a', 'foo.egg'))
+        assert cached.join('EGG-INFO', 'PKG-INFO').read() == 'x' * 10
+        assert [entry[1] for entry in cache.entries()] == [20]
+
+        cache.put(self.make_egg(tmpdir, 'foo.egg', 10), 'b')
+        assert cache.get('a', 'foo.egg') is None
+
+    def test_entries_skips_temporary_files(self, cache, tmpdir):
+        cache.put(self.make_egg(tmpdir, 'foo.egg'), 'a')
+        tmpfile = py.path.local(cache.path('a', 'foo.egg.tmp123.456'))
+        tmpfile.write('x')
+        assert [entry[2] for entry in cache.entries()] \
+            == [cache.path('a', 'foo.egg')]
+
+    @pytest.mark.parametrize('max_size', [15])
+    def test_evict_already_evicted(self, cache, tmpdir, monkeypatch):
+        cache.put(self.make_egg(tmpdir, 'foo.egg'), 'a')
+        entries = cache.entries()
+        # Another process evicts the egg first
+        py.path.local(cache.path('a', '')).remove()
+        monkeypatch.setattr(cache, 'entries', lambda: entries)
+        cache.put(self.make_egg(tmpdir, 'foo.egg'), 'b')
+        assert cache.get('b', 'foo.egg') is not None
+
+    def test_put_retries(self, cache, tmpdir, monkeypatch):
+        import humpty
+        link_or_copy = humpty.link_or_copy
+        calls = []
+
+        def evicted(src, dst):
+            calls.append(dst)
+            if len(calls) == 1:
+                # Another process evicts the directory
+                os.rmdir(os.path.dirname(dst))
+            link_or_copy(src, dst)
+        monkeypatch.setattr(humpty, 'link_or_copy', evicted)
+        cache.put(self.make_egg(tmpdir, 'foo.egg'), 'a')
+        assert len(calls) == 2
+        assert cache.get('a', 'foo.egg') is not None
+
+    def test_put_gives_up(self, cache, tmpdir, monkeypatch):
+        import humpty
+        calls = []
+
+        def evicted(src, dst):
+            calls.append(dst)
+            raise OSError(errno.ENOENT, "No such file or directory")
+        monkeypatch.setattr(humpty, 'link_or_copy', evicted)
+        with pytest.raises(OSError):
+            cache.put(self.make_egg(tmpdir, 'foo.egg'), 'a', retries=2)
+        assert len(calls) == 3
+
+    def test_get_error(self, cache, tmpdir, monkeypatch):
+        cache.put(self.make_egg(tmpdir, 'foo.egg'), 'a')
+
+        def utime(path, times):
+            raise OSError(errno.EACCES, "Permission denied")
+        monkeypatch.setattr(os, 'utime', utime)
+        with pytest.raises(OSError):
+            cache.get('a', 'foo.egg')
+
+    def test_concurrent_use(self, tmpdir):
+        directory = str(tmpdir.join('cache'))
+        egg = self.make_egg(tmpdir, 'foo.egg')
+        pool = multiprocessing.Pool(4)
+        try:
+            pool.map(_use_cache, [(directory, egg, n) for n in range(8)])
+        finally:
+            pool.close()
+            pool.join()
+        from humpty import EggCache
+        assert sum(entry[1] for entry in EggCache(directory).entries()) <= 30
+
+
+def _use_cache(args):
+    from humpty import EggCache
+    directory, egg, n = args
+    cache = EggCache(directory, 30)
+    for i in range(50):
+        digest = str((n + i) % 7)
+        cache.put(egg, digest)
+        cache.get(digest, 'foo.egg')
+
+
+def test_ignore_errors():
+    from humpty import ignore_errors
+    with ignore_errors(errno.ENOENT, errno.EEXIST):
+        raise OSError(errno.EEXIST, "File exists")
+    with pytest.raises(OSError):
+        with ignore_errors(errno.ENOENT):
+            raise OSError(errno.EEXIST, "File exists")
+
+
+def test_replace_path(tmpdir):
+    from humpty import replace_path
+    src = tmpdir.join('src')
+    src.join('a').write('new', ensure=True)
+    dst = tmpdir.join('dst')
+    dst.write('old')
+    replace_path(str(src), str(dst))
+    assert dst.join('a').read() == 'new'
+
+    src.write('newer')
+    replace_path(str(src), str(dst))
+    assert dst.read() == 'newer'
+    assert tmpdir.listdir() == [dst]
+
+
+def test_link_or_copy_tree(tmpdir):
+    from humpty import link_or_copy
+    src = tmpdir.join('src')
+    src.join('sub', 'a').write('content', ensure=True)
+    dst = tmpdir.join('dst')
+    dst.join('b').write('old', ensure=True)
+    link_or_copy(str(src), str(dst))
+    assert dst.join('sub', 'a').read() == 'content'
+    assert not dst.join('b').exists()
+    assert len(tmpdir.listdir()) == 2
+
+
+class TestConversionStats(object):
+    @pytest.fixture
+    def stats(self):
+        from humpty import ConversionStats
+
+        class Stats(ConversionStats):
+            now = 0.0
+            events = []
+
+            def clock(self):
+                return self.now
+
+            def phase_started(self, name):
+                self.events.append(('start', name))
+
+            def phase_finished(self, name, seconds):
+                self.events.append(('finish', name, seconds))
+
+        return Stats()
+
+    def test_nested_phases(self, stats):
+        with stats.phase('outer'):
+            stats.now += 1
+            with stats.phase('inner'):
+                stats.now += 2
+            stats.now += 4
+            with stats.phase('inner'):
+                stats.now += 8
+        assert stats.times == {'outer': 5, 'inner': 10}
+        assert list(stats.times) == ['outer', 'inner']
+        assert stats.total == 15
+        assert stats.events == [
+            ('start', 'outer'),
+            ('start', 'inner'),
+            ('finish', 'inner', 2),
+            ('start', 'inner'),
+            ('finish', 'inner', 8),
+            ('finish', 'outer', 15),
+            ]
+
+    def test_count(self, stats):
+        stats.count('files')
+        stats.count('bytes', 10)
+        stats.count('files')
+        assert stats.as_dict() == {
+            'seconds': 0,
+            'phases': {},
+            'counters': {'files': 2, 'bytes': 10},
+            }
+
+    def test_cancel(self, stats):
+        from humpty import ConversionCancelled
+        with stats.phase('outer'):
+            stats.cancel()
+            with pytest.raises(ConversionCancelled):
+                with stats.phase('inner'):
+                    pass  # pragma: NO COVER
+        assert 'inner' not in stats.times
+
+
+def test_sum_stats():
+    from humpty import sum_stats
+    stats = {'seconds': 1.0, 'phases': {'a': 1.0}, 'counters': {'n': 2}}
+    assert sum_stats([stats, stats]) == {
+        'seconds': 2.0, 'phases': {'a': 2.0}, 'counters': {'n': 4}}
+
+
+def test_format_stats():
+    from humpty import format_stats
+    lines = format_stats({'seconds': 0.5,
+                          'phases': {'a': 0.1, 'b': 0.4},
+                          'counters': {'files': 3}})
+    assert [line.split() for line in lines] == [
+        ['total', '500.0ms'],
+        ['b', '400.0ms'],
+        ['a', '100.0ms'],
+        ['files', '3'],
+        ]
+
+
+def test_find_wheels(tmpdir):
+    from humpty import find_wheels
+    for path in ['b.whl', 'a.whl', 'c.txt', 'sub/d.whl', 'sub/e.zip']:
+        tmpdir.join(path).write('', ensure=True)
+
+    def found(**kwargs):
+        return [os.path.relpath(path, str(tmpdir))
+                for path in find_wheels(str(tmpdir), **kwargs)]
+
+    assert found() == ['a.whl', 'b.whl']
+    assert found(recursive=True) == ['a.whl', 'b.whl',
+                                     os.path.join('sub', 'd.whl')]
+    assert found(recursive=True, patterns=['*.zip', 'b*']) \
+        == ['b.whl', os.path.join('sub', 'e.zip')]
+
+
+def test_read_wheel_list():
+    from humpty import read_wheel_list
+    fp = StringIO(u"a.whl\n\n# comment\n  b c.whl  \n")
+    assert list(read_wheel_list(fp)) == ['a.whl', 'b c.whl']
+
+
+def test_link_or_copy(tmpdir):
+    from humpty import link_or_copy
+    src = tmpdir.join('src')
+    src.write('content')
+    dst = tmpdir.join('dst')
+    dst.write('old')
+    link_or_copy(str(src), str(dst))
+    assert dst.read() == 'content'
+    assert len(tmpdir.listdir()) == 2
+
 
 def test_warner(caplog):
     # coverage
@@ -553,6 +1537,17 @@ class TestScriptCopyer(object):
         assert scripts == []
         assert len(dstdir.listdir()) == 0
 
+    def test_copy_script(self, copyer):
+        script = copyer.copy_script(b"#!python -u\nprint('Hello')\n")
+        assert script.splitlines() == [
+            b"#!%s -u" % sys.executable.encode('utf-8'),
+            b"print('Hello')",
+            ]
+
+    def test_copy_script_not_python(self, copyer):
+        script = b"#!/bin/sh\necho Hello\n"
+        assert copyer.copy_script(script) == script
+
 
 # Wheel==0.23 is the first version which supports the --python-tag
 # argument to bdist_wheel.
@@ -577,3 +1572,1045 @@ class TestEggWriter(object):
         wheel_file = packages.get_wheel('dist1')
         self.make_one(wheel_file)
         assert len(caplog.records) == 0
+
+    @pytest.mark.parametrize('dist_name', ['dist1', 'dist2'])
+    def test_streaming_matches_unpack(self, packages, tmpdir, dist_name):
+        wheel_file = packages.get_wheel(dist_name)
+        streamed = self.make_one(wheel_file).build_egg(
+            str(tmpdir.join('streamed')))
+        writer = self.make_one(wheel_file)
+        writer.streaming = False
+        unpacked = writer.build_egg(str(tmpdir.join('unpacked')))
+
+        def read_egg(egg):
+            zf = ZipFile(egg)
+            try:
+                return dict(
+                    (name, zf.read(name)) for name in zf.namelist()
+                    # hashbangs and byte-code differ in detail, and
+                    # humpty.txt records the conversion path
+                    if not name.startswith('EGG-INFO/scripts/')
+                    and not name.endswith('.pyc')
+                    and name != 'EGG-INFO/humpty.txt')
+            finally:
+                zf.close()
+
+        streamed_files = read_egg(streamed)
+        assert streamed_files == read_egg(unpacked)
+        assert not any(name.endswith('.pth') for name in streamed_files)
+
+    def test_raw_copy_matches_recompress(self, packages, tmpdir):
+        wheel_file = packages.get_wheel('extension_dist')
+        raw = self.make_one(wheel_file).build_egg(str(tmpdir.join('raw')))
+        writer = self.make_one(wheel_file)
+        writer.raw_copy = False
+        recompressed = writer.build_egg(str(tmpdir.join('recompressed')))
+
+        raw_zf = ZipFile(raw)
+        recompressed_zf = ZipFile(recompressed)
+        try:
+            assert raw_zf.testzip() is None
+            assert raw_zf.namelist() == recompressed_zf.namelist()
+            for name in raw_zf.namelist():
+                if name == 'EGG-INFO/humpty.txt':
+                    continue    # records the conversion path
+                assert raw_zf.read(name) == recompressed_zf.read(name)
+        finally:
+            raw_zf.close()
+            recompressed_zf.close()
+
+    def test_build_info(self, packages, tmpdir):
+        wheel_file = packages.get_wheel('dist1')
+        egg = self.make_one(wheel_file).build_egg(str(tmpdir))
+        zf = ZipFile(egg)
+        try:
+            build_info = zf.read('EGG-INFO/humpty.txt').decode('utf-8')
+        finally:
+            zf.close()
+        assert 'Wheel-SHA256: ' in build_info
+        assert 'Python-Version: %d.%d' % sys.version_info[:2] in build_info
+        assert 'Streaming: yes' in build_info
+        assert 'Raw-Copy: yes' in build_info
+
+    def test_skips_up_to_date(self, packages, tmpdir, caplog):
+        wheel_file = packages.get_wheel('dist1')
+        egg = self.make_one(wheel_file).build_egg(str(tmpdir))
+        os.utime(egg, (0, 0))
+
+        writer = self.make_one(wheel_file)
+        assert writer.is_up_to_date(egg)
+        assert writer.build_egg(str(tmpdir)) == egg
+        assert os.stat(egg).st_mtime == 0
+        assert 'is up to date' in caplog.text
+
+    @pytest.mark.parametrize('options', [
+        {'raw_copy': False},
+        {'streaming': False},
+        ])
+    def test_rebuilds_if_conversion_path_changes(self, packages, tmpdir,
+                                                 options):
+        from humpty import EggWriter
+        wheel_file = str(packages.get_wheel('dist1'))
+        egg = EggWriter(wheel_file).build_egg(str(tmpdir))
+        with EggWriter(wheel_file, **options) as writer:
+            assert not writer.is_up_to_date(egg)
+
+    def test_force(self, packages, tmpdir):
+        wheel_file = packages.get_wheel('dist1')
+        egg = self.make_one(wheel_file).build_egg(str(tmpdir))
+        os.utime(egg, (0, 0))
+
+        self.make_one(wheel_file).build_egg(str(tmpdir), force=True)
+        assert os.stat(egg).st_mtime != 0
+
+    def test_rebuilds_if_humpty_version_changes(self, packages, tmpdir,
+                                                monkeypatch):
+        wheel_file = packages.get_wheel('dist1')
+        writer = self.make_one(wheel_file)
+        egg = writer.build_egg(str(tmpdir))
+        assert writer.is_up_to_date(egg)
+        monkeypatch.setattr('humpty.__version__', 'x.y')
+        assert not writer.is_up_to_date(egg)
+
+    def test_not_up_to_date_if_not_an_egg(self, packages, tmpdir):
+        writer = self.make_one(packages.get_wheel('dist1'))
+        egg = tmpdir.join('junk.egg')
+        assert not writer.is_up_to_date(str(egg))
+        egg.write('junk')
+        assert not writer.is_up_to_date(str(egg))
+
+    def test_cache(self, packages, tmpdir, caplog):
+        from humpty import EggCache, EggWriter
+        cache = EggCache(str(tmpdir.join('cache')))
+        wheel_file = str(packages.get_wheel('dist1'))
+        egg1 = EggWriter(wheel_file, cache=cache).build_egg(
+            str(tmpdir.join('dist1')))
+        assert 'from cache' not in caplog.text
+
+        egg2 = EggWriter(wheel_file, cache=cache).build_egg(
+            str(tmpdir.join('dist2')))
+        assert 'from cache' in caplog.text
+        with open(egg1, 'rb') as fp1, open(egg2, 'rb') as fp2:
+            assert fp1.read() == fp2.read()
+
+    def test_cache_failure(self, packages, tmpdir, caplog, monkeypatch):
+        from humpty import EggCache, EggWriter
+        cache = EggCache(str(tmpdir.join('cache')))
+
+        def fail(*args):
+            raise OSError(errno.EACCES, "Permission denied")
+        monkeypatch.setattr(cache, 'put', fail)
+        wheel_file = str(packages.get_wheel('dist1'))
+        egg = EggWriter(wheel_file, cache=cache).build_egg(
+            str(tmpdir.join('dist')))
+        assert os.path.isfile(egg)
+        assert 'Can not add' in caplog.text
+
+        monkeypatch.setattr(cache, 'get', fail)
+        egg = EggWriter(wheel_file, cache=cache).build_egg(
+            str(tmpdir.join('dist2')))
+        assert os.path.isfile(egg)
+        assert 'Can not copy' in caplog.text
+
+    def test_no_partial_egg_on_failure(self, packages, tmpdir, monkeypatch):
+        writer = self.make_one(packages.get_wheel('dist1'))
+
+        def copy_wheel(zf):
+            raise RuntimeError("boom")
+        monkeypatch.setattr(writer, 'copy_wheel', copy_wheel)
+
+        with pytest.raises(RuntimeError):
+            writer.build_egg(str(tmpdir))
+        assert tmpdir.listdir() == []
+
+    def egg_names(self, egg):
+        zf = ZipFile(egg)
+        try:
+            return set(zf.namelist())
+        finally:
+            zf.close()
+
+    @pytest.mark.parametrize('legacy_pyc', [False, True])
+    def test_compile(self, packages, tmpdir, legacy_pyc):
+        from humpty import EggWriter, pyc_arcname
+        wheel_file = str(packages.get_wheel('dist1'))
+        writer = EggWriter(wheel_file, compile=True, legacy_pyc=legacy_pyc)
+        names = self.egg_names(writer.build_egg(str(tmpdir)))
+        assert pyc_arcname('dist1.py', legacy_pyc) in names
+
+    def test_no_compile(self, packages, tmpdir):
+        from humpty import EggWriter
+        wheel_file = str(packages.get_wheel('dist1'))
+        writer = EggWriter(wheel_file, compile=False)
+        names = self.egg_names(writer.build_egg(str(tmpdir)))
+        assert not any(name.endswith('.pyc') for name in names)
+
+    def test_compile_failure(self, packages, tmpdir, caplog, monkeypatch):
+        from humpty import EggWriter
+        monkeypatch.setattr('humpty.compile_pyc',
+                            lambda *args: 1 / 0)
+        wheel_file = str(packages.get_wheel('dist1'))
+        writer = EggWriter(wheel_file, compile=True)
+        names = self.egg_names(writer.build_egg(str(tmpdir)))
+        assert 'dist1.py' in names
+        assert not any(name.endswith('.pyc') for name in names)
+        assert 'Byte-compilation of dist1.py failed' in caplog.text
+
+    def test_parallel_compile(self, packages, tmpdir, monkeypatch):
+        from humpty import EggWriter
+        # Stub loaders are compiled with the current time
+        monkeypatch.setattr('time.time', lambda: 1500000000.0)
+        wheel_file = str(packages.get_wheel('dist2'))
+        serial = EggWriter(wheel_file, compile=True).build_egg(
+            str(tmpdir.join('serial')))
+        parallel = EggWriter(wheel_file, compile=True,
+                             compile_workers=2).build_egg(
+            str(tmpdir.join('parallel')))
+        serial_zf = ZipFile(serial)
+        parallel_zf = ZipFile(parallel)
+        try:
+            assert serial_zf.namelist() == parallel_zf.namelist()
+            for name in serial_zf.namelist():
+                assert serial_zf.read(name) == parallel_zf.read(name)
+        finally:
+            serial_zf.close()
+            parallel_zf.close()
+
+    def compress_types(self, egg):
+        zf = ZipFile(egg)
+        try:
+            assert zf.testzip() is None
+            return dict((zinfo.filename, zinfo.compress_type)
+                        for zinfo in zf.infolist())
+        finally:
+            zf.close()
+
+    def test_compression_store(self, packages, tmpdir):
+        from humpty import EggWriter
+        wheel_file = str(packages.get_wheel('dist2'))
+        writer = EggWriter(wheel_file, compression='store')
+        compress_types = self.compress_types(writer.build_egg(str(tmpdir)))
+        assert set(compress_types.values()) == set([ZIP_STORED])
+
+    def test_compress_level(self, packages, tmpdir):
+        from humpty import EggWriter
+        wheel_file = str(packages.get_wheel('dist2'))
+        fast = EggWriter(wheel_file, compress_level=0).build_egg(
+            str(tmpdir.join('fast')))
+        best = EggWriter(wheel_file, compress_level=9).build_egg(
+            str(tmpdir.join('best')))
+        assert os.path.getsize(best) < os.path.getsize(fast)
+
+    def test_stores_compressed_extensions(self, packages, tmpdir):
+        from humpty import EggWriter
+        wheel_file = str(packages.get_wheel('extension_dist'))
+        writer = EggWriter(wheel_file)
+        compress_types = self.compress_types(writer.build_egg(str(tmpdir)))
+        for name, compress_type in compress_types.items():
+            if name.endswith(EggWriter.STORED_EXTENSIONS):
+                assert compress_type == ZIP_STORED
+            else:
+                assert compress_type == ZIP_DEFLATED
+        assert ZIP_STORED in compress_types.values()
+
+    @pytest.mark.parametrize('kwargs', [
+        {'compression': 'bzip2'},
+        {'compress_level': 10},
+        ])
+    def test_bad_compression(self, packages, kwargs):
+        from humpty import EggWriter
+        with pytest.raises(ValueError):
+            EggWriter(str(packages.get_wheel('dist1')), **kwargs)
+
+    def test_rebuilds_if_compression_changes(self, packages, tmpdir):
+        from humpty import EggWriter
+        wheel_file = str(packages.get_wheel('dist1'))
+        egg = EggWriter(wheel_file).build_egg(str(tmpdir))
+        writer = EggWriter(wheel_file, compression='store')
+        assert not writer.is_up_to_date(egg)
+
+    @pytest.mark.parametrize('dist_name', ['dist2', 'extension_dist'])
+    def test_unzip(self, packages, tmpdir, dist_name):
+        from humpty import EggWriter
+        wheel_file = str(packages.get_wheel(dist_name))
+        zipped = EggWriter(wheel_file).build_egg(str(tmpdir.join('zipped')))
+        writer = EggWriter(wheel_file, unzip=True)
+        unzipped = writer.build_egg(str(tmpdir.join('unzipped')))
+        assert os.path.isdir(unzipped)
+        assert writer.is_up_to_date(unzipped)
+        assert not writer.is_up_to_date(zipped)
+        assert not EggWriter(wheel_file).is_up_to_date(unzipped)
+
+        zf = ZipFile(zipped)
+        try:
+            for name in zf.namelist():
+                path = os.path.join(unzipped, *name.split('/'))
+                with open(path, 'rb') as fp:
+                    assert fp.read() == zf.read(name)
+        finally:
+            zf.close()
+        assert tmpdir.join('unzipped').listdir() == [py.path.local(unzipped)]
+
+    def test_unzip_replaces_zipped_egg(self, packages, tmpdir):
+        from humpty import EggWriter
+        wheel_file = str(packages.get_wheel('dist1'))
+        egg = EggWriter(wheel_file).build_egg(str(tmpdir))
+        assert EggWriter(wheel_file, unzip=True).build_egg(str(tmpdir)) == egg
+        assert os.path.isdir(egg)
+        assert tmpdir.listdir() == [py.path.local(egg)]
+
+    def test_unzip_from_cache(self, packages, tmpdir):
+        from humpty import EggCache, EggWriter
+        cache = EggCache(str(tmpdir.join('cache')))
+        wheel_file = str(packages.get_wheel('dist1'))
+        egg1 = EggWriter(wheel_file, cache=cache, unzip=True).build_egg(
+            str(tmpdir.join('dist1')))
+        egg2 = EggWriter(wheel_file, cache=cache, unzip=True).build_egg(
+            str(tmpdir.join('dist2')))
+        pkg_info1 = py.path.local(egg1).join('EGG-INFO', 'PKG-INFO')
+        pkg_info2 = py.path.local(egg2).join('EGG-INFO', 'PKG-INFO')
+        assert pkg_info1.read() == pkg_info2.read()
+
+    @pytest.mark.parametrize('streaming', [True, False])
+    def test_stats(self, packages, tmpdir, streaming):
+        from humpty import ConversionStats, EggWriter
+        stats = ConversionStats()
+        wheel_file = str(packages.get_wheel('dist1'))
+        writer = EggWriter(wheel_file, streaming=streaming, stats=stats)
+        egg = writer.build_egg(str(tmpdir))
+        assert writer.stats is stats
+        for phase in 'open', 'build', 'verify', 'metadata', 'egg-info':
+            assert phase in stats.times
+        if streaming:
+            assert 'copy' in stats.times
+        else:
+            assert 'install' in stats.times
+        zf = ZipFile(egg)
+        try:
+            infolist = zf.infolist()
+        finally:
+            zf.close()
+        assert stats.counters['files'] == len(infolist)
+        assert stats.counters['bytes'] == sum(
+            zinfo.file_size for zinfo in infolist)
+
+    @pytest.mark.parametrize('wheel_type', [
+        'fileobj', 'bytearray', 'memoryview',
+        pytest.param('bytes', marks=pytest.mark.skipif(
+            not PY3, reason="bytes is str under python 2")),
+        ])
+    def test_wheel_from_memory(self, packages, tmpdir, wheel_type):
+        from humpty import EggWriter
+        wheel_path = packages.get_wheel('dist1')
+        content = wheel_path.read_binary()
+        if wheel_type == 'fileobj':
+            wheel_file = BytesIO(content)
+        elif wheel_type == 'bytearray':
+            wheel_file = bytearray(content)
+        elif wheel_type == 'memoryview':
+            wheel_file = memoryview(content)
+        else:
+            wheel_file = content
+        with EggWriter(wheel_file, filename=wheel_path.basename) as writer:
+            assert writer.archive.path is None
+            egg = writer.build_egg(str(tmpdir))
+        with EggWriter(str(wheel_path)) as writer:
+            assert writer.is_up_to_date(egg)
+
+    def test_wheel_from_named_file(self, packages, tmpdir):
+        from humpty import EggWriter
+        wheel_path = packages.get_wheel('dist1')
+        with wheel_path.open('rb') as fp:
+            with EggWriter(fp) as writer:
+                egg = writer.build_egg(str(tmpdir))
+            assert not fp.closed
+        assert os.path.basename(egg).startswith('dist1-')
+
+    def test_wheel_from_fileobj_requires_filename(self, packages):
+        from humpty import EggWriter
+        content = packages.get_wheel('dist1').read_binary()
+        with pytest.raises(ValueError):
+            EggWriter(BytesIO(content))
+
+    def test_wheel_from_fileobj_requires_streaming(self, packages):
+        from humpty import EggWriter
+        wheel_path = packages.get_wheel('dist1')
+        with pytest.raises(ValueError):
+            EggWriter(BytesIO(wheel_path.read_binary()), streaming=False,
+                      filename=wheel_path.basename)
+
+    @pytest.mark.skipif(not PY3, reason="io.RawIOBase.seekable")
+    def test_wheel_from_unseekable_fileobj(self, packages):
+        from humpty import EggWriter
+        import io
+        wheel_path = packages.get_wheel('dist1')
+
+        class Unseekable(io.BytesIO):
+            def seekable(self):
+                return False
+
+        with pytest.raises(ValueError):
+            EggWriter(Unseekable(wheel_path.read_binary()),
+                      filename=wheel_path.basename)
+
+    @pytest.mark.parametrize('seekable', [
+        True,
+        pytest.param(False, marks=pytest.mark.skipif(
+            sys.version_info < (3, 5),
+            reason="ZipFile can not write unseekable streams")),
+        ])
+    def test_build_egg_file(self, packages, tmpdir, seekable):
+        from humpty import EggWriter
+        wheel_file = str(packages.get_wheel('dist1'))
+        out = BytesIO() if seekable else UnseekableWriter()
+        with EggWriter(wheel_file) as writer:
+            writer.build_egg_file(out)
+            egg = writer.build_egg(str(tmpdir))
+
+        zf = ZipFile(BytesIO(out.getvalue()))
+        assert zf.testzip() is None
+        expected = ZipFile(egg)
+        assert zf.namelist() == expected.namelist()
+        for name in zf.namelist():
+            assert zf.read(name) == expected.read(name)
+        zf.close()
+        expected.close()
+
+    def test_build_egg_file_unzip(self, packages):
+        from humpty import EggWriter
+        wheel_file = str(packages.get_wheel('dist1'))
+        with EggWriter(wheel_file, unzip=True) as writer:
+            with pytest.raises(ValueError):
+                writer.build_egg_file(BytesIO())
+
+    @pytest.fixture
+    def tampered_wheel(self, packages, tmpdir, request):
+        # A copy of dist1's wheel, with a member which does not match
+        # its RECORD
+        target = getattr(request, 'param', 'dist1.py')
+        wheel_path = packages.get_wheel('dist1')
+        tampered = tmpdir.join('src', wheel_path.basename)
+        tampered.ensure()
+        src = ZipFile(str(wheel_path))
+        dst = ZipFile(str(tampered), 'w', ZIP_DEFLATED)
+        for zinfo in src.infolist():
+            content = src.read(zinfo)
+            if zinfo.filename == target:
+                content = content.replace(b'i', b'I')
+            dst.writestr(zinfo, content, ZIP_DEFLATED)
+        dst.close()
+        src.close()
+        return str(tampered)
+
+    @pytest.mark.parametrize('tampered_wheel', [
+        'dist1.py',
+        'dist1-0.1.data/scripts/dist1_script',
+        'dist1-0.1.dist-info/entry_points.txt',
+        ], indirect=True)
+    @pytest.mark.parametrize('options', [
+        {},
+        {'compile': False},
+        {'compile': False, 'raw_copy': False},
+        {'use_mmap': True},
+        {'unzip': True},
+        {'streaming': False},
+        {'use_mmap': True},
+        {'use_mmap': True, 'raw_copy': False},
+        ])
+    def test_tampered_wheel(self, tampered_wheel, tmpdir, options):
+        from distlib import DistlibException
+        from humpty import EggWriter
+        destdir = tmpdir.join('dist')
+        # (The error must propagate through the writer's close)
+        with pytest.raises(DistlibException):
+            with EggWriter(tampered_wheel, **options) as writer:
+                writer.build_egg(str(destdir))
+        assert destdir.listdir() == []
+
+    @pytest.fixture
+    def corrupt_wheel(self, packages, tmpdir):
+        # A copy of dist1's wheel, with a byte of the compressed data of
+        # a deflated member flipped
+        wheel_path = packages.get_wheel('dist1')
+        corrupt = tmpdir.join('src', wheel_path.basename)
+        corrupt.dirpath().ensure(dir=True)
+        wheel_path.copy(corrupt)
+        with ZipFile(str(wheel_path)) as zf:
+            zinfo = zf.getinfo('dist1.py')
+        assert zinfo.compress_type == ZIP_DEFLATED
+        with open(str(corrupt), 'r+b') as fp:
+            fp.seek(zinfo.header_offset + 26)
+            name_len, extra_len = struct.unpack('<HH', fp.read(4))
+            fp.seek(name_len + extra_len + zinfo.compress_size // 2, 1)
+            byte = ord(fp.read(1))
+            fp.seek(-1, 1)
+            fp.write(int2byte(byte ^ 0x10))
+        return str(corrupt)
+
+    @pytest.mark.parametrize('verify', ['full', 'fast'])
+    @pytest.mark.parametrize('options', [
+        {},
+        {'use_mmap': True},
+        ])
+    def test_corrupt_wheel(self, corrupt_wheel, tmpdir, verify, options):
+        from distlib import DistlibException
+        from zipfile import BadZipfile
+        from humpty import EggWriter
+        destdir = tmpdir.join('dist')
+        with pytest.raises((BadZipfile, DistlibException, zlib.error)):
+            with EggWriter(corrupt_wheel, verify=verify,
+                           compile=False, **options) as writer:
+                writer.build_egg(str(destdir))
+        assert destdir.listdir() == []
+
+    @pytest.mark.parametrize('verify', ['fast', 'none'])
+    @pytest.mark.parametrize('options', [
+        {},
+        {'compile': False},
+        {'use_mmap': True},
+        ])
+    def test_unverified_tampered_wheel(self, tampered_wheel, tmpdir,
+                                       verify, options):
+        from humpty import EggWriter
+        with EggWriter(tampered_wheel, verify=verify, **options) as writer:
+            egg = writer.build_egg(str(tmpdir.join('dist')))
+            assert writer.archive.verified == (
+                set() if verify == 'none' else set(writer.archive.namelist))
+        assert os.path.isfile(egg)
+
+    def test_walk_unpacked(self, tmpdir):
+        from humpty import EggWriter
+        for path in ['b.py', 'a/z.py', 'a/b/c.py', 'a/__init__.py',
+                     'foo-nspkg.pth', 'a/foo-nspkg.pth',
+                     'foo-1.0.dist-info/RECORD', 'EGG-INFO/PKG-INFO']:
+            tmpdir.join(path).ensure()
+        libdir = str(tmpdir)
+        assert list(EggWriter.walk_unpacked(libdir)) == [
+            (arcname, os.path.join(libdir, *arcname.split('/')))
+            for arcname in ['b.py',
+                            'EGG-INFO/PKG-INFO',
+                            'a/__init__.py',
+                            'a/foo-nspkg.pth',
+                            'a/z.py',
+                            'a/b/c.py']]
+
+    def test_bad_verify_mode(self, packages):
+        from humpty import EggWriter
+        with pytest.raises(ValueError):
+            EggWriter(str(packages.get_wheel('dist1')), verify='some')
+
+    @pytest.fixture
+    def shuffled_wheel(self, packages, tmpdir):
+        # A copy of dist1's wheel, with its members in reverse order,
+        # and with different timestamps and permissions
+        wheel_path = packages.get_wheel('dist1')
+        shuffled = tmpdir.join('shuffled', wheel_path.basename)
+        shuffled.ensure()
+        src = ZipFile(str(wheel_path))
+        dst = ZipFile(str(shuffled), 'w', ZIP_DEFLATED)
+        for zinfo in reversed(src.infolist()):
+            new = ZipInfo(zinfo.filename, date_time=(2001, 2, 3, 4, 5, 6))
+            new.external_attr = 0o100600 << 16
+            dst.writestr(new, src.read(zinfo), ZIP_DEFLATED)
+        dst.close()
+        src.close()
+        return str(shuffled)
+
+    @pytest.mark.parametrize('options', [
+        {},
+        {'compile': True},
+        {'compile': True, 'legacy_pyc': True},
+        {'compile': True, 'compile_workers': 2},
+        {'streaming': False},
+        ])
+    def test_reproducible(self, packages, shuffled_wheel, tmpdir,
+                          monkeypatch, options):
+        from humpty import EggWriter, file_cm
+        monkeypatch.setenv('SOURCE_DATE_EPOCH', '1700000000')
+        # (Distlib's installer writes .pyc files unless this is set)
+        monkeypatch.setattr(sys, 'dont_write_bytecode', False)
+        wheel_file = str(packages.get_wheel('dist1'))
+        now = time.time()
+        eggs = []
+        for i, wheel_file in enumerate([wheel_file, wheel_file,
+                                        shuffled_wheel]):
+            # The time of the build should not matter
+            monkeypatch.setattr(time, 'time', lambda: now + 3600 * i)
+            with EggWriter(wheel_file, reproducible=True,
+                           **options) as writer:
+                eggs.append(writer.build_egg(str(tmpdir.join(str(i)))))
+        monkeypatch.undo()
+
+        with open(eggs[0], 'rb') as fp1, open(eggs[1], 'rb') as fp2:
+            assert fp1.read() == fp2.read()
+
+        def members(egg):
+            with file_cm(ZipFile(egg)) as zf:
+                return [(zinfo.filename, zinfo.date_time,
+                         zinfo.external_attr, zf.read(zinfo))
+                        for zinfo in zf.infolist()
+                        if zinfo.filename != 'EGG-INFO/humpty.txt']
+        # The order, timestamps and permissions of the wheel's
+        # members do not matter
+        assert members(eggs[0]) == members(eggs[2])
+        assert any(name.endswith('.pyc') for name, _, _, _ in members(eggs[0]))
+
+        with file_cm(ZipFile(eggs[0])) as zf:
+            infolist = zf.infolist()
+            build_info = zf.read('EGG-INFO/humpty.txt')
+        assert set(zinfo.date_time for zinfo in infolist) \
+            == set([time.gmtime(1700000000)[:6]])
+        assert set(zinfo.external_attr >> 16 for zinfo in infolist) \
+            == set([0o100644, 0o100755])
+        assert b'Source-Date-Epoch: 1700000000' in build_info
+
+    @pytest.fixture
+    def many_modules_wheel(self, tmpdir):
+        # A wheel with many modules, of varying sizes
+        import hashlib
+        from humpty import record_digest
+        files = [
+            ('many-1.0.dist-info/WHEEL',
+             b"Wheel-Version: 1.0\nRoot-Is-Purelib: true\n"
+             b"Tag: py2.py3-none-any\n"),
+            ('many-1.0.dist-info/METADATA',
+             b"Metadata-Version: 2.0\nName: many\nVersion: 1.0\n"),
+            ]
+        for n in range(100):
+            source = b''.join(b"def f%d(): return %d\n" % (i, i)
+                              for i in range(n % 7 * 50))
+            files.append(('many/mod%d.py' % n, source))
+        record = [
+            '%s,sha256=%s,%d' % (path, record_digest(hashlib.sha256(content)),
+                                 len(content))
+            for path, content in files]
+        record.append('many-1.0.dist-info/RECORD,,')
+        files.append(('many-1.0.dist-info/RECORD',
+                      '\n'.join(record).encode('utf-8') + b'\n'))
+        wheel = tmpdir.join('src', 'many-1.0-py2.py3-none-any.whl')
+        wheel.ensure()
+        with ZipFile(str(wheel), 'w', ZIP_DEFLATED) as zf:
+            for path, content in files:
+                zf.writestr(path, content)
+        return str(wheel)
+
+    def test_reproducible_parallel_compile(self, many_modules_wheel, tmpdir):
+        from humpty import EggWriter
+        eggs = []
+        for i, compile_workers in enumerate([1, 2, 2]):
+            with EggWriter(many_modules_wheel, reproducible=True,
+                           compile=True,
+                           compile_workers=compile_workers) as writer:
+                eggs.append(writer.build_egg(str(tmpdir.join(str(i)))))
+        contents = []
+        for egg in eggs:
+            with open(egg, 'rb') as fp:
+                contents.append(fp.read())
+        assert contents[1] == contents[0]
+        assert contents[2] == contents[0]
+
+    def test_reproducible_rebuilds(self, packages, tmpdir):
+        from humpty import EggWriter
+        wheel_file = str(packages.get_wheel('dist1'))
+        with EggWriter(wheel_file) as writer:
+            egg = writer.build_egg(str(tmpdir))
+        with EggWriter(wheel_file, reproducible=True) as writer:
+            assert not writer.is_up_to_date(egg)
+            writer.build_egg(str(tmpdir))
+            assert writer.is_up_to_date(egg)
+
+    @pytest.mark.parametrize('unzip', [False, True])
+    def test_python_version(self, packages, tmpdir, unzip):
+        from humpty import EggWriter
+        wheel_file = str(packages.get_wheel('dist1'))
+        with EggWriter(wheel_file, python_version=FOREIGN_PYTHON_VERSION,
+                       unzip=unzip) as writer:
+            assert not writer.byte_compile_modules
+            egg = writer.build_egg(str(tmpdir))
+        assert os.path.basename(egg) \
+            == 'dist1-0.1-py%s.egg' % FOREIGN_PYTHON_VERSION
+        if unzip:
+            with open(os.path.join(egg, 'EGG-INFO', 'humpty.txt')) as fp:
+                build_info = fp.read()
+            with open(os.path.join(egg, 'EGG-INFO', 'scripts',
+                                   'dist1_script')) as fp:
+                script = fp.read()
+            names = [os.path.relpath(os.path.join(dirpath, fn), egg)
+                     for dirpath, _, filenames in os.walk(egg)
+                     for fn in filenames]
+        else:
+            with ZipFile(egg) as zf:
+                build_info = zf.read('EGG-INFO/humpty.txt').decode('utf-8')
+                script = zf.read('EGG-INFO/scripts/dist1_script')
+                script = script.decode('utf-8')
+                names = zf.namelist()
+        assert 'Python-Version: %s' % FOREIGN_PYTHON_VERSION in build_info
+        assert 'Byte-Compile: none' in build_info
+        assert script.startswith('#!python%s\n' % FOREIGN_PYTHON_VERSION)
+        assert not any(name.endswith('.pyc') for name in names)
+
+    @pytest.mark.parametrize('python_version, options', [
+        ('3', {}),
+        ('3.6.1', {}),
+        (FOREIGN_PYTHON_VERSION, {'compile': True}),
+        (FOREIGN_PYTHON_VERSION, {'streaming': False}),
+        ])
+    def test_bad_python_version(self, packages, python_version, options):
+        from humpty import EggWriter
+        with pytest.raises(ValueError):
+            EggWriter(str(packages.get_wheel('dist1')),
+                      python_version=python_version, **options)
+
+    def test_retarget(self, packages, tmpdir, monkeypatch):
+        from humpty import EggWriter, WheelArchive
+        verified = []
+        _verified = WheelArchive._verified
+
+        def record_verified(self, zinfo, hasher, digest):
+            verified.append(zinfo.filename)
+            return _verified(self, zinfo, hasher, digest)
+        monkeypatch.setattr(WheelArchive, '_verified', record_verified)
+
+        wheel_file = str(packages.get_wheel('dist1'))
+        with EggWriter(wheel_file, compile=None) as writer:
+            native = writer.build_egg(str(tmpdir))
+            retargeted = writer.retarget(FOREIGN_PYTHON_VERSION)
+            assert retargeted.archive is writer.archive
+            assert retargeted.python_version == FOREIGN_PYTHON_VERSION
+            assert writer.python_version == '%d.%d' % sys.version_info[:2]
+            foreign = retargeted.build_egg(str(tmpdir))
+        assert native != foreign
+        assert os.path.isfile(native)
+        assert os.path.isfile(foreign)
+        # Each member was verified just once
+        assert sorted(verified) == sorted(set(verified))
+
+    def test_members_read_once(self, packages, tmpdir, monkeypatch):
+        from humpty import EggWriter, WheelArchive
+        wheel_file = str(packages.get_wheel('dist1'))
+        inflated = []
+        iter_content = WheelArchive._iter_content
+
+        def _iter_content(self, zinfo, bufsize):
+            inflated.append(zinfo.filename)
+            return iter_content(self, zinfo, bufsize)
+        monkeypatch.setattr(WheelArchive, '_iter_content', _iter_content)
+
+        with EggWriter(wheel_file, compile=True) as writer:
+            writer.build_egg(str(tmpdir))
+            assert set(writer.archive.verified) \
+                == set(writer.archive.namelist)
+        assert sorted(inflated) == sorted(set(inflated))
+
+    @pytest.mark.parametrize('unzip', [False, True])
+    def test_use_mmap(self, packages, tmpdir, unzip):
+        from humpty import EggWriter
+        wheel_file = str(packages.get_wheel('dist1'))
+        eggs = []
+        for use_mmap in False, True:
+            destdir = str(tmpdir.join(str(use_mmap)))
+            with EggWriter(wheel_file, use_mmap=use_mmap,
+                           unzip=unzip) as writer:
+                assert (writer.archive.mmap is not None) == use_mmap
+                eggs.append(writer.build_egg(destdir))
+        if unzip:
+            def listdir(path):
+                return sorted(os.path.relpath(os.path.join(dirpath, fn), path)
+                              for dirpath, _, filenames in os.walk(path)
+                              for fn in filenames)
+            assert listdir(eggs[0]) == listdir(eggs[1])
+        else:
+            with open(eggs[0], 'rb') as fp1, open(eggs[1], 'rb') as fp2:
+                assert fp1.read() == fp2.read()
+
+    @pytest.mark.parametrize('unzip', [False, True])
+    def test_cancel(self, packages, tmpdir, unzip):
+        from humpty import ConversionCancelled, ConversionStats, EggWriter
+
+        class Stats(ConversionStats):
+            def count(self, name, n=1):
+                ConversionStats.count(self, name, n)
+                if self.counters.get('files') == 3:
+                    self.cancel()
+
+        wheel_file = str(packages.get_wheel('dist1'))
+        writer = EggWriter(wheel_file, unzip=unzip, stats=Stats())
+        with pytest.raises(ConversionCancelled):
+            writer.build_egg(str(tmpdir))
+        assert tmpdir.listdir() == []
+
+
+def test_build_eggs_consumes_wheels_lazily(packages, tmpdir):
+    from humpty import build_eggs
+    wheel = str(packages.get_wheel('dist1'))
+    consumed = []
+
+    def wheels():
+        for n in range(20):
+            consumed.append(n)
+            yield wheel
+
+    results = build_eggs(wheels(), str(tmpdir), jobs=2)
+    first_wheel, first_egg = next(results)
+    assert first_wheel == wheel
+    assert first_egg.endswith('.egg')
+    assert len(consumed) < 20
+    assert len(list(results)) == 19
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_build_eggs_python_versions(packages, tmpdir, jobs):
+    from humpty import build_eggs
+    wheel = str(packages.get_wheel('dist1'))
+    python_versions = ['%d.%d' % sys.version_info[:2], FOREIGN_PYTHON_VERSION]
+    stats = []
+    results = list(build_eggs([wheel], str(tmpdir), jobs=jobs,
+                              python_versions=python_versions,
+                              stats_callback=lambda *args: stats.append(args)))
+    assert [wheel for wheel, egg in results] == [wheel, wheel]
+    assert [os.path.basename(egg) for wheel, egg in results] == [
+        'dist1-0.1-py%s.egg' % python_version
+        for python_version in python_versions]
+    assert len(stats) == 1
+
+
+def test_build_eggs_python_version_option(packages, tmpdir):
+    from humpty import build_eggs
+    wheel = str(packages.get_wheel('dist1'))
+    results = list(build_eggs([wheel], str(tmpdir),
+                              python_version=FOREIGN_PYTHON_VERSION))
+    assert [os.path.basename(egg) for wheel_, egg in results] == [
+        'dist1-0.1-py%s.egg' % FOREIGN_PYTHON_VERSION]
+
+
+def test_build_eggs_python_versions_failure(tmpdir):
+    from humpty import build_eggs
+    wheel = str(tmpdir.join('missing-1.0-py2.py3-none-any.whl'))
+    results = list(build_eggs([wheel], str(tmpdir),
+                              python_versions=['2.7', '3.6']))
+    assert results == [(wheel, None), (wheel, None)]
+
+
+class TestConversionServer(object):
+    @pytest.fixture
+    def socket_path(self, tmpdir):
+        return str(tmpdir.join('humpty.sock'))
+
+    @pytest.fixture
+    def server(self, socket_path, tmpdir, request):
+        from humpty import ConversionServer
+        import threading
+        server = ConversionServer(socket_path, str(tmpdir.join('dist')))
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+
+        def fin():
+            server.shutdown()
+            thread.join()
+            server.server_close()
+        request.addfinalizer(fin)
+        return server
+
+    @pytest.fixture
+    def client(self, server, socket_path, request):
+        import socket
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(socket_path)
+        request.addfinalizer(sock.close)
+        return sock.makefile('rwb')
+
+    def call(self, client, request):
+        import json
+        if not isinstance(request, bytes):
+            request = json.dumps(request).encode('utf-8')
+        client.write(request + b'\n')
+        client.flush()
+        return json.loads(client.readline().decode('utf-8'))
+
+    def test_convert(self, client, packages, tmpdir):
+        wheel = str(packages.get_wheel('dist1'))
+        response = self.call(client, {'wheel': wheel})
+        assert response['ok']
+        assert response['wheel'] == wheel
+        assert response['egg'].startswith(str(tmpdir.join('dist')))
+        assert os.path.isfile(response['egg'])
+        assert response['stats']['counters']['files'] > 0
+        assert response['seconds'] >= response['stats']['seconds']
+
+        # Several requests may be made on one connection
+        response = self.call(client, {
+            'wheel': wheel,
+            'dist_dir': str(tmpdir.join('other')),
+            'options': {'unzip': True},
+            })
+        assert response['ok']
+        assert os.path.isdir(response['egg'])
+
+    def test_python_version(self, client, packages):
+        wheel = str(packages.get_wheel('dist1'))
+        response = self.call(client, {
+            'wheel': wheel,
+            'options': {'python_version': FOREIGN_PYTHON_VERSION},
+            })
+        assert response['ok']
+        assert os.path.basename(response['egg']) \
+            == 'dist1-0.1-py%s.egg' % FOREIGN_PYTHON_VERSION
+
+    def test_failure(self, client, tmpdir):
+        bad_wheel = tmpdir.join('bad-1.0-py2.py3-none-any.whl')
+        bad_wheel.write("not a zip file")
+        response = self.call(client, {'wheel': str(bad_wheel)})
+        assert not response['ok']
+        assert response['egg'] is None
+        assert any('Failed to convert' in msg for msg in response['log'])
+
+    @pytest.mark.parametrize('request_, error', [
+        (b'{', None),
+        ([], 'request must be a JSON object'),
+        ({}, 'wheel must be a string'),
+        ({'wheel': 'foo.whl'}, 'wheel must be an absolute path'),
+        ({'wheel': '/foo.whl', 'options': {'cache': None}},
+         'unknown options: cache'),
+        ])
+    def test_bad_request(self, client, request_, error):
+        response = self.call(client, request_)
+        assert not response['ok']
+        if error is not None:
+            assert response['error'] == error
+
+    def test_busy(self, server, client):
+        for n in range(17):
+            assert server.slots.acquire(False)
+        response = self.call(client, {'wheel': '/foo.whl'})
+        assert response == {'ok': False, 'error': 'busy'}
+
+    def test_server_close_removes_socket(self, socket_path):
+        from humpty import ConversionServer
+        server = ConversionServer(socket_path)
+        assert os.path.exists(socket_path)
+        server.server_close()
+        assert not os.path.exists(socket_path)
+
+
+def test_check_socket_path(tmpdir):
+    from humpty import _check_socket_path
+    import click
+    import socket
+    socket_path = str(tmpdir.join('humpty.sock'))
+    _check_socket_path(socket_path)
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.bind(socket_path)
+        sock.listen(1)
+        with pytest.raises(click.UsageError):
+            _check_socket_path(socket_path)
+    finally:
+        sock.close()
+
+    # Stale socket is removed
+    assert os.path.exists(socket_path)
+    _check_socket_path(socket_path)
+    assert not os.path.exists(socket_path)
+
+
+@pytest.mark.skipif(sys.version_info < (3, 5, 2),
+                    reason="asyncio API requires python >= 3.5.2")
+class TestAsyncAPI(object):
+    @pytest.fixture
+    def loop(self, request):
+        import asyncio
+        loop = asyncio.new_event_loop()
+        request.addfinalizer(loop.close)
+        return loop
+
+    @pytest.fixture
+    def wheels(self, packages):
+        return [str(packages.get_wheel('dist1')),
+                str(packages.get_wheel('dist2'))]
+
+    def test_convert_wheel(self, loop, wheels, tmpdir):
+        from humpty import convert_wheel
+        egg = loop.run_until_complete(
+            convert_wheel(wheels[0], str(tmpdir), loop=loop, unzip=True))
+        assert os.path.isdir(egg)
+        assert os.path.dirname(egg) == str(tmpdir)
+
+    def test_convert_wheel_failure(self, loop, tmpdir):
+        from humpty import convert_wheel
+        bad_wheel = tmpdir.join('bad-1.0-py2.py3-none-any.whl')
+        bad_wheel.write("not a zip file")
+        with pytest.raises(Exception):
+            loop.run_until_complete(
+                convert_wheel(str(bad_wheel), str(tmpdir), loop=loop))
+
+    def test_cancel_convert_wheel(self, loop, wheels, tmpdir):
+        import asyncio
+        from concurrent.futures import ThreadPoolExecutor
+        import threading
+        from humpty import ConversionStats, convert_wheel
+
+        started = threading.Event()
+        proceed = threading.Event()
+
+        class Stats(ConversionStats):
+            def phase_started(self, name):
+                if name == 'copy':
+                    started.set()
+                    proceed.wait(10)
+
+        stats = Stats()
+        executor = ThreadPoolExecutor(1)
+        future = convert_wheel(wheels[0], str(tmpdir), stats=stats,
+                               loop=loop, executor=executor)
+        assert started.wait(10)
+        future.cancel()
+        loop.run_until_complete(asyncio.sleep(0))
+        assert stats.cancelled
+        proceed.set()
+        executor.shutdown()
+        assert tmpdir.listdir() == []
+
+    def collect(self, loop, conversions, n=None):
+        results = []
+        while n is None or len(results) < n:
+            try:
+                results.append(
+                    loop.run_until_complete(conversions.__anext__()))
+            except StopAsyncIteration:  # noqa: F821
+                break
+        return results
+
+    def test_convert_wheels(self, loop, wheels, tmpdir):
+        from humpty import convert_wheels
+        bad_wheel = tmpdir.join('bad-1.0-py2.py3-none-any.whl')
+        bad_wheel.write("not a zip file")
+        dist_dir = tmpdir.join('dist')
+        conversions = convert_wheels(wheels + [str(bad_wheel)],
+                                     str(dist_dir), concurrency=2, loop=loop)
+        assert conversions.__aiter__() is conversions
+        results = dict(self.collect(loop, conversions))
+        assert set(results) == set(wheels + [str(bad_wheel)])
+        assert results[str(bad_wheel)] is None
+        for wheel in wheels:
+            assert os.path.isfile(results[wheel])
+
+    def test_aclose(self, loop, wheels, tmpdir):
+        from humpty import convert_wheels
+        consumed = []
+
+        def iter_wheels():
+            for n in range(20):
+                consumed.append(n)
+                yield wheels[0]
+
+        conversions = convert_wheels(iter_wheels(), str(tmpdir),
+                                     concurrency=2, loop=loop)
+        assert loop.run_until_complete(conversions.__aenter__()) \
+            is conversions
+        results = self.collect(loop, conversions, 1)
+        assert len(results) == 1
+        loop.run_until_complete(conversions.__aexit__(None, None, None))
+        assert len(consumed) < 20
+        assert [path.basename for path in tmpdir.listdir()] \
+            == [os.path.basename(results[0][1])]